@@ -0,0 +1,77 @@
+"""
+SQLite setup for the project.
+
+This file builds the DATABASES entry used in config/settings.py and tunes every new SQLite connection:
+  - sqlite_database() returns the settings for one database file, with persistent connections
+    (CONN_MAX_AGE, checked with CONN_HEALTH_CHECKS) and IMMEDIATE transactions.
+  - configure_sqlite() runs on Django's connection_created signal and applies the pragmas in
+    settings.SQLITE_PRAGMAS (WAL journal, synchronous=NORMAL, busy timeout, page cache and mmap size).
+Importing this module (settings.py does) registers the signal receiver.
+"""
+
+import os
+
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+# Pragmas applied to every new SQLite connection, unless settings.SQLITE_PRAGMAS overrides them.
+DEFAULT_SQLITE_PRAGMAS = {
+    # Readers no longer block the writer (and vice versa); the setting is stored in the database file.
+    'journal_mode': 'WAL',
+    # In WAL mode NORMAL is still crash-safe for the database; only the last commits may be lost on power failure.
+    'synchronous': 'NORMAL',
+    # Milliseconds a connection waits for a lock before raising "database is locked".
+    'busy_timeout': 20000,
+    # Page cache per connection, in KiB when negative (here 20 MB).
+    'cache_size': -20000,
+    # Read the database through a memory map of up to 128 MB instead of read() calls.
+    'mmap_size': 128 * 1024 * 1024,
+    'temp_store': 'MEMORY',
+}
+
+
+def sqlite_database(path):
+    """
+    Returns the DATABASES entry for the SQLite file at `path`.
+    SHOP_DB_CONN_MAX_AGE (seconds, default 60) sets how long a connection is reused across requests;
+    0 closes it after every request, as Django does by default.
+    """
+    return {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': path,
+        'CONN_MAX_AGE': int(os.environ.get('SHOP_DB_CONN_MAX_AGE', '60')),
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': {
+            # Transactions take the write lock when they begin, so concurrent writers (e.g. checkouts)
+            # wait for each other (up to busy_timeout) instead of failing with "database is locked"
+            # when a read lock cannot be upgraded.
+            'transaction_mode': 'IMMEDIATE',
+        },
+    }
+
+
+def sqlite_pragmas():
+    """
+    Returns the pragmas to apply: settings.SQLITE_PRAGMAS, or the defaults above.
+    """
+    from django.conf import settings
+    return getattr(settings, 'SQLITE_PRAGMAS', DEFAULT_SQLITE_PRAGMAS)
+
+
+def apply_pragmas(dbapi_connection, pragmas):
+    """
+    Runs `PRAGMA name = value` for each pragma on a raw sqlite3 connection.
+    """
+    for name, value in pragmas.items():
+        dbapi_connection.execute(f'PRAGMA {name} = {value}')
+
+
+@receiver(connection_created)
+def configure_sqlite(sender, connection, **kwargs):
+    """
+    Applies the pragmas to each new SQLite connection. They run on the raw connection, so they
+    don't show up in query logs or the request profiler. With persistent connections this only
+    happens once per connection, not once per request.
+    """
+    if connection.vendor == 'sqlite':
+        apply_pragmas(connection.connection, sqlite_pragmas())
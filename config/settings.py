@@ -7,6 +7,8 @@ It controls which apps are enabled, how templates and static files are handled,
 
 import os
 
+from config.database import DEFAULT_SQLITE_PRAGMAS, sqlite_database
+
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 
@@ -43,7 +45,9 @@ CRISPY_ALLOWED_TEMPLATE_PACKS = "bootstrap5"
 CRISPY_TEMPLATE_PACK = "bootstrap5"
 
 MIDDLEWARE = [
+    'shop.profiling.ProfilingMiddleware',  # First, so its timings cover the whole middleware stack
     'django.middleware.security.SecurityMiddleware',
+    'shop.versioning.VersionCheckMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -58,13 +62,21 @@ TEMPLATES = [
     {
         'BACKEND': 'django.template.backends.django.DjangoTemplates',
         'DIRS': [os.path.join(BASE_DIR, 'templates')],  # Where to look for template files
-        'APP_DIRS': True,  # Also look for templates in each app's 'templates' folder
         'OPTIONS': {
             'context_processors': [
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
-                'shop.views.cart_context',  # Adds cart info to every template
+                'shop.caching.cache_context',  # Keys for the {% cache %} fragments
+            ],
+            # Templates are compiled once per process and kept in memory (shop/templating.py compiles them
+            # at startup). The app_directories loader replaces APP_DIRS, which can't be combined with loaders.
+            # The development server's autoreloader empties the cache when a template file changes.
+            'loaders': [
+                ('django.template.loaders.cached.Loader', [
+                    'django.template.loaders.filesystem.Loader',
+                    'django.template.loaders.app_directories.Loader',  # Each app's 'templates' folder
+                ]),
             ],
         },
     },
@@ -76,12 +88,68 @@ WSGI_APPLICATION = 'config.wsgi.application'
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
 
 DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
-    }
+    'default': sqlite_database(os.path.join(BASE_DIR, 'db.sqlite3')),
 }
 
+# Pragmas applied to every new SQLite connection (see config/database.py)
+SQLITE_PRAGMAS = DEFAULT_SQLITE_PRAGMAS
+
+# Cache
+# https://docs.djangoproject.com/en/5.2/topics/cache/
+# In-process memory by default; set SHOP_CACHE_DIR to share the cache between processes through files.
+
+if os.environ.get('SHOP_CACHE_DIR'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+            'LOCATION': os.environ['SHOP_CACHE_DIR'],
+            'OPTIONS': {'MAX_ENTRIES': 10000},
+        },
+        'sessions': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+            'LOCATION': os.path.join(os.environ['SHOP_CACHE_DIR'], 'sessions'),
+            'OPTIONS': {'MAX_ENTRIES': 100000},
+        },
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'OPTIONS': {'MAX_ENTRIES': 10000},
+        },
+        'sessions': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'sessions',
+            'OPTIONS': {'MAX_ENTRIES': 100000},
+        },
+    }
+
+# Sessions. Without SHOP_CACHE_DIR they stay in Django's db engine: every worker reads the django_session row,
+# so a change or a logout made by one worker is seen by all of them. A per-process cache in front of the rows
+# would let each worker keep serving its own stale copy (a logged-out session, an older cart).
+# With SHOP_CACHE_DIR set, the sessions cache is shared by every worker and shop/sessions.py is used: sessions are
+# read from that cache, saves that change nothing are skipped, and changes are written to the database inside the
+# request, or with SESSION_WRITE_DELAY > 0 coalesced and written at most that many seconds later, in batches.
+# Changes waiting for that write are written by a normal shutdown, but a worker killed outright (kill -9, out of
+# memory, power loss) loses them: up to SESSION_WRITE_DELAY seconds of cart clicks and messages of every visitor
+# it served.
+# Expired rows: shop/sessions.py deletes SESSION_CLEANUP_BATCH_SIZE of them at most every SESSION_CLEANUP_INTERVAL
+# seconds, after a session save, and `manage.py clearsessions` deletes the rest batch by batch. With the db engine,
+# run `manage.py clearsessions` periodically (e.g. nightly).
+SESSION_ENGINE = 'shop.sessions' if os.environ.get('SHOP_CACHE_DIR') else 'django.contrib.sessions.backends.db'
+SESSION_CACHE_ALIAS = 'sessions'
+SESSION_WRITE_DELAY = float(os.environ.get('SESSION_WRITE_DELAY', '0')) if os.environ.get('SHOP_CACHE_DIR') else 0
+SESSION_CLEANUP_INTERVAL = 300
+SESSION_CLEANUP_BATCH_SIZE = 500
+
+# Seconds a cached page (shop/caching.py) and a cached template fragment are kept.
+# Catalog changes invalidate both (within VERSION_CHECK_INTERVAL); these only bound how long unused entries linger.
+PAGE_CACHE_TIMEOUT = 600
+FRAGMENT_CACHE_TIMEOUT = 3600
+# Seconds a process keeps using its copy of the version counters (shop/versioning.py) before reading them
+# again: how long another process's catalog change can take to reach this one's cached pages.
+VERSION_CHECK_INTERVAL = 1
+
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
 
@@ -118,6 +186,12 @@ STATIC_URL = '/static/'  # URL to access static files in templates
 STATICFILES_DIRS = [os.path.join(BASE_DIR, 'static')]  # Local app static files
 STATIC_ROOT = os.path.join(BASE_DIR, 'staticfiles')
 
+# collectstatic minifies, hashes and precompresses the static files (see shop/assets.py)
+STORAGES = {
+    'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage'},
+    'staticfiles': {'BACKEND': 'shop.assets.AssetStorage'},
+}
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
@@ -125,5 +199,36 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 LOGIN_URL = '/login/'
 
+# Shop listing pagination: products per page, and the most a client may ask for with ?page_size=
+SHOP_PAGE_SIZE = 24
+SHOP_MAX_PAGE_SIZE = 96
+# Reviews shown per page on the product detail page (the rest are loaded on demand)
+REVIEWS_PAGE_SIZE = 10
+# Most products shown on the search results page
+SEARCH_RESULTS_LIMIT = 48
+# Related items shown on the product detail page
+RECOMMENDATIONS_PER_PRODUCT = 4
+# How many stale rows of its categories a product save rebuilds after committing (see shop/recommendations.py).
+RECOMMENDATION_REBUILDS_PER_SAVE = 20
+
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
+
+# Request profiling (see shop/profiling.py): the fraction of requests instrumented (0 turns it off),
+# how often the collected stats are written to the database, and how many slow queries are kept per route
+PROFILING_SAMPLE_RATE = float(os.environ.get('PROFILING_SAMPLE_RATE', '0.01'))
+PROFILING_FLUSH_INTERVAL = 60
+PROFILING_SLOW_QUERIES = 5
+
+# Product image variants (see shop/images.py): the widths generated for srcset,
+# and how many background threads resize uploads
+PRODUCT_IMAGE_WIDTHS = [320, 640, 1024]
+PRODUCT_IMAGE_WORKERS = 2
+
+# Review write-behind queue (see shop/review_queue.py): whether new reviews are queued and written in batches
+# by a background thread, the most reviews per batch, how long the writer waits for a batch to fill (seconds),
+# and how many reviews may wait before submit_review writes directly again
+REVIEW_WRITE_BEHIND = os.environ.get('REVIEW_WRITE_BEHIND', '1') == '1'
+REVIEW_QUEUE_BATCH_SIZE = 200
+REVIEW_QUEUE_FLUSH_DELAY = 0.05
+REVIEW_QUEUE_MAX_SIZE = 10000
@@ -2,6 +2,9 @@
 WSGI config for config project.
 
 It exposes the WSGI callable as a module-level variable named ``application``.
+Requests for collected static files (STATIC_ROOT, see shop/assets.py) are answered
+before they reach Django, with long-lived cache headers and precompressed copies.
+The templates are compiled before the first request (see shop/templating.py).
 
 For more information on this file, see
 https://docs.djangoproject.com/en/5.2/howto/deployment/wsgi/
@@ -14,3 +17,9 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
 
 application = get_wsgi_application()
+
+from shop.assets import StaticFilesApplication  # noqa: E402 (needs the apps loaded by get_wsgi_application)
+from shop.templating import warm_templates  # noqa: E402
+
+warm_templates()
+application = StaticFilesApplication(application)
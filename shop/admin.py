@@ -1,8 +1,161 @@
+# shop/admin.py
+# This file registers the shop models with the Django admin.
+# The changelists are built to stay fast when the tables are large (millions of reviews and orders):
+#   - list_select_related loads the users and products the rows show (their __str__ and columns)
+#     in the same query, instead of one query per row;
+#   - foreign keys to big tables are edited as raw IDs, or with autocomplete, instead of a <select>
+#     listing every user or product;
+#   - lists are ordered by primary key (newest first, like created_at) and filtered on indexed
+#     columns, so a page is read from an index instead of sorting the whole table;
+#   - product search goes through the search index (shop/search.py) instead of LIKE '%...%';
+#   - EstimatedCountPaginator replaces the exact COUNT(*) of the whole table with an estimate,
+#     and show_full_result_count = False drops the second count Django runs for filtered lists.
+
 from django.contrib import admin
-from .models import Category, Product, Review, CartItem, Order
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import Max, Q
+from django.utils.functional import cached_property
+
+from .models import CartItem, Category, Order, OrderItem, Product, Review
+from .search import search_products
+
+# Filtered and searched lists count their rows exactly up to this many; past it, the count shows this number.
+COUNT_LIMIT = 10000
+# How many products a search in the admin (or a product autocomplete) can match.
+SEARCH_LIMIT = 1000
+
+
+def estimated_row_count(queryset):
+    """
+    Returns an estimate of the number of rows in the queryset's table without counting them:
+    the planner statistics on PostgreSQL and SQLite (after ANALYZE), otherwise the largest primary key,
+    read from the primary key index (deleted rows make it an overestimate).
+    """
+    connection = connections[queryset.db]
+    table = queryset.model._meta.db_table
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute("SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass", [table])
+            row = cursor.fetchone()
+            if row and row[0] >= 0:  # -1 until the table was first analyzed
+                return row[0]
+        elif connection.vendor == 'sqlite':
+            # sqlite_stat1 only exists once ANALYZE has run; each of its rows starts with the table's row count.
+            cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'sqlite_stat1'")
+            if cursor.fetchone():
+                cursor.execute("SELECT stat FROM sqlite_stat1 WHERE tbl = %s", [table])
+                row = cursor.fetchone()
+                if row:
+                    return int(row[0].split()[0])
+    return queryset.model._default_manager.using(queryset.db).aggregate(last=Max('pk'))['last'] or 0
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Paginator that never counts a whole large table: an unfiltered list uses estimated_row_count()
+    when it is above COUNT_LIMIT, and anything else is counted exactly up to COUNT_LIMIT rows.
+    With an estimate, the last pages can come out shorter than expected, or empty.
+    """
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if not queryset.query.where:
+            estimate = estimated_row_count(queryset)
+            if estimate > COUNT_LIMIT:
+                return estimate
+        return queryset.order_by()[:COUNT_LIMIT].count()
+
+
+class LargeTableAdmin(admin.ModelAdmin):
+    """
+    Settings shared by the changelists of tables that grow without bound.
+    """
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    ordering = ('-pk',)
+
+
+def _matching_product_ids(search_term):
+    return [product.pk for product in search_products(search_term, limit=SEARCH_LIMIT)]
+
+
+# Category admin: a small table; searchable so product forms can autocomplete it.
+@admin.register(Category)
+class CategoryAdmin(admin.ModelAdmin):
+    list_display = ('name', 'slug')
+    search_fields = ('name',)
+    prepopulated_fields = {'slug': ('name',)}
+
+
+# Product admin: listed by name (product_name_id_idx), filtered by category (product_category_name_idx).
+@admin.register(Product)
+class ProductAdmin(LargeTableAdmin):
+    list_display = ('name', 'category', 'price', 'rating_avg', 'rating_count', 'updated_at')
+    list_select_related = ('category',)
+    list_filter = ('category',)
+    ordering = ('name', 'id')
+    search_fields = ('name',)
+    autocomplete_fields = ('category',)
+    raw_id_fields = ('created_by',)
+
+    def get_search_results(self, request, queryset, search_term):
+        # Also used by the product autocomplete of ReviewAdmin.
+        if not search_term.strip():
+            return queryset, False
+        return queryset.filter(pk__in=_matching_product_ids(search_term)), False
+
+
+# Review admin: search matches product names (through the search index) or an exact username.
+@admin.register(Review)
+class ReviewAdmin(LargeTableAdmin):
+    list_display = ('id', 'product', 'user', 'rating', 'created_at')
+    list_select_related = ('product', 'user')
+    list_filter = ('rating',)
+    search_fields = ('product__name', 'user__username')
+    search_help_text = "Product name, or the exact username."
+    autocomplete_fields = ('product',)
+    raw_id_fields = ('user',)
+
+    def get_search_results(self, request, queryset, search_term):
+        search_term = search_term.strip()
+        if not search_term:
+            return queryset, False
+        return queryset.filter(
+            Q(product_id__in=_matching_product_ids(search_term)) | Q(user__username=search_term)
+        ), False
+
+
+class OrderItemInline(admin.TabularInline):
+    model = OrderItem
+    extra = 0
+    raw_id_fields = ('product',)
+
+
+# Order admin: search by order number or exact username.
+@admin.register(Order)
+class OrderAdmin(LargeTableAdmin):
+    list_display = ('id', 'user', 'status', 'total', 'created_at')
+    list_select_related = ('user',)
+    list_filter = ('status',)
+    search_fields = ('=id', 'user__username__exact')
+    search_help_text = "Order number, or the exact username."
+    raw_id_fields = ('user', 'items')
+    inlines = [OrderItemInline]
+
+    def get_search_results(self, request, queryset, search_term):
+        search_term = search_term.strip()
+        if search_term.isdigit():
+            return queryset.filter(pk=int(search_term)), False
+        if not search_term:
+            return queryset, False
+        return queryset.filter(user__username=search_term), False
+
 
-admin.site.register(Category)
-admin.site.register(Product)
-admin.site.register(Review)
-admin.site.register(CartItem)
-admin.site.register(Order)
+# Cart item admin: search by exact username.
+@admin.register(CartItem)
+class CartItemAdmin(LargeTableAdmin):
+    list_display = ('user', 'product', 'quantity', 'added_at')
+    list_select_related = ('user', 'product')
+    search_fields = ('user__username__exact',)
+    raw_id_fields = ('user', 'product')
@@ -1,6 +1,15 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_migrate
 
 
 class ShopConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'shop'
+
+    def ready(self):
+        # Register the model signal receivers (cache invalidation, etc.).
+        from . import signals  # noqa: F401
+        from .recommendations import build_missing
+
+        # Products that have no recommendation row yet (e.g. right after the table was added) get one.
+        post_migrate.connect(build_missing, sender=self)
@@ -0,0 +1,284 @@
+# shop/assets.py
+# This file contains the static asset pipeline, used by `python manage.py collectstatic`, and the WSGI
+# application wrapper that serves its output.
+#
+# AssetStorage (the "staticfiles" storage in settings.STORAGES) builds on ManifestStaticFilesStorage:
+#   1. the collected CSS and JS files are minified and PNG/JPEG images are recompressed losslessly;
+#   2. every file gets a copy named after a hash of its content (style.css -> style.1a2b3c4d5e6f.css), and
+#      {% static %} links to that copy (the mapping is in STATIC_ROOT/staticfiles.json);
+#   3. text files get precompressed .gz (and .br, if the optional `brotli` package is installed) copies,
+#      and images a lossless .webp copy, kept only when they are smaller.
+# A hashed name changes whenever the content does, so those files can be cached by browsers for a year
+# without revalidation. Until collectstatic has run (development, tests), {% static %} links to the plain names.
+#
+# StaticFilesApplication wraps the WSGI application (see config/wsgi.py) and answers requests for files in
+# STATIC_ROOT before they reach Django, picking the precompressed copy the client accepts.
+
+import gzip
+import io
+import mimetypes
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+from wsgiref.util import FileWrapper
+
+from django.conf import settings
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage
+from django.utils.http import http_date, parse_http_date_safe
+from PIL import Image
+
+try:
+    import brotli
+except ImportError:  # Optional: without it only gzip copies are written
+    brotli = None
+
+# Extensions of the files that get precompressed copies (images and fonts are compressed already).
+COMPRESSIBLE = {'.css', '.js', '.json', '.svg', '.txt', '.html', '.xml', '.map'}
+IMAGES = {'.png', '.jpg', '.jpeg'}
+# Copies are only kept when they save at least this fraction of the file.
+MIN_SAVING = 0.05
+# The suffixes of the precompressed copies, by content encoding, in order of preference.
+ENCODINGS = [('br', '.br'), ('gzip', '.gz')]
+
+_CSS_STRINGS = re.compile(r'("(?:\\.|[^"\\])*"|\'(?:\\.|[^\'\\])*\')')
+_CSS_COMMENTS = re.compile(r'/\*.*?\*/', re.S)
+
+
+def minify_css(text):
+    """
+    Removes comments and the whitespace CSS does not need. Quoted strings are left untouched.
+    """
+    parts = _CSS_STRINGS.split(text)
+    for index in range(0, len(parts), 2):  # Even parts are outside strings
+        part = _CSS_COMMENTS.sub('', parts[index])
+        part = re.sub(r'\s+', ' ', part)
+        part = re.sub(r'\s*([{};,>])\s*', r'\1', part)
+        part = re.sub(r':\s+', ':', part)  # Only after the colon: "a :hover" and "a:hover" are different selectors
+        parts[index] = part.replace(';}', '}')
+    return ''.join(parts).strip()
+
+
+def minify_js(text):
+    """
+    Removes indentation, blank lines and whole-line // comments. Line breaks are kept, so automatic
+    semicolon insertion still sees the same statements, and lines inside multi-line template literals
+    are kept as they are.
+    """
+    lines = []
+    in_template = False
+    for line in text.splitlines():
+        if in_template:
+            lines.append(line)
+        else:
+            stripped = line.strip()
+            if stripped and not stripped.startswith('//'):
+                lines.append(stripped)
+        # An odd number of backticks opens or closes a template literal that spans lines.
+        if len(re.findall(r'(?<!\\)`', line)) % 2:
+            in_template = not in_template
+    return '\n'.join(lines) + '\n'
+
+
+def recompress_image(data, extension):
+    """
+    Re-encodes a PNG or JPEG without changing its pixels. Returns the new bytes, or None if they are not smaller.
+    """
+    image = Image.open(io.BytesIO(data))
+    output = io.BytesIO()
+    if extension == '.png':
+        image.save(output, 'PNG', optimize=True)
+    else:
+        # quality='keep' reuses the original quantization tables, so only the entropy coding is redone.
+        image.save(output, 'JPEG', quality='keep', optimize=True, progressive=True)
+    return output.getvalue() if output.tell() < len(data) else None
+
+
+def webp_copy(data):
+    """
+    Returns a lossless WebP encoding of an image.
+    """
+    image = Image.open(io.BytesIO(data))
+    output = io.BytesIO()
+    image.save(output, 'WEBP', lossless=True, method=6)
+    return output.getvalue()
+
+
+def compressed_copies(data):
+    """
+    Returns {suffix: bytes} of the gzip (and brotli) encodings of `data` that are worth keeping.
+    """
+    copies = {'.gz': gzip.compress(data, compresslevel=9, mtime=0)}
+    if brotli is not None:
+        copies['.br'] = brotli.compress(data, quality=11)
+    return {suffix: copy for suffix, copy in copies.items() if len(copy) <= len(data) * (1 - MIN_SAVING)}
+
+
+class AssetStorage(ManifestStaticFilesStorage):
+    """
+    ManifestStaticFilesStorage that minifies and recompresses files before hashing them,
+    and writes precompressed copies of the results.
+    """
+    def stored_name(self, name):
+        try:
+            return super().stored_name(name)
+        except ValueError:
+            # No manifest entry: collectstatic has not run (or the file is new), so link to the plain name,
+            # which the development server serves from the app and project static directories.
+            return name
+
+    def post_process(self, paths, dry_run=False, **options):
+        if dry_run:
+            yield from super().post_process(paths, dry_run, **options)
+            return
+        with ThreadPoolExecutor(max_workers=os.cpu_count()) as pool:
+            # Collected files are copies in STATIC_ROOT, so they are rewritten in place, and hashed from there
+            # rather than from their source directories.
+            list(pool.map(self._optimize, paths))
+            paths = {path: (self, path) for path in paths}
+            yield from super().post_process(paths, dry_run, **options)
+            list(pool.map(self._write_copies, paths))
+
+    def _optimize(self, name):
+        extension = os.path.splitext(name)[1].lower()
+        if extension not in ('.css', '.js') and extension not in IMAGES:
+            return
+        data = self._read(name)
+        if extension == '.css':
+            optimized = minify_css(data.decode()).encode()
+        elif extension == '.js':
+            optimized = minify_js(data.decode()).encode()
+        else:
+            optimized = recompress_image(data, extension)
+        if optimized and len(optimized) < len(data):
+            self._replace(name, optimized)
+
+    def _write_copies(self, name):
+        """
+        Writes the precompressed copies of a collected file and of its hashed copy.
+        """
+        extension = os.path.splitext(name)[1].lower()
+        if extension not in COMPRESSIBLE and extension not in IMAGES:
+            return
+        data = None
+        for target in {name, self.hashed_files.get(self.hash_key(self.clean_name(name)), name)}:
+            content = self._read(target)
+            if content != data:  # The hashed copy of a CSS file has its url()s rewritten
+                data = content
+                if extension in IMAGES:
+                    copy = webp_copy(data)
+                    copies = {'.webp': copy} if len(copy) <= len(data) * (1 - MIN_SAVING) else {}
+                else:
+                    copies = compressed_copies(data)
+            for suffix, copy in copies.items():
+                self._replace(target + suffix, copy)
+
+    def _read(self, name):
+        with self.open(name) as source:
+            return source.read()
+
+    def _replace(self, name, data):
+        with open(self.path(name), 'wb') as target:
+            target.write(data)
+
+
+def _accepts(header, token):
+    """
+    Whether an Accept or Accept-Encoding header value lists `token` with a non-zero quality.
+    """
+    for item in header.split(','):
+        value, _, params = item.strip().partition(';')
+        if value.strip().lower() == token:
+            quality = params.strip()
+            return not re.fullmatch(r'q=0(\.0*)?', quality.replace(' ', ''))
+    return False
+
+
+class StaticFile:
+    """
+    One file under STATIC_ROOT, with its precompressed copies.
+    Attributes:
+      - headers: The response headers of the file itself, without Content-Length.
+      - last_modified: Its modification time (seconds since the epoch).
+      - variants: [(request header, accepted value, headers to override, path, size), ...] of the copies
+        in order of preference, ending with the file itself.
+    """
+    def __init__(self, path, immutable):
+        stat = os.stat(path)
+        self.last_modified = int(stat.st_mtime)
+        content_type, _ = mimetypes.guess_type(path)
+        content_type = content_type or 'application/octet-stream'
+        if content_type.startswith('text/') or content_type == 'application/javascript':
+            content_type += '; charset=utf-8'
+        self.headers = [
+            ('Content-Type', content_type),
+            ('Last-Modified', http_date(self.last_modified)),
+            # A hashed name never changes content; a plain one may, so it is revalidated on every use.
+            ('Cache-Control', 'public, max-age=31536000, immutable' if immutable else 'public, no-cache'),
+        ]
+        self.variants = []
+        for encoding, suffix in ENCODINGS:
+            if os.path.exists(path + suffix):
+                self._add_variant('HTTP_ACCEPT_ENCODING', encoding, {'Content-Encoding': encoding}, path + suffix)
+        if os.path.exists(path + '.webp'):
+            self._add_variant('HTTP_ACCEPT', 'image/webp', {'Content-Type': 'image/webp'}, path + '.webp')
+        if self.variants:
+            self.headers.append(('Vary', 'Accept' if self.variants[0][0] == 'HTTP_ACCEPT' else 'Accept-Encoding'))
+        self._add_variant(None, None, {}, path)
+
+    def _add_variant(self, header, value, overrides, path):
+        self.variants.append((header, value, overrides, path, os.path.getsize(path)))
+
+    def choose(self, environ):
+        """
+        Returns (headers, path) of the copy to send for a request.
+        """
+        for header, value, overrides, path, size in self.variants:
+            if header is None or _accepts(environ.get(header, ''), value):
+                shared = dict(self.headers)
+                headers = [(name, overrides.get(name, content)) for name, content in self.headers]
+                headers += [(name, content) for name, content in overrides.items() if name not in shared]
+                return headers + [('Content-Length', str(size))], path
+
+
+class StaticFilesApplication:
+    """
+    WSGI application wrapper that serves the files collected in STATIC_ROOT and passes every
+    other request to `application`. The directory is indexed once at startup (run collectstatic
+    before starting the server); files hashed by AssetStorage are sent with a one-year immutable
+    Cache-Control, the others with Last-Modified for 304 revalidation.
+    """
+    def __init__(self, application, root=None, prefix=None):
+        self.application = application
+        self.prefix = prefix or settings.STATIC_URL
+        self.files = self._index(root or settings.STATIC_ROOT)
+
+    def _index(self, root):
+        files = {}
+        if not root or not os.path.isdir(root):
+            return files
+        hashed = self._hashed_names(root)
+        for directory, _, names in os.walk(root):
+            for name in names:
+                path = os.path.join(directory, name)
+                relative = os.path.relpath(path, root).replace(os.sep, '/')
+                files[self.prefix + relative] = StaticFile(path, relative in hashed)
+        return files
+
+    def _hashed_names(self, root):
+        storage = AssetStorage(location=root)
+        return set(storage.hashed_files.values())
+
+    def __call__(self, environ, start_response):
+        static_file = self.files.get(environ.get('PATH_INFO', ''))
+        if static_file is None or environ['REQUEST_METHOD'] not in ('GET', 'HEAD'):
+            return self.application(environ, start_response)
+        since = parse_http_date_safe(environ.get('HTTP_IF_MODIFIED_SINCE', ''))
+        if since is not None and static_file.last_modified <= since:
+            start_response('304 Not Modified', static_file.headers)
+            return []
+        headers, path = static_file.choose(environ)
+        start_response('200 OK', headers)
+        if environ['REQUEST_METHOD'] == 'HEAD':
+            return []
+        file_wrapper = environ.get('wsgi.file_wrapper', FileWrapper)
+        return file_wrapper(open(path, 'rb'))
@@ -0,0 +1,234 @@
+# shop/benchmarking.py
+# This file contains the storefront benchmark used by `python manage.py bench_storefront`.
+# It seeds a throwaway database with a synthetic catalog (categories, products, users, reviews),
+# drives the main request paths through the Django test client and measures, per route:
+#   - latency percentiles (p50/p95/p99) over many requests,
+#   - database queries per request,
+#   - peak Python memory allocated while handling a request (tracemalloc).
+# Results are plain dicts so they can be written to JSON and compared between releases.
+
+import json
+import platform
+import random
+import sqlite3
+import statistics
+import time
+import tracemalloc
+from decimal import Decimal
+
+import django
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from .models import Category, Product, Review
+from .ratings import rebuild_all_ratings
+from .recommendations import build_all
+from .search import rebuild_index
+
+# Named catalog sizes: (products, users, reviews)
+SIZES = {
+    'small': (1_000, 100, 3_000),
+    'medium': (10_000, 1_000, 30_000),
+    'large': (100_000, 10_000, 300_000),
+}
+
+CATEGORY_NAMES = ['Shirts', 'Trousers', 'Jackets', 'Dresses', 'Shoes', 'Hats', 'Bags', 'Socks']
+ADJECTIVES = ['Classic', 'Slim', 'Relaxed', 'Vintage', 'Linen', 'Denim', 'Wool', 'Cotton', 'Summer', 'Winter']
+
+# Routes in the order they are measured. Review submissions change the catalog (and so invalidate
+# cached pages), so they run last to avoid skewing the read-only routes.
+ROUTES = ['home', 'shop', 'product_detail', 'add_to_cart', 'cart', 'submit_review']
+
+_BATCH_SIZE = 2000
+
+
+def _bulk_create(model, objects):
+    model.objects.bulk_create(objects, batch_size=_BATCH_SIZE)
+
+
+def seed_catalog(products, users, reviews, seed=0):
+    """
+    Fills the (empty) database with a synthetic catalog using bulk inserts.
+    bulk_create sends no signals, so the derived data (search index, rating aggregates,
+    recommendations) is rebuilt once at the end, the same way the management commands do it.
+    Returns the elapsed seconds.
+    """
+    started = time.perf_counter()
+    rng = random.Random(seed)
+    _bulk_create(Category, [
+        Category(name=name, slug=name.lower(), description=f"All {name.lower()}") for name in CATEGORY_NAMES
+    ])
+    category_ids = list(Category.objects.values_list('id', flat=True))
+
+    user = User(username='bench-0')
+    user.set_unusable_password()
+    _bulk_create(User, [User(username=f'bench-{i}', password=user.password) for i in range(users)])
+    user_ids = list(User.objects.filter(username__startswith='bench-').values_list('id', flat=True))
+
+    _bulk_create(Product, [
+        Product(
+            name=f"{rng.choice(ADJECTIVES)} {rng.choice(CATEGORY_NAMES)[:-1]} {i}",
+            slug=f'bench-product-{i}',
+            description=f"Synthetic product {i} for benchmarking.",
+            price=Decimal(rng.randrange(500, 20000)) / 100,
+            category_id=rng.choice(category_ids),
+        )
+        for i in range(products)
+    ])
+    product_ids = list(Product.objects.values_list('id', flat=True))
+
+    batch = []
+    for i in range(reviews):
+        batch.append(Review(
+            user_id=rng.choice(user_ids),
+            product_id=rng.choice(product_ids),
+            rating=rng.randint(1, 5),
+            comment=f"Benchmark review {i}.",
+        ))
+        if len(batch) >= _BATCH_SIZE:
+            _bulk_create(Review, batch)
+            batch = []
+    if batch:
+        _bulk_create(Review, batch)
+
+    rebuild_index()
+    rebuild_all_ratings()
+    build_all()
+    return time.perf_counter() - started
+
+
+def _percentile(sorted_values, percent):
+    """
+    Returns the `percent` percentile of an already sorted list (nearest-rank method).
+    """
+    if not sorted_values:
+        return 0.0
+    rank = max(1, round(percent / 100 * len(sorted_values)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+class StorefrontBenchmark:
+    """
+    Drives the storefront routes against the seeded database.
+    Anonymous routes use one client; cart and review routes use a logged-in bench user.
+    Product pages and cart additions pick products at random (seeded, so runs are repeatable).
+    """
+    def __init__(self, seed=0):
+        self.rng = random.Random(seed)
+        self.slugs = list(Product.objects.values_list('slug', flat=True))
+        self.anonymous = Client()
+        self.customer = Client()
+        self.customer.force_login(User.objects.filter(username__startswith='bench-').first())
+
+    def _random_slug(self):
+        return self.rng.choice(self.slugs)
+
+    def request(self, route):
+        """
+        Sends one request for `route` and returns the response.
+        """
+        if route == 'home':
+            return self.anonymous.get(reverse('home'))
+        if route == 'shop':
+            return self.anonymous.get(reverse('shop'))
+        if route == 'product_detail':
+            return self.anonymous.get(reverse('product_detail', args=[self._random_slug()]))
+        if route == 'add_to_cart':
+            return self.customer.post(
+                reverse('add_to_cart', args=[self._random_slug()]), HTTP_X_REQUESTED_WITH='XMLHttpRequest',
+            )
+        if route == 'cart':
+            return self.customer.get(reverse('cart'))
+        if route == 'submit_review':
+            return self.customer.post(
+                reverse('submit_review', args=[self._random_slug()]),
+                data=json.dumps({'rating': self.rng.randint(1, 5), 'comment': "Benchmark review."}),
+                content_type='application/json',
+            )
+        raise ValueError(f"Unknown route: {route}")
+
+    def measure(self, route, requests, warmup, memory_samples):
+        """
+        Measures one route and returns its result dict.
+        Latency and query counts come from `requests` timed requests (after `warmup` untimed ones);
+        peak memory comes from a separate pass of `memory_samples` requests, because tracemalloc
+        itself slows requests down too much to time them at the same time.
+        """
+        for _ in range(warmup):
+            self.request(route)
+        latencies = []
+        queries = []
+        errors = 0
+        for _ in range(requests):
+            with CaptureQueriesContext(connection) as context:
+                started = time.perf_counter()
+                response = self.request(route)
+                latencies.append((time.perf_counter() - started) * 1000)
+            queries.append(len(context.captured_queries))
+            if response.status_code >= 400:
+                errors += 1
+        peaks = []
+        tracemalloc.start()
+        try:
+            for _ in range(memory_samples):
+                tracemalloc.reset_peak()
+                baseline = tracemalloc.get_traced_memory()[0]
+                self.request(route)
+                peaks.append(tracemalloc.get_traced_memory()[1] - baseline)
+        finally:
+            tracemalloc.stop()
+        latencies.sort()
+        return {
+            'requests': requests,
+            'errors': errors,
+            'p50_ms': round(_percentile(latencies, 50), 3),
+            'p95_ms': round(_percentile(latencies, 95), 3),
+            'p99_ms': round(_percentile(latencies, 99), 3),
+            'mean_ms': round(statistics.fmean(latencies), 3) if latencies else 0.0,
+            'queries_mean': round(statistics.fmean(queries), 2) if queries else 0.0,
+            'queries_max': max(queries, default=0),
+            'peak_memory_kb': round(max(peaks, default=0) / 1024, 1),
+        }
+
+
+def run_benchmark(routes=ROUTES, requests=200, warmup=10, memory_samples=5, seed=0):
+    """
+    Runs every route in `routes` against the current (already seeded) database with a cold cache.
+    Returns {route: result dict}.
+    """
+    cache.clear()
+    benchmark = StorefrontBenchmark(seed=seed)
+    return {route: benchmark.measure(route, requests, warmup, memory_samples) for route in routes}
+
+
+def environment():
+    """
+    Returns the versions that matter when comparing two result files.
+    """
+    return {
+        'python': platform.python_version(),
+        'django': django.get_version(),
+        'sqlite': sqlite3.sqlite_version,
+        'machine': platform.machine(),
+    }
+
+
+def compare(results, baseline, threshold):
+    """
+    Compares `results` with an earlier result file's routes. Returns a list of
+    (route, metric, old, new) for every p95 latency or mean query count that grew by more
+    than `threshold` (a fraction, e.g. 0.2 for 20%).
+    """
+    regressions = []
+    for route, result in results.items():
+        old = baseline.get(route)
+        if not old:
+            continue
+        for metric in ('p95_ms', 'queries_mean'):
+            if old[metric] and result[metric] > old[metric] * (1 + threshold):
+                regressions.append((route, metric, old[metric], result[metric]))
+    return regressions
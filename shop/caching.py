@@ -0,0 +1,196 @@
+# shop/caching.py
+# This file contains the page and fragment caching helpers.
+# Everything cached here is keyed by the CATALOG version counter (shop/versioning.py), which the
+# receivers in shop/signals.py bump whenever a Product, Category or Review is saved or deleted.
+# Old entries are never deleted explicitly: they simply stop being looked up and expire.
+#
+# Two levels are used:
+#   - Template fragments ({% cache %} in the templates) for the product grid, category sidebar,
+#     home page products and recommendation block. They are shared by every visitor and vary
+#     on the staff user only where the fragment shows staff-only links.
+#   - Whole responses (cache_public_page) for anonymous visitors with no pending messages, on pages
+#     that don't hand out a CSRF token. The navbar cart is not part of any page: main.js fetches it
+#     from the cart_summary view.
+# Both work with the local-memory and the file-based cache backends (see CACHES in config/settings.py).
+#
+# Pages can also be revalidated by the browser (conditional_page): they carry an ETag (and, for anonymous
+# visitors, a Last-Modified date) derived from the catalog version kept in the database, and a request
+# presenting the current one gets an empty 304 Not Modified without the view running at all.
+
+import hashlib
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+from django.contrib.messages.storage.cookie import CookieStorage
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+from django.utils.http import http_date
+
+from .versioning import CATALOG, get_version
+
+
+def cache_context(request):
+    """
+    Context processor: the values the {% cache %} fragments in the templates are keyed on.
+      - catalog_version: Changes whenever catalog data changes.
+      - fragment_cache_timeout: How long a fragment is kept (FRAGMENT_CACHE_TIMEOUT).
+      - fragment_cache_user: 'staff-<id>' for staff (who see their own Edit links), otherwise 'public'.
+    """
+    return {
+        'catalog_version': lambda: get_version(CATALOG),
+        'fragment_cache_timeout': settings.FRAGMENT_CACHE_TIMEOUT,
+        'fragment_cache_user': lambda: f'staff-{request.user.pk}' if request.user.is_staff else 'public',
+    }
+
+
+def _is_public_request(request):
+    """
+    True if the response for this request is the same for every visitor:
+    an anonymous GET with no messages waiting to be shown.
+    """
+    if request.method not in ('GET', 'HEAD'):
+        return False
+    if CookieStorage.cookie_name in request.COOKIES:
+        return False
+    if settings.SESSION_COOKIE_NAME in request.COOKIES:
+        # Only visitors with a session can have a login or session-stored messages.
+        if request.user.is_authenticated:
+            return False
+        if request.session.get('_messages'):
+            return False
+    return True
+
+
+async def _ais_public_request(request):
+    """
+    Async version of _is_public_request(). It loads the user with request.auser(), so the async view
+    that runs next finds it (and the session) already loaded.
+    """
+    if request.method not in ('GET', 'HEAD'):
+        return False
+    if CookieStorage.cookie_name in request.COOKIES:
+        return False
+    if settings.SESSION_COOKIE_NAME in request.COOKIES:
+        if (await request.auser()).is_authenticated:
+            return False
+        if await request.session.aget('_messages'):
+            return False
+    return True
+
+
+def _page_key(request):
+    return f'shop:page:{get_version(CATALOG)}:{request.get_full_path()}'
+
+
+def _cached_response(request):
+    cached = cache.get(_page_key(request))
+    if cached is None:
+        return None
+    content, content_type = cached
+    response = HttpResponse(content, content_type=content_type)
+    patch_vary_headers(response, ('Cookie',))
+    return response
+
+
+def _store_response(request, response):
+    # Never store a response that hands out a CSRF token or sets cookies: those belong to one visitor.
+    if (
+        response.status_code == 200
+        and not response.streaming
+        and not response.cookies
+        and not request.META.get('CSRF_COOKIE_NEEDS_UPDATE')
+    ):
+        cache.set(_page_key(request), (response.content, response['Content-Type']), settings.PAGE_CACHE_TIMEOUT)
+    patch_vary_headers(response, ('Cookie',))
+    return response
+
+
+def cache_public_page(view):
+    """
+    View decorator: serves the whole rendered page from the cache for public requests (see _is_public_request),
+    keyed by the URL and the catalog version. Logged-in users, carts and messages always get a fresh render.
+    Works for both regular and async views.
+    """
+    if iscoroutinefunction(view):
+        @wraps(view)
+        async def async_wrapper(request, *args, **kwargs):
+            if not await _ais_public_request(request):
+                return await view(request, *args, **kwargs)
+            # The cache is called directly: the local-memory and file backends are quick, and
+            # cache.aget() would only run the same call in a worker thread.
+            response = _cached_response(request)
+            if response is None:
+                response = _store_response(request, await view(request, *args, **kwargs))
+            return response
+        return async_wrapper
+
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if not _is_public_request(request):
+            return view(request, *args, **kwargs)
+        response = _cached_response(request)
+        if response is None:
+            response = _store_response(request, view(request, *args, **kwargs))
+        return response
+    return wrapper
+
+
+async def _ahas_messages(request):
+    if request.COOKIES.get(CookieStorage.cookie_name):  # Empty once the messages were shown
+        return True
+    return settings.SESSION_COOKIE_NAME in request.COOKIES and bool(await request.session.aget('_messages'))
+
+
+def conditional_page(validators):
+    """
+    Async view decorator: answers conditional GETs (If-None-Match, If-Modified-Since) for a page.
+    `validators` is an async function taking the view's arguments and returning (key, last_modified),
+    where key is a string that changes whenever the page content does, or None to skip validation
+    (the view then runs as usual, to show its 404 for example).
+    The ETag also covers who is asking (the user and their CSRF cookie, which the page's forms embed),
+    and Last-Modified is only sent to anonymous visitors, as it cannot tell one login from another.
+    Requests with messages waiting to be shown are never answered with a 304, and pages rendered with
+    a new CSRF secret get no validators.
+    Django's condition() decorator is not used: it calls its functions synchronously, and these query the database.
+    """
+    def decorator(view):
+        @wraps(view)
+        async def wrapper(request, *args, **kwargs):
+            if request.method not in ('GET', 'HEAD'):
+                return await view(request, *args, **kwargs)
+            request.user = await request.auser()
+            stamp = await validators(request, *args, **kwargs)
+            if stamp is None or await _ahas_messages(request):
+                return await view(request, *args, **kwargs)
+            key, last_modified = stamp
+            user = request.user
+            viewer = f'user-{user.pk}-{int(user.is_staff)}' if user.is_authenticated else 'anonymous'
+            csrf_cookie = request.COOKIES.get(settings.CSRF_COOKIE_NAME, '')
+            digest = hashlib.md5(
+                f'{request.get_full_path()}:{key}:{viewer}:{csrf_cookie}'.encode(), usedforsecurity=False,
+            ).hexdigest()
+            etag = f'W/"{digest}"'
+            if user.is_authenticated:
+                last_modified = None
+            timestamp = int(last_modified.timestamp()) if last_modified else None
+            response = get_conditional_response(request, etag=etag, last_modified=timestamp)
+            if response is None:
+                response = await view(request, *args, **kwargs)
+                # A page rendered with a new CSRF secret (first visit, or rotated at login) embeds a token
+                # the ETag does not cover; CsrfViewMiddleware sends the cookie for it.
+                new_csrf_secret = request.META.get('CSRF_COOKIE', csrf_cookie) != csrf_cookie
+                if response.status_code == 200 and not new_csrf_secret:
+                    response.headers.setdefault('ETag', etag)
+                    if timestamp is not None:
+                        response.headers.setdefault('Last-Modified', http_date(timestamp))
+            patch_vary_headers(response, ('Cookie',))
+            # Browsers and proxies may keep the page, but must check with us before every use.
+            if user.is_authenticated:
+                patch_cache_control(response, no_cache=True, private=True)
+            else:
+                patch_cache_control(response, no_cache=True)
+            return response
+        return wrapper
+    return decorator
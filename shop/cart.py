@@ -0,0 +1,522 @@
+# shop/cart.py
+# This file contains the cart service shared by the views (cart page, cart_summary for the navbar, checkout).
+#
+# Logged-in users keep their cart in the database (one CartItem row per product), so it follows them
+# across devices. Adding to it is a single UPDATE ... SET quantity = quantity + n, so concurrent
+# add-to-cart clicks never lose an increment, and it never rewrites the session.
+# Its snapshot (see below) is kept in the cache and dropped whenever the cart changes, but only when the
+# cache is shared by every worker process (SHOP_CACHE_DIR): with the per-process (locmem) cache, the other
+# workers would not see it dropped and would keep showing the old cart, so it is rebuilt on every request
+# instead (one joined query).
+#
+# Visitors who are not logged in keep their cart in the session, under two keys:
+#   - 'cart': {product_id: quantity}, the source of truth.
+#   - 'cart_snapshot': a denormalized copy of the cart (name, slug, price, thumbnail, count, total)
+#     so the navbar cart (cart_summary) can be built without looking up any products.
+# When they log in, the session cart is merged into their database cart (merge_session_cart).
+#
+# Snapshots carry the CART_SNAPSHOT version they were built with and are rebuilt when a product changes.
+#
+# Async views call aget_cart_summary(), which builds the same snapshot through the async ORM before
+# the page is rendered. The cache is read directly: the local-memory and file caches are quick, and
+# Django's cache.aget() would only run the same call in a worker thread.
+
+from decimal import Decimal
+
+from django.core.cache import DEFAULT_CACHE_ALIAS, cache, caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import IntegrityError, transaction
+from django.db.models import Case, F, Q, Value, When
+from django.utils.functional import cached_property
+
+from .images import smallest_variant_url
+from .models import CartItem, Product
+from .versioning import CART_SNAPSHOT, get_version
+
+CART_SESSION_KEY = 'cart'
+SNAPSHOT_SESSION_KEY = 'cart_snapshot'
+
+# How long a logged-in user's cart snapshot stays in the cache without being read.
+USER_SNAPSHOT_TIMEOUT = 60 * 60 * 24
+
+# Batch cart changes (apply_cart_operations): the operations, the most accepted in one request,
+# and the largest quantity one operation may add or set.
+CART_OPERATIONS = ('add', 'remove', 'set')
+MAX_CART_OPERATIONS = 50
+MAX_ITEM_QUANTITY = 999
+
+
+def _thumbnail_url(product):
+    """
+    Returns the URL used for the small cart image (the smallest resized variant when there is one),
+    or '' if the product has no image.
+    """
+    if not product.image:
+        return ''
+    return smallest_variant_url(product) or product.image.url
+
+
+def _snapshot_item(product, quantity):
+    return {
+        'name': product.name,
+        'slug': product.slug,
+        'price': str(product.price),
+        'thumbnail_url': _thumbnail_url(product),
+        'quantity': quantity,
+    }
+
+
+def _finish_snapshot(items):
+    """
+    Builds the snapshot dict (with precomputed count and total) from its items.
+    """
+    count = 0
+    total = Decimal('0.00')
+    for item in items.values():
+        count += item['quantity']
+        total += Decimal(item['price']) * item['quantity']
+    return {
+        'version': get_version(CART_SNAPSHOT),
+        'items': items,
+        'cart_count': count,
+        'cart_total': str(total),
+    }
+
+
+def build_snapshot(cart):
+    """
+    Builds a fresh snapshot for a {product_id: quantity} cart with a single product query.
+    Products that no longer exist are left out.
+    """
+    items = {}
+    if cart:
+        for product in Product.objects.filter(id__in=cart.keys()):
+            items[str(product.id)] = _snapshot_item(product, cart.get(str(product.id), 0))
+    return _finish_snapshot(items)
+
+
+async def abuild_snapshot(cart):
+    """
+    Async version of build_snapshot().
+    """
+    items = {}
+    if cart:
+        async for product in Product.objects.filter(id__in=cart.keys()):
+            items[str(product.id)] = _snapshot_item(product, cart.get(str(product.id), 0))
+    return _finish_snapshot(items)
+
+
+def _user_snapshot_key(user_id):
+    return f'shop:cart:{user_id}'
+
+
+def build_user_snapshot(user_id):
+    """
+    Builds a fresh snapshot of a logged-in user's database cart
+    (the cart rows and their products are read with one joined query).
+    """
+    items = {}
+    # No ORDER BY: CartSummary sorts the items itself.
+    for item in CartItem.objects.filter(user_id=user_id).select_related('product').order_by():
+        items[str(item.product_id)] = _snapshot_item(item.product, item.quantity)
+    return _finish_snapshot(items)
+
+
+async def abuild_user_snapshot(user_id):
+    """
+    Async version of build_user_snapshot().
+    """
+    items = {}
+    async for item in CartItem.objects.filter(user_id=user_id).select_related('product').order_by():
+        items[str(item.product_id)] = _snapshot_item(item.product, item.quantity)
+    return _finish_snapshot(items)
+
+
+def _caches_user_snapshots():
+    # A snapshot dropped from one process's memory would live on in the others.
+    return not isinstance(caches[DEFAULT_CACHE_ALIAS], LocMemCache)
+
+
+def _user_snapshot(user_id):
+    """
+    Returns the cached snapshot of a user's database cart, rebuilding it if it is missing or out of date
+    (or always, when the cache is not shared between processes).
+    """
+    if not _caches_user_snapshots():
+        return build_user_snapshot(user_id)
+    key = _user_snapshot_key(user_id)
+    snapshot = cache.get(key)
+    if snapshot is None or snapshot.get('version') != get_version(CART_SNAPSHOT):
+        snapshot = build_user_snapshot(user_id)
+        cache.set(key, snapshot, USER_SNAPSHOT_TIMEOUT)
+    return snapshot
+
+
+async def _auser_snapshot(user_id):
+    if not _caches_user_snapshots():
+        return await abuild_user_snapshot(user_id)
+    key = _user_snapshot_key(user_id)
+    snapshot = cache.get(key)
+    if snapshot is None or snapshot.get('version') != get_version(CART_SNAPSHOT):
+        snapshot = await abuild_user_snapshot(user_id)
+        cache.set(key, snapshot, USER_SNAPSHOT_TIMEOUT)
+    return snapshot
+
+
+def _snapshot_is_current(snapshot, cart):
+    return (
+        snapshot is not None
+        and snapshot.get('version') == get_version(CART_SNAPSHOT)
+        and set(snapshot.get('items', {})) <= set(cart)
+    )
+
+
+class CartSummary:
+    """
+    Summary of the request's cart (the user's database cart, or the session cart for visitors).
+    Attributes (each computed on first access, then reused):
+      - items: A list of dicts with 'product_id', 'name', 'slug', 'price', 'thumbnail_url', 'quantity' and 'subtotal'.
+      - count: The total number of units in the cart.
+      - total: The sum of all subtotals.
+    A current snapshot is served straight from the cache or the session, and an empty session cart
+    never touches the database.
+    """
+    def __init__(self, request):
+        self.request = request
+
+    @cached_property
+    def snapshot(self):
+        if self.request.user.is_authenticated:
+            return _user_snapshot(self.request.user.pk)
+        session = self.request.session
+        cart = session.get(CART_SESSION_KEY, {})
+        if not cart:
+            return _finish_snapshot({})
+        snapshot = session.get(SNAPSHOT_SESSION_KEY)
+        if not _snapshot_is_current(snapshot, cart):
+            snapshot = build_snapshot(cart)
+            session[SNAPSHOT_SESSION_KEY] = snapshot
+        return snapshot
+
+    async def aload(self):
+        """
+        Computes the snapshot with the async ORM, so reading the summary afterwards never queries the database.
+        """
+        if 'snapshot' in self.__dict__:
+            return
+        user = await self.request.auser()
+        if user.is_authenticated:
+            snapshot = await _auser_snapshot(user.pk)
+        else:
+            cart = await self.request.session.aget(CART_SESSION_KEY, {})
+            snapshot = await self.request.session.aget(SNAPSHOT_SESSION_KEY) if cart else _finish_snapshot({})
+            if cart and not _snapshot_is_current(snapshot, cart):
+                snapshot = await abuild_snapshot(cart)
+                await self.request.session.aset(SNAPSHOT_SESSION_KEY, snapshot)
+        self.__dict__['snapshot'] = snapshot
+
+    @cached_property
+    def items(self):
+        items = []
+        for product_id, item in self.snapshot['items'].items():
+            price = Decimal(item['price'])
+            items.append(dict(item, product_id=int(product_id), price=price, subtotal=price * item['quantity']))
+        items.sort(key=lambda item: item['name'])  # Same order as Product.Meta.ordering
+        return items
+
+    @property
+    def count(self):
+        return self.snapshot['cart_count']
+
+    @cached_property
+    def total(self):
+        return Decimal(self.snapshot['cart_total'])
+
+
+def get_cart_summary(request):
+    """
+    Returns the CartSummary for this request, creating it on first use.
+    Later calls in the same request reuse the same object.
+    """
+    summary = getattr(request, '_cart_summary', None)
+    if summary is None:
+        summary = CartSummary(request)
+        request._cart_summary = summary
+    return summary
+
+
+async def aget_cart_summary(request):
+    """
+    Async version of get_cart_summary(): returns the request's CartSummary with its snapshot already loaded.
+    """
+    summary = get_cart_summary(request)
+    await summary.aload()
+    return summary
+
+
+def invalidate_cart_summary(request):
+    """
+    Drops the memoized summary after the cart in the session has changed,
+    so the next read reflects the new contents.
+    """
+    request.__dict__.pop('_cart_summary', None)
+
+
+def _update_session_cart(request, product, quantity):
+    """
+    Sets the quantity of `product` in the session cart (0 removes it) and patches the
+    snapshot in place when it is still current, instead of rebuilding it from the database.
+    """
+    session = request.session
+    cart = session.get(CART_SESSION_KEY, {})
+    if cart:
+        snapshot = session.get(SNAPSHOT_SESSION_KEY)
+        snapshot_is_current = _snapshot_is_current(snapshot, cart)
+    else:
+        # An empty cart has a trivially current (empty) snapshot to start from.
+        snapshot = {'items': {}}
+        snapshot_is_current = True
+    key = str(product.id)
+    if quantity > 0:
+        cart[key] = quantity
+    else:
+        cart.pop(key, None)
+    session[CART_SESSION_KEY] = cart
+    if snapshot_is_current:
+        items = snapshot['items']
+        if quantity > 0:
+            items[key] = _snapshot_item(product, quantity)
+        else:
+            items.pop(key, None)
+        session[SNAPSHOT_SESSION_KEY] = _finish_snapshot(items)
+    else:
+        session.pop(SNAPSHOT_SESSION_KEY, None)
+    invalidate_cart_summary(request)
+
+
+def forget_user_snapshot(user_id):
+    """
+    Drops the cached snapshot of a user's database cart after the cart rows changed.
+    """
+    cache.delete(_user_snapshot_key(user_id))
+
+
+def _user_cart_changed(request, user_id):
+    forget_user_snapshot(user_id)
+    invalidate_cart_summary(request)
+
+
+def _increment_user_cart(user_id, product_id, quantity):
+    """
+    Adds `quantity` units to a user's cart row with an atomic F() update, creating the row if there is none.
+    """
+    rows = CartItem.objects.filter(user_id=user_id, product_id=product_id)
+    if rows.update(quantity=F('quantity') + quantity):
+        return
+    try:
+        with transaction.atomic():
+            CartItem.objects.create(user_id=user_id, product_id=product_id, quantity=quantity)
+    except IntegrityError:
+        # A concurrent request created the row first; add to it instead.
+        rows.update(quantity=F('quantity') + quantity)
+
+
+def add_item(request, product, quantity=1):
+    """
+    Adds `quantity` units of `product` to the request's cart
+    (the user's database cart when logged in, otherwise the session cart).
+    """
+    if request.user.is_authenticated:
+        _increment_user_cart(request.user.pk, product.pk, quantity)
+        _user_cart_changed(request, request.user.pk)
+        return
+    cart = request.session.get(CART_SESSION_KEY, {})
+    _update_session_cart(request, product, cart.get(str(product.id), 0) + quantity)
+
+
+def remove_item(request, product):
+    """
+    Removes `product` from the request's cart. Returns True if it was in the cart.
+    """
+    if request.user.is_authenticated:
+        deleted, _ = CartItem.objects.filter(user_id=request.user.pk, product_id=product.pk).delete()
+        _user_cart_changed(request, request.user.pk)
+        return bool(deleted)
+    if str(product.id) not in request.session.get(CART_SESSION_KEY, {}):
+        return False
+    _update_session_cart(request, product, 0)
+    return True
+
+
+def merge_session_cart(request, user):
+    """
+    Moves the session cart into `user`'s database cart (called when they log in).
+    Missing rows are bulk-inserted first, then every row gets its session quantity added with
+    a single F() update, so quantities of products already in their cart are added together.
+    Products that no longer exist are dropped.
+    """
+    cart = request.session.pop(CART_SESSION_KEY, None)
+    request.session.pop(SNAPSHOT_SESSION_KEY, None)
+    if not cart:
+        return
+    product_ids = list(Product.objects.filter(pk__in=[int(key) for key in cart]).values_list('id', flat=True))
+    if product_ids:
+        with transaction.atomic():
+            CartItem.objects.bulk_create(
+                [CartItem(user=user, product_id=product_id, quantity=0) for product_id in product_ids],
+                ignore_conflicts=True,
+            )
+            CartItem.objects.filter(user=user, product_id__in=product_ids).update(
+                quantity=F('quantity') + Case(
+                    *[When(product_id=product_id, then=Value(cart[str(product_id)])) for product_id in product_ids],
+                    default=Value(0),
+                ),
+            )
+    _user_cart_changed(request, user.pk)
+
+
+class CartOperationError(Exception):
+    """
+    Raised when a batch of cart operations is invalid; nothing in the batch was applied,
+    and the message can be shown to the customer.
+    """
+
+
+def parse_cart_operations(data):
+    """
+    Validates a list of cart operations, each a dict like {"op": "add", "slug": "red-hat", "quantity": 2}:
+      - op: 'add' (quantity defaults to 1), 'remove', or 'set' (quantity 0 removes the product);
+      - the product, by "slug" or by "id".
+    Returns [(op, product key, quantity), ...], where the key is ('slug', slug) or ('id', id).
+    Raises CartOperationError for anything else.
+    """
+    if not isinstance(data, list) or not data:
+        raise CartOperationError("Send a non-empty list of operations.")
+    if len(data) > MAX_CART_OPERATIONS:
+        raise CartOperationError(f"Send at most {MAX_CART_OPERATIONS} operations at once.")
+    operations = []
+    for operation in data:
+        if not isinstance(operation, dict) or operation.get('op') not in CART_OPERATIONS:
+            raise CartOperationError(f"Each operation needs an op: {', '.join(CART_OPERATIONS)}.")
+        op = operation['op']
+        if isinstance(operation.get('slug'), str) and operation['slug']:
+            key = ('slug', operation['slug'])
+        elif isinstance(operation.get('id'), int) and not isinstance(operation['id'], bool):
+            key = ('id', operation['id'])
+        else:
+            raise CartOperationError("Each operation needs a product slug or id.")
+        quantity = operation.get('quantity', 1 if op == 'add' else 0)
+        lowest = 1 if op == 'add' else 0
+        if op != 'remove' and (
+            not isinstance(quantity, int) or isinstance(quantity, bool) or not lowest <= quantity <= MAX_ITEM_QUANTITY
+        ):
+            raise CartOperationError(f"Quantities must be whole numbers from {lowest} to {MAX_ITEM_QUANTITY}.")
+        operations.append((op, key, quantity))
+    return operations
+
+
+def _resolve_products(operations):
+    """
+    Looks up every product named in `operations` with one query. Returns {product key: Product}.
+    """
+    slugs = {value for _, (kind, value), _ in operations if kind == 'slug'}
+    ids = {value for _, (kind, value), _ in operations if kind == 'id'}
+    products = {}
+    for product in Product.objects.filter(Q(slug__in=slugs) | Q(pk__in=ids)):
+        products[('slug', product.slug)] = product
+        products[('id', product.pk)] = product
+    missing = [key[1] for _, key, _ in operations if key not in products]
+    if missing:
+        raise CartOperationError(f"No product matches {missing[0]!r}.")
+    return products
+
+
+def _check_quantity(product, quantity):
+    if quantity > MAX_ITEM_QUANTITY:
+        raise CartOperationError(f"You can have at most {MAX_ITEM_QUANTITY} of {product.name} in your cart.")
+
+
+def _fold_operations(operations, products):
+    """
+    Reduces the operations to one change per product, in order: {Product: (base, added)}, meaning
+    "set the quantity to `base` (None: keep the current one), then add `added`".
+    Raises CartOperationError when a set quantity plus what is added to it goes over MAX_ITEM_QUANTITY
+    (added amounts alone are checked against the stored quantity when they are applied).
+    """
+    changes = {}
+    for op, key, quantity in operations:
+        product = products[key]
+        base, added = changes.get(product, (None, 0))
+        if op == 'add':
+            changes[product] = (base, added + quantity)
+        else:
+            changes[product] = (0 if op == 'remove' else quantity, 0)
+    for product, (base, added) in changes.items():
+        _check_quantity(product, (base or 0) + added)
+    return changes
+
+
+def _apply_user_cart_changes(user_id, changes):
+    """
+    Applies folded changes to a user's database cart in one transaction: one DELETE, one upsert for the
+    quantities that were set, and, for products that were only added to, the same F() increment as
+    merge_session_cart, so concurrent clicks in another tab never lose an increment.
+    The rows added to are read (and locked) first, and the whole batch is rolled back with a
+    CartOperationError if an increment would take one over MAX_ITEM_QUANTITY.
+    """
+    by_id = {product.pk: product for product in changes}
+    removed = [product.pk for product, (base, added) in changes.items() if base is not None and base + added == 0]
+    assigned = {
+        product.pk: base + added
+        for product, (base, added) in changes.items() if base is not None and base + added > 0
+    }
+    increments = {product.pk: added for product, (base, added) in changes.items() if base is None}
+    with transaction.atomic():
+        if removed:
+            CartItem.objects.filter(user_id=user_id, product_id__in=removed).delete()
+        if assigned:
+            CartItem.objects.bulk_create(
+                [CartItem(user_id=user_id, product_id=product_id, quantity=quantity) for product_id, quantity in assigned.items()],
+                update_conflicts=True,
+                unique_fields=['user', 'product'],
+                update_fields=['quantity'],
+            )
+        if increments:
+            stored = CartItem.objects.select_for_update().filter(user_id=user_id, product_id__in=increments)
+            for product_id, quantity in stored.values_list('product_id', 'quantity'):
+                _check_quantity(by_id[product_id], quantity + increments[product_id])
+            CartItem.objects.bulk_create(
+                [CartItem(user_id=user_id, product_id=product_id, quantity=0) for product_id in increments],
+                ignore_conflicts=True,
+            )
+            CartItem.objects.filter(user_id=user_id, product_id__in=increments).update(
+                quantity=F('quantity') + Case(
+                    *[When(product_id=product_id, then=Value(added)) for product_id, added in increments.items()],
+                    default=Value(0),
+                ),
+            )
+
+
+def apply_cart_operations(request, operations):
+    """
+    Applies parsed cart operations (see parse_cart_operations) to the request's cart, all or nothing:
+    every product is looked up first with a single query, and an unknown one, or a quantity that would
+    go over MAX_ITEM_QUANTITY, rejects the whole batch (CartOperationError). Several operations on the
+    same product are combined, so a burst of clicks costs one write per product (the session cart is
+    written once, with the response).
+    """
+    products = _resolve_products(operations)
+    changes = _fold_operations(operations, products)
+    if request.user.is_authenticated:
+        _apply_user_cart_changes(request.user.pk, changes)
+        _user_cart_changed(request, request.user.pk)
+        return
+    cart = request.session.get(CART_SESSION_KEY, {})
+    quantities = {}
+    for product, (base, added) in changes.items():
+        current = cart.get(str(product.id), 0)
+        quantities[product] = (current if base is None else base) + added
+        _check_quantity(product, quantities[product])
+    for product, quantity in quantities.items():
+        if quantity != cart.get(str(product.id), 0):
+            _update_session_cart(request, product, quantity)
@@ -0,0 +1,142 @@
+# shop/catalog.py
+# This file contains the listing helpers used by the shop page, the product detail page and their JSON feeds.
+# Listings use keyset pagination: products on (name, id), which matches Product.Meta.ordering,
+# and reviews on (-created_at, -id). Each page starts right after the last row of the previous page,
+# so the database never has to count or skip rows, however deep the customer scrolls.
+# aproduct_page() and areview_page() run the same queries through the async ORM, for the async views.
+
+import base64
+import binascii
+import json
+from datetime import datetime
+
+from django.conf import settings
+from django.db.models import Q
+
+from .models import Review
+
+
+def page_size_from(value):
+    """
+    Turns the ?page_size= query parameter into a page size between 1 and SHOP_MAX_PAGE_SIZE.
+    Missing or invalid values fall back to SHOP_PAGE_SIZE.
+    """
+    try:
+        size = int(value)
+    except (TypeError, ValueError):
+        return settings.SHOP_PAGE_SIZE
+    return max(1, min(size, settings.SHOP_MAX_PAGE_SIZE))
+
+
+def encode_cursor(*values):
+    """
+    Encodes the position of a row (its ordering values, e.g. name and id) as an opaque, URL-safe cursor string.
+    """
+    raw = json.dumps(values).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor, *types):
+    """
+    Decodes a cursor made by encode_cursor() back into a tuple of values of the given types.
+    Returns None for a missing or malformed cursor, which means "start from the first page".
+    """
+    if not cursor:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        values = json.loads(raw)
+    except (binascii.Error, ValueError, TypeError):
+        return None
+    if not isinstance(values, list) or len(values) != len(types):
+        return None
+    if not all(isinstance(value, kind) for value, kind in zip(values, types)):
+        return None
+    return tuple(values)
+
+
+def _product_page_query(queryset, cursor, page_size):
+    queryset = queryset.order_by('name', 'id')
+    position = decode_cursor(cursor, str, int)
+    if position is not None:
+        name, product_id = position
+        # The name__gte bound lets the database start from a range seek on the (name, id) index.
+        queryset = queryset.filter(Q(name__gt=name) | Q(name=name, id__gt=product_id), name__gte=name)
+    # Fetch one extra row to find out whether there is another page.
+    return queryset[:page_size + 1]
+
+
+def _product_page_result(products, page_size):
+    next_cursor = None
+    if len(products) > page_size:
+        products = products[:page_size]
+        next_cursor = encode_cursor(products[-1].name, products[-1].id)
+    return products, next_cursor
+
+
+def product_page(queryset, cursor=None, page_size=None):
+    """
+    Returns (products, next_cursor) for one page of `queryset` in (name, id) order.
+    `products` is a list of at most `page_size` products that come after `cursor`;
+    `next_cursor` is None on the last page.
+    """
+    page_size = page_size or settings.SHOP_PAGE_SIZE
+    products = list(_product_page_query(queryset, cursor, page_size))
+    return _product_page_result(products, page_size)
+
+
+async def aproduct_page(queryset, cursor=None, page_size=None):
+    """
+    Async version of product_page(), for the async views.
+    """
+    page_size = page_size or settings.SHOP_PAGE_SIZE
+    products = [product async for product in _product_page_query(queryset, cursor, page_size)]
+    return _product_page_result(products, page_size)
+
+
+def _review_page_query(product, cursor, page_size):
+    reviews = (
+        Review.objects.filter(product=product)
+        .select_related('user')
+        .only('id', 'rating', 'comment', 'created_at', 'user__username')
+        .order_by('-created_at', '-id')
+    )
+    position = decode_cursor(cursor, str, int)
+    if position is not None:
+        try:
+            created_at = datetime.fromisoformat(position[0])
+        except ValueError:
+            created_at = None
+        if created_at is not None:
+            reviews = reviews.filter(
+                Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=position[1]),
+                created_at__lte=created_at,
+            )
+    return reviews[:page_size + 1]
+
+
+def _review_page_result(reviews, page_size):
+    next_cursor = None
+    if len(reviews) > page_size:
+        reviews = reviews[:page_size]
+        next_cursor = encode_cursor(reviews[-1].created_at.isoformat(), reviews[-1].id)
+    return reviews, next_cursor
+
+
+def review_page(product, cursor=None, page_size=None):
+    """
+    Returns (reviews, next_cursor) for one page of `product`'s reviews, newest first.
+    The reviewer is fetched in the same query, and only the columns the page shows are loaded.
+    """
+    page_size = page_size or settings.REVIEWS_PAGE_SIZE
+    reviews = list(_review_page_query(product, cursor, page_size))
+    return _review_page_result(reviews, page_size)
+
+
+async def areview_page(product, cursor=None, page_size=None):
+    """
+    Async version of review_page(), for the async views.
+    """
+    page_size = page_size or settings.REVIEWS_PAGE_SIZE
+    reviews = [review async for review in _review_page_query(product, cursor, page_size)]
+    return _review_page_result(reviews, page_size)
@@ -0,0 +1,379 @@
+# shop/catalog_io.py
+# This file contains the bulk catalog import and export used by `manage.py import_catalog` and `export_catalog`.
+# Files are CSV (with a header row) or JSONL (one JSON object per line) with these columns:
+#   name, slug, description, price, category, category_slug, category_description, image
+# Only name, price and category (or category_slug) are required. `image` is a path inside MEDIA_ROOT.
+#
+# Both directions stream: rows are read, validated and written in chunks of `batch_size`, so memory use
+# does not grow with the file. Each chunk costs a handful of queries (existing slugs, categories, one
+# bulk_create and one upsert) in its own transaction; image paths are checked in a thread pool.
+# Rows whose slug already exists (compared exactly, case included) update that product; explicit slugs are
+# only validated, never rewritten, so exporting and importing the same file changes nothing. Rows without
+# a slug get one made from the name, with a numeric suffix if it is taken in the database or the chunk.
+# Bulk writes send no signals, so the search index, facet counts, caches and recommendations are refreshed
+# once at the end of the import (finish_import).
+
+import csv
+import json
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal, InvalidOperation
+
+from django.core.exceptions import ValidationError
+from django.core.files.storage import default_storage
+from django.core.validators import validate_slug
+from django.db import transaction
+from django.utils.text import slugify
+from PIL import Image
+
+from .facets import rebuild_facet_counts
+from .models import Category, Product
+from .recommendations import mark_stale
+from .search import rebuild_index
+from .versioning import CART_SNAPSHOT, CATALOG, bump_version
+
+FIELDS = ['name', 'slug', 'description', 'price', 'category', 'category_slug', 'category_description', 'image']
+UPDATE_FIELDS = ['name', 'description', 'price', 'category', 'image', 'updated_at']
+
+SLUG_MAX_LENGTH = Product._meta.get_field('slug').max_length
+NAME_MAX_LENGTH = Product._meta.get_field('name').max_length
+CATEGORY_SLUG_MAX_LENGTH = Category._meta.get_field('slug').max_length
+CATEGORY_NAME_MAX_LENGTH = Category._meta.get_field('name').max_length
+
+# How many rows are kept of each kind of error message (the count is always exact).
+MAX_ERROR_MESSAGES = 50
+
+# How many slug prefixes the allocator remembers the next free suffix for.
+SLUG_CACHE_SIZE = 10000
+
+
+class ImportStats:
+    """
+    Counters and (a bounded number of) error messages for one import.
+    """
+    def __init__(self):
+        self.rows = 0
+        self.created = 0
+        self.updated = 0
+        self.failed = 0
+        self.errors = []
+        self.category_ids = set()
+
+    def error(self, line, message):
+        self.failed += 1
+        if len(self.errors) < MAX_ERROR_MESSAGES:
+            self.errors.append(f"line {line}: {message}")
+
+
+def detect_format(path, fmt=None):
+    """
+    Returns 'csv' or 'jsonl' from an explicit format or the file extension.
+    """
+    if fmt:
+        return fmt
+    return 'jsonl' if path.endswith(('.jsonl', '.ndjson', '.json')) else 'csv'
+
+
+def read_rows(stream, fmt):
+    """
+    Yields (line number, row dict) from a CSV or JSONL text stream, one row at a time.
+    """
+    if fmt == 'csv':
+        reader = csv.DictReader(stream)
+        for row in reader:
+            yield reader.line_num, row
+        return
+    for line_number, line in enumerate(stream, start=1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError as error:
+            yield line_number, {'_error': f"invalid JSON ({error})"}
+            continue
+        yield line_number, row if isinstance(row, dict) else {'_error': "not a JSON object"}
+
+
+def _chunks(rows, size):
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _clean(value):
+    return str(value).strip() if value is not None else ''
+
+
+def _valid_slug(slug):
+    try:
+        validate_slug(slug)
+    except ValidationError:
+        return False
+    return True
+
+
+def parse_row(row):
+    """
+    Validates one input row. Returns (cleaned dict, None) or (None, error message).
+    """
+    if '_error' in row:
+        return None, row['_error']
+    name = _clean(row.get('name'))
+    if not name:
+        return None, "name is required"
+    if len(name) > NAME_MAX_LENGTH:
+        return None, f"name is longer than {NAME_MAX_LENGTH} characters"
+    try:
+        price = Decimal(_clean(row.get('price')))
+    except InvalidOperation:
+        return None, f"invalid price {row.get('price')!r}"
+    if not price.is_finite() or price < 0 or price.as_tuple().exponent < -2 or price >= Decimal('1e8'):
+        return None, f"invalid price {row.get('price')!r}"
+    category_name = _clean(row.get('category'))
+    category_slug = _clean(row.get('category_slug'))
+    if category_slug:
+        # Given slugs are kept as they are (existing ones may be mixed-case), so they match exactly.
+        if not _valid_slug(category_slug):
+            return None, f"invalid category_slug {category_slug!r}"
+        if len(category_slug) > CATEGORY_SLUG_MAX_LENGTH:
+            return None, f"category_slug is longer than {CATEGORY_SLUG_MAX_LENGTH} characters"
+    else:
+        category_slug = slugify(category_name)[:CATEGORY_SLUG_MAX_LENGTH]
+    if not category_slug:
+        return None, "category is required"
+    slug = _clean(row.get('slug'))
+    if slug and not _valid_slug(slug):
+        return None, f"invalid slug {slug!r}"
+    if len(slug) > SLUG_MAX_LENGTH:
+        return None, f"slug is longer than {SLUG_MAX_LENGTH} characters"
+    return {
+        'name': name,
+        'slug': slug,
+        'description': _clean(row.get('description')),
+        'price': price,
+        'category_name': category_name or category_slug.replace('-', ' ').title(),
+        'category_slug': category_slug,
+        'category_description': _clean(row.get('category_description')),
+        'image': _clean(row.get('image')),
+    }, None
+
+
+def check_image(path):
+    """
+    Returns None if `path` is a readable image in the default storage, otherwise an error message.
+    """
+    if not default_storage.exists(path):
+        return f"image {path!r} does not exist"
+    try:
+        with default_storage.open(path, 'rb') as source:
+            Image.open(source).verify()
+    except Exception as error:
+        return f"image {path!r} is not a valid image ({error})"
+    return None
+
+
+class SlugAllocator:
+    """
+    Makes unique slugs for rows that don't have one. Remembers the next free suffix of recently
+    used prefixes (up to SLUG_CACHE_SIZE of them), so memory stays bounded on any file size.
+    """
+    def __init__(self):
+        self._next_suffix = OrderedDict()
+
+    def _first_free_suffix(self, base):
+        taken = Product.objects.filter(slug__startswith=f'{base}-').values_list('slug', flat=True)
+        suffixes = [int(slug[len(base) + 1:]) for slug in taken if slug[len(base) + 1:].isdigit()]
+        return max(suffixes, default=1) + 1
+
+    def _next_slug(self, base, taken):
+        suffix = self._next_suffix.pop(base, None) or self._first_free_suffix(base)
+        while f'{base}-{suffix}' in taken:
+            suffix += 1
+        self._next_suffix[base] = suffix + 1
+        if len(self._next_suffix) > SLUG_CACHE_SIZE:
+            self._next_suffix.popitem(last=False)
+        return f'{base}-{suffix}'
+
+    def allocate(self, bases, reserved=()):
+        """
+        Returns a unique slug for each base slug in `bases` (a list that may repeat). A slug is unique if
+        no product in the database has it, and it is neither in `reserved` (the explicit slugs of the
+        same chunk) nor given to an earlier base. The database is checked with one query per chunk,
+        plus one more to catch remembered suffixes that were taken since (by explicit slugs of earlier chunks).
+        """
+        existing = set(Product.objects.filter(slug__in=set(bases)).values_list('slug', flat=True))
+        taken = set(reserved)
+        slugs = []
+        for base in bases:
+            if base not in existing and base not in taken and base not in self._next_suffix:
+                slug = base
+            else:
+                slug = self._next_slug(base, taken)
+            taken.add(slug)
+            slugs.append(slug)
+        collided = set(Product.objects.filter(slug__in=set(slugs) - set(bases)).values_list('slug', flat=True))
+        for index, slug in enumerate(slugs):
+            if slug in collided:
+                base = bases[index]
+                self._next_suffix.pop(base, None)  # Start again from the largest suffix in the database
+                slugs[index] = self._next_slug(base, taken | collided)
+                taken.add(slugs[index])
+        return slugs
+
+
+def _category_ids(rows, categories):
+    """
+    Returns {category slug: id} for the chunk, creating missing categories with one bulk insert.
+    `categories` is the import-wide {slug: id} cache (stores are small, so it stays small).
+    """
+    missing = {row['category_slug']: row for row in rows if row['category_slug'] not in categories}
+    if missing:
+        categories.update(Category.objects.filter(slug__in=missing).values_list('slug', 'id'))
+        to_create = [
+            Category(slug=slug, name=row['category_name'][:CATEGORY_NAME_MAX_LENGTH], description=row['category_description'] or None)
+            for slug, row in missing.items() if slug not in categories
+        ]
+        if to_create:
+            Category.objects.bulk_create(to_create, ignore_conflicts=True)
+            categories.update(Category.objects.filter(slug__in=missing).values_list('slug', 'id'))
+    return categories
+
+
+def import_chunk(lines, stats, categories, slugs, pool, dry_run=False):
+    """
+    Validates and writes one chunk of (line number, raw row) pairs in a single transaction.
+    """
+    parsed = []
+    for line, raw in lines:
+        stats.rows += 1
+        row, error = parse_row(raw)
+        if error:
+            stats.error(line, error)
+        else:
+            parsed.append((line, row))
+
+    # Each distinct image path is checked once per chunk, all of them in parallel.
+    paths = list({row['image'] for _, row in parsed if row['image']})
+    image_errors = dict(zip(paths, pool.map(check_image, paths)))
+    valid = []
+    for line, row in parsed:
+        error = image_errors.get(row['image'])
+        if error:
+            stats.error(line, error)
+        else:
+            valid.append((line, row))
+    if not valid:
+        return
+
+    # An explicit slug given twice in a chunk is an error on the later row, rather than one row replacing the other.
+    first_line = {}
+    unique = []
+    for line, row in valid:
+        if row['slug'] and row['slug'] in first_line:
+            stats.error(line, f"slug {row['slug']!r} is already used on line {first_line[row['slug']]}")
+            continue
+        if row['slug']:
+            first_line[row['slug']] = line
+        unique.append((line, row))
+    valid = unique
+
+    with transaction.atomic():
+        _category_ids([row for _, row in valid], categories)
+        explicit = [row['slug'] for _, row in valid if row['slug']]
+        existing = dict(Product.objects.filter(slug__in=explicit).values_list('slug', 'image')) if explicit else {}
+        generated = iter(slugs.allocate(
+            [slugify(row['name'])[:SLUG_MAX_LENGTH - 8] or 'product' for _, row in valid if not row['slug']],
+            reserved=explicit,
+        ))
+        to_create = []
+        to_update = []
+        for line, row in valid:
+            category_id = categories[row['category_slug']]
+            stats.category_ids.add(category_id)
+            slug = row['slug'] or next(generated)
+            product = Product(
+                name=row['name'], slug=slug, description=row['description'], price=row['price'],
+                category_id=category_id, image=row['image'] or existing.get(slug, ''),
+            )
+            (to_update if slug in existing else to_create).append(product)
+        Product.objects.bulk_create(to_create)
+        if to_update:
+            # An upsert on the slug: one INSERT ... ON CONFLICT DO UPDATE per batch, which is far cheaper
+            # than bulk_update's CASE WHEN per field, and leaves the ratings and created_by alone.
+            Product.objects.bulk_create(
+                to_update, update_conflicts=True, unique_fields=['slug'], update_fields=UPDATE_FIELDS,
+            )
+        stats.created += len(to_create)
+        stats.updated += len(to_update)
+        if dry_run:
+            transaction.set_rollback(True)
+
+
+def import_catalog(stream, fmt, batch_size=2000, workers=8, dry_run=False):
+    """
+    Imports every row of a CSV or JSONL stream. Returns the ImportStats.
+    """
+    stats = ImportStats()
+    categories = {}
+    slugs = SlugAllocator()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for chunk in _chunks(read_rows(stream, fmt), batch_size):
+            import_chunk(chunk, stats, categories, slugs, pool, dry_run=dry_run)
+    if not dry_run and (stats.created or stats.updated):
+        finish_import(stats)
+    return stats
+
+
+def finish_import(stats):
+    """
+    Refreshes what the skipped signals would have: the search index, the facet counts, the recommendations
+    of the touched categories, and every cache keyed on the catalog or cart snapshot versions.
+    """
+    rebuild_index()
+    rebuild_facet_counts()
+    mark_stale(stats.category_ids)
+    bump_version(CATALOG)
+    bump_version(CART_SNAPSHOT)
+
+
+def export_rows(batch_size=2000):
+    """
+    Yields one row dict per product (in id order), reading the table in chunks.
+    """
+    products = (
+        Product.objects.select_related('category').order_by('id')
+        .values_list(
+            'name', 'slug', 'description', 'price', 'category__name', 'category__slug',
+            'category__description', 'image',
+        )
+    )
+    for values in products.iterator(chunk_size=batch_size):
+        row = dict(zip(FIELDS, values))
+        row['price'] = str(row['price'])
+        row['category_description'] = row['category_description'] or ''
+        yield row
+
+
+def export_catalog(stream, fmt, batch_size=2000):
+    """
+    Writes every product to a CSV or JSONL text stream. Returns the number of rows written.
+    """
+    count = 0
+    if fmt == 'csv':
+        writer = csv.DictWriter(stream, fieldnames=FIELDS)
+        writer.writeheader()
+        for row in export_rows(batch_size):
+            writer.writerow(row)
+            count += 1
+        return count
+    for row in export_rows(batch_size):
+        stream.write(json.dumps(row, ensure_ascii=False))
+        stream.write('\n')
+        count += 1
+    return count
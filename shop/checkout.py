@@ -0,0 +1,78 @@
+# shop/checkout.py
+# This file turns a logged-in user's database cart into an Order.
+# Everything happens in one transaction:
+#   1. the cart rows are locked (SELECT ... FOR UPDATE; on SQLite the IMMEDIATE transaction mode set in
+#      config/settings.py takes the write lock up front, so concurrent checkouts queue instead of failing
+#      with "database is locked" when they try to upgrade a read lock),
+#   2. the cart is re-priced from Product.price with one joined query,
+#   3. the Order and all its OrderItem lines are inserted (the lines with one bulk_create),
+#   4. the cart is emptied.
+# The checkout form carries a one-time token that is stored on the order, so a double submit
+# returns the order that was already placed instead of creating a second one.
+
+import secrets
+
+from django.db import IntegrityError, transaction
+
+from .cart import forget_user_snapshot
+from .models import CartItem, Order, OrderItem
+
+TOKEN_MAX_LENGTH = Order._meta.get_field('checkout_token').max_length
+
+
+class CheckoutError(Exception):
+    """
+    Raised when an order cannot be placed; the message can be shown to the customer.
+    """
+
+
+def new_checkout_token():
+    """
+    Returns a fresh token for one checkout form.
+    """
+    return secrets.token_urlsafe(24)
+
+
+def place_order(user, token):
+    """
+    Places an order for everything in `user`'s cart and empties the cart.
+    Returns (order, created); `created` is False if an order with this token already exists
+    (the form was submitted twice), in which case nothing else happens.
+    Raises CheckoutError if the token is invalid or the cart is empty.
+    """
+    if not token or len(token) > TOKEN_MAX_LENGTH:
+        raise CheckoutError("Your checkout session expired. Please try again.")
+    with transaction.atomic():
+        existing = Order.objects.filter(checkout_token=token).first()
+        if existing is not None:
+            if existing.user_id != user.pk:
+                raise CheckoutError("Your checkout session expired. Please try again.")
+            return existing, False
+        items = list(
+            CartItem.objects.select_for_update().filter(user=user, quantity__gt=0)
+            .select_related('product').only('id', 'quantity', 'product__id', 'product__name', 'product__price')
+            .order_by()
+        )
+        items.sort(key=lambda item: item.product.name)
+        if not items:
+            raise CheckoutError("Your cart is empty.")
+        total = sum(item.product.price * item.quantity for item in items)
+        try:
+            with transaction.atomic():
+                order = Order.objects.create(user=user, total=total, checkout_token=token)
+        except IntegrityError:
+            # Another request with the same token got there first (only possible without IMMEDIATE locking).
+            return Order.objects.get(checkout_token=token), False
+        OrderItem.objects.bulk_create([
+            OrderItem(
+                order=order,
+                product=item.product,
+                product_name=item.product.name,
+                unit_price=item.product.price,
+                quantity=item.quantity,
+            )
+            for item in items
+        ])
+        CartItem.objects.filter(pk__in=[item.pk for item in items]).delete()
+        transaction.on_commit(lambda: forget_user_snapshot(user.pk))
+    return order, True
@@ -0,0 +1,257 @@
+# shop/facets.py
+# This file contains the faceted filtering of the shop page: categories (any number of them), price ranges
+# and a minimum rating, with the number of products behind every option shown in the sidebar.
+#
+# The counts come from the facet count index (FacetCount): one row per (category, price bucket, rating bucket)
+# with the number of products in it. Stores have a handful of categories, so the index has at most a few
+# hundred rows, and the counts for any combination of filters are sums over it, done in Python.
+# Each facet is counted with the other facets' filters applied but not its own ("disjunctive" counts),
+# so the sidebar shows what checking one more option would add.
+#
+# The index is kept up to date incrementally: a saved or deleted product, or a rating change, moves the
+# product from its old cell to its new one with two F() updates (see shop/signals.py and shop/ratings.py).
+# Bulk writes that skip signals (imports, rebuild_ratings) call rebuild_facet_counts(),
+# and `python manage.py rebuild_facets` rebuilds it by hand.
+
+import bisect
+import math
+from collections import Counter
+from contextlib import contextmanager
+from decimal import Decimal
+
+from django.db import IntegrityError, transaction
+from django.db.models import F, Q
+
+from .models import FacetCount, Product
+
+# (lowest price, label) of each price bucket; a bucket ends where the next one starts.
+PRICE_BUCKETS = [
+    (Decimal('0'), "Under $25"),
+    (Decimal('25'), "$25 to $50"),
+    (Decimal('50'), "$50 to $100"),
+    (Decimal('100'), "$100 to $200"),
+    (Decimal('200'), "$200 and up"),
+]
+_PRICE_BOUNDS = [low for low, _ in PRICE_BUCKETS]
+
+# The "N stars & up" options of the rating facet.
+MIN_RATINGS = [4, 3, 2, 1]
+
+
+def price_bucket(price):
+    """
+    Returns the index in PRICE_BUCKETS of the bucket `price` falls in.
+    """
+    return max(0, bisect.bisect_right(_PRICE_BOUNDS, Decimal(str(price))) - 1)
+
+
+def rating_bucket(rating_avg):
+    """
+    Returns the average rating rounded down (0 to 5); products without reviews have 0.
+    """
+    return min(5, max(0, math.floor(rating_avg or 0)))
+
+
+def product_cell(category_id, price, rating_avg):
+    """
+    Returns the index cell (category_id, price bucket, rating bucket) of a product.
+    """
+    return (category_id, price_bucket(price), rating_bucket(rating_avg))
+
+
+def _add(cell, delta):
+    """
+    Adds `delta` products to one cell with an atomic F() update, creating the row if there is none.
+    """
+    category_id, price, rating = cell
+    rows = FacetCount.objects.filter(category_id=category_id, price_bucket=price, rating_bucket=rating)
+    if rows.update(count=F('count') + delta) or delta < 0:
+        # A missing row cannot lose products (e.g. it was deleted with its category).
+        return
+    try:
+        with transaction.atomic():
+            FacetCount.objects.create(category_id=category_id, price_bucket=price, rating_bucket=rating, count=delta)
+    except IntegrityError:
+        # A concurrent request created the row first; add to it instead.
+        rows.update(count=F('count') + delta)
+
+
+def move_product(old_cell, new_cell):
+    """
+    Moves one product between cells (None for "not in the index": a new or deleted product).
+    """
+    if old_cell == new_cell:
+        return
+    if old_cell is not None:
+        _add(old_cell, -1)
+    if new_cell is not None:
+        _add(new_cell, 1)
+
+
+def current_cells(product_ids):
+    """
+    Returns {product_id: cell} for the given products, as they are in the database now.
+    """
+    rows = Product.objects.filter(pk__in=product_ids).order_by().values_list('id', 'category_id', 'price', 'rating_avg')
+    return {product_id: product_cell(*values) for product_id, *values in rows}
+
+
+@contextmanager
+def tracking(product_ids):
+    """
+    Context manager for updates that bypass Product.save() (e.g. F() rating updates):
+    reads the products' cells before and after the block, and moves the ones that changed.
+    """
+    before = current_cells(product_ids)
+    yield
+    after = current_cells(product_ids)
+    for product_id, cell in before.items():
+        move_product(cell, after.get(product_id))
+
+
+def rebuild_facet_counts(batch_size=2000):
+    """
+    Recomputes the whole index from the product table. Returns the number of cells.
+    """
+    counts = Counter(
+        product_cell(*values)
+        for values in Product.objects.order_by().values_list('category_id', 'price', 'rating_avg').iterator(chunk_size=batch_size)
+    )
+    with transaction.atomic():
+        FacetCount.objects.all().delete()
+        FacetCount.objects.bulk_create(
+            FacetCount(category_id=category_id, price_bucket=price, rating_bucket=rating, count=count)
+            for (category_id, price, rating), count in counts.items()
+        )
+    return len(counts)
+
+
+def _cells_query():
+    return FacetCount.objects.filter(count__gt=0).values_list('category_id', 'price_bucket', 'rating_bucket', 'count')
+
+
+def facet_cells():
+    """
+    Returns every non-empty cell of the index as (category_id, price bucket, rating bucket, count).
+    """
+    return list(_cells_query())
+
+
+async def afacet_cells():
+    """
+    Async version of facet_cells().
+    """
+    return [cell async for cell in _cells_query()]
+
+
+class FacetSelection:
+    """
+    The filters chosen on the shop page (from the query string).
+    Attributes:
+      - categories: The selected Category objects (none means every category).
+      - price_buckets: Indexes of the selected price buckets (none means any price).
+      - min_rating: The minimum average rating, or None.
+    """
+    def __init__(self, categories=(), price_buckets=(), min_rating=None):
+        self.categories = list(categories)
+        self.category_ids = {category.id for category in self.categories}
+        self.price_buckets = set(price_buckets)
+        self.min_rating = min_rating
+
+    @classmethod
+    def from_query(cls, params, categories):
+        """
+        Builds the selection from ?category= (repeatable), ?price= (repeatable bucket indexes) and ?rating=.
+        `categories` are the Category objects of the requested slugs. Invalid prices and ratings are ignored.
+        """
+        prices = set()
+        for value in params.getlist('price'):
+            if value.isdigit() and int(value) < len(PRICE_BUCKETS):
+                prices.add(int(value))
+        rating = params.get('rating', '')
+        min_rating = int(rating) if rating.isdigit() and int(rating) in MIN_RATINGS else None
+        return cls(categories, prices, min_rating)
+
+    def __bool__(self):
+        return bool(self.category_ids or self.price_buckets or self.min_rating)
+
+    def filter(self, queryset):
+        """
+        Applies the selection to a Product queryset.
+        """
+        if len(self.category_ids) == 1:
+            # A single category keeps the (category, name, id) index usable for the listing order.
+            queryset = queryset.filter(category_id=next(iter(self.category_ids)))
+        elif self.category_ids:
+            queryset = queryset.filter(category_id__in=self.category_ids)
+        if self.price_buckets:
+            ranges = Q()
+            for index in self.price_buckets:
+                bounds = Q(price__gte=PRICE_BUCKETS[index][0])
+                if index + 1 < len(PRICE_BUCKETS):
+                    bounds &= Q(price__lt=PRICE_BUCKETS[index + 1][0])
+                ranges |= bounds
+            queryset = queryset.filter(ranges)
+        if self.min_rating:
+            queryset = queryset.filter(rating_avg__gte=self.min_rating)
+        return queryset
+
+    def _matches(self, cell, skip):
+        category_id, price, rating, _ = cell
+        return (
+            (skip == 'category' or not self.category_ids or category_id in self.category_ids)
+            and (skip == 'price' or not self.price_buckets or price in self.price_buckets)
+            and (skip == 'rating' or not self.min_rating or rating >= self.min_rating)
+        )
+
+    def counts(self, cells):
+        """
+        Returns the sidebar counts from the index cells (see facet_cells()):
+        {'categories': {category_id: n}, 'prices': {bucket: n}, 'ratings': {min rating: n}, 'total': n}.
+        Each facet is counted with the other facets' filters applied, but not its own.
+        """
+        categories = Counter()
+        prices = Counter()
+        ratings = Counter()
+        total = 0
+        for cell in cells:
+            category_id, price, rating, count = cell
+            if self._matches(cell, 'category'):
+                categories[category_id] += count
+            if self._matches(cell, 'price'):
+                prices[price] += count
+            if self._matches(cell, 'rating'):
+                for min_rating in MIN_RATINGS:
+                    if rating >= min_rating:
+                        ratings[min_rating] += count
+            if self._matches(cell, None):
+                total += count
+        return {'categories': categories, 'prices': prices, 'ratings': ratings, 'total': total}
+
+    def sidebar(self, all_categories, cells):
+        """
+        Returns the options the sidebar shows, each a dict with 'value', 'label', 'count' and 'selected':
+        {'categories': [...], 'prices': [...], 'ratings': [...], 'total': n}.
+        """
+        counts = self.counts(cells)
+        return {
+            'categories': [
+                {
+                    'value': category.slug, 'label': category.name,
+                    'count': counts['categories'][category.id], 'selected': category.id in self.category_ids,
+                }
+                for category in all_categories
+            ],
+            'prices': [
+                {'value': index, 'label': label, 'count': counts['prices'][index], 'selected': index in self.price_buckets}
+                for index, (_, label) in enumerate(PRICE_BUCKETS)
+            ],
+            'ratings': [
+                {
+                    'value': min_rating, 'label': f"{min_rating} stars & up",
+                    'count': counts['ratings'][min_rating], 'selected': min_rating == self.min_rating,
+                }
+                for min_rating in MIN_RATINGS
+            ],
+            'total': counts['total'],
+        }
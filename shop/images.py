@@ -0,0 +1,183 @@
+# shop/images.py
+# This file builds resized copies ("variants") of product images for responsive <img srcset> markup.
+# For every width in PRODUCT_IMAGE_WIDTHS a WebP and a JPEG copy is written next to the upload,
+# and their file names are stored on Product.image_variants.
+# Resizing runs in a small background thread pool after the product is committed, so saving a
+# product (add_product, edit_product, the admin) returns without waiting for Pillow.
+# `python manage.py build_image_variants` backfills existing images.
+
+import hashlib
+import io
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import connection, transaction
+from django.utils import timezone
+from PIL import Image, UnidentifiedImageError
+
+from .models import Product
+from .versioning import CART_SNAPSHOT, CATALOG, bump_version
+
+logger = logging.getLogger(__name__)
+
+VARIANTS_DIR = 'products/variants'
+
+# (key in image_variants, Pillow format, save options)
+FORMATS = (
+    ('webp', 'WEBP', {'quality': 80, 'method': 4}),
+    ('jpeg', 'JPEG', {'quality': 82, 'optimize': True, 'progressive': True}),
+)
+
+_executor = None
+
+# One lock per source image, so two products sharing an upload never write the same variant file at once.
+_source_locks = {}
+_source_locks_guard = threading.Lock()
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=settings.PRODUCT_IMAGE_WORKERS, thread_name_prefix='image-variants',
+        )
+    return _executor
+
+
+def _source_lock(source_name):
+    with _source_locks_guard:
+        return _source_locks.setdefault(source_name, threading.Lock())
+
+
+def needs_variants(product):
+    """
+    Returns True if the product has an image whose variants were not built yet.
+    """
+    return bool(product.image) and product.image_variants.get('source') != product.image.name
+
+
+def _target_widths(original_width):
+    # Never upscale: keep the widths smaller than the original, or just the original if it is tiny.
+    widths = [width for width in settings.PRODUCT_IMAGE_WIDTHS if width < original_width]
+    return widths or [original_width]
+
+
+def _variant_name(source_name, width, extension):
+    stem = os.path.splitext(os.path.basename(source_name))[0]
+    digest = hashlib.sha1(source_name.encode('utf-8')).hexdigest()[:8]
+    return f'{VARIANTS_DIR}/{stem}-{digest}-{width}.{extension}'
+
+
+def _encode(image, pil_format, options):
+    if pil_format == 'JPEG' and image.mode != 'RGB':
+        # JPEG has no transparency: flatten onto white so transparent PNGs don't turn black.
+        background = Image.new('RGB', image.size, (255, 255, 255))
+        rgba = image.convert('RGBA')
+        background.paste(rgba, mask=rgba.getchannel('A'))
+        image = background
+    elif pil_format == 'WEBP' and image.mode not in ('RGB', 'RGBA'):
+        image = image.convert('RGBA')
+    buffer = io.BytesIO()
+    image.save(buffer, pil_format, **options)
+    return buffer.getvalue()
+
+
+def bump_image_versions():
+    """
+    Cart snapshots and cached pages store image URLs, so let them pick up new variants.
+    """
+    bump_version(CART_SNAPSHOT)
+    bump_version(CATALOG)
+
+
+def build_variants(product, force=False, bump=True):
+    """
+    Resizes the product's image to every configured width in every format and records the results.
+    Variant files are named after the upload, so products sharing an image share its variants;
+    existing files are reused unless `force` is set.
+    The versions are bumped only if the recorded variants changed; callers building many products pass
+    bump=False and call bump_image_versions() once at the end.
+    Runs synchronously; returns the new image_variants dict (empty if the product has no image).
+    Raises FileNotFoundError if the uploaded file is missing.
+    """
+    if not product.image:
+        return {}
+    source_name = product.image.name
+    with default_storage.open(source_name, 'rb') as source:
+        original = Image.open(source)
+        original.load()
+    variants = {'source': source_name}
+    with _source_lock(source_name):
+        for width in _target_widths(original.width):
+            height = max(1, round(original.height * width / original.width))
+            resized = original if width == original.width else original.resize((width, height), Image.LANCZOS)
+            for key, pil_format, options in FORMATS:
+                name = _variant_name(source_name, width, key)
+                if default_storage.exists(name):
+                    if not force:
+                        variants.setdefault(key, {})[str(width)] = name
+                        continue
+                    default_storage.delete(name)
+                saved_name = default_storage.save(name, ContentFile(_encode(resized, pil_format, options)))
+                variants.setdefault(key, {})[str(width)] = saved_name
+    if variants == product.image_variants:
+        return variants
+    # Only record the variants if the image was not replaced while we were resizing.
+    if Product.objects.filter(pk=product.pk, image=source_name).update(
+        image_variants=variants, updated_at=timezone.now(),
+    ):
+        product.image_variants = variants
+        if bump:
+            bump_image_versions()
+    return variants
+
+
+def _build_in_background(product_id):
+    try:
+        product = Product.objects.filter(pk=product_id).first()
+        if product is not None and needs_variants(product):
+            build_variants(product)
+    except (FileNotFoundError, UnidentifiedImageError) as error:
+        # The upload was deleted or isn't an image: nothing to retry, so no traceback.
+        logger.warning("Could not build image variants for product %s: %s", product_id, error)
+    except Exception:
+        logger.exception("Could not build image variants for product %s", product_id)
+    finally:
+        # Worker threads have their own database connection; don't leave it open between jobs.
+        connection.close()
+
+
+def schedule_variants(product):
+    """
+    Queues variant generation for `product` on the background pool once the current transaction commits.
+    """
+    product_id = product.pk
+    transaction.on_commit(lambda: _get_executor().submit(_build_in_background, product_id))
+
+
+def variant_srcset(product, key):
+    """
+    Returns the srcset string ("url 320w, url 640w") for one variant format, or '' if there are none.
+    """
+    widths = product.image_variants.get(key) or {}
+    return ', '.join(
+        f'{default_storage.url(name)} {width}w'
+        for width, name in sorted(widths.items(), key=lambda item: int(item[0]))
+    )
+
+
+def smallest_variant_url(product):
+    """
+    Returns the URL of the smallest JPEG variant (for thumbnails), or None if there are no variants.
+    """
+    if product.image_variants.get('source') != product.image.name:
+        return None
+    widths = product.image_variants.get('jpeg') or {}
+    if not widths:
+        return None
+    return default_storage.url(widths[min(widths, key=int)])
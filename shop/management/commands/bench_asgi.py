@@ -0,0 +1,187 @@
+# shop/management/commands/bench_asgi.py
+# Usage: python manage.py bench_asgi [--concurrency 64] [--requests 1000] [--routes home,shop,...] [--output results.json]
+# Compares the storefront's throughput under WSGI and ASGI at high concurrency, in process:
+#   - wsgi: Django's WSGIHandler called from --concurrency threads, like a threaded WSGI server;
+#   - asgi: Django's ASGIHandler driven by --concurrency coroutines on one event loop, like uvicorn or daphne.
+# Both go through the whole middleware stack against the same seeded throwaway SQLite file (see
+# shop/benchmarking.py); a file is used because an in-memory database locks whole tables between threads.
+# Sockets and HTTP parsing are left out, so the numbers compare Django's own request handling.
+# Reports requests per second and latency percentiles per route and server interface.
+
+import asyncio
+import json
+import os
+import random
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.handlers.asgi import ASGIHandler
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+from django.test import AsyncRequestFactory, RequestFactory
+from django.test.utils import setup_test_environment, teardown_test_environment
+from django.urls import reverse
+
+from shop.benchmarking import StorefrontBenchmark, _percentile, seed_catalog
+
+ROUTES = ['home', 'shop', 'product_detail', 'cart']
+
+
+def _paths(route, benchmark, rng, count):
+    """
+    Returns (path, logged in) for `count` requests of `route`; product pages pick products at random.
+    """
+    if route == 'product_detail':
+        return [(reverse('product_detail', args=[rng.choice(benchmark.slugs)]), False) for _ in range(count)]
+    return [(reverse(route), route == 'cart')] * count
+
+
+def _factories(factory_class, benchmark):
+    anonymous = factory_class()
+    customer = factory_class()
+    customer.cookies = benchmark.customer.cookies
+    return {False: anonymous, True: customer}
+
+
+def _summary(results, seconds):
+    latencies = sorted(latency for latency, _ in results)
+    return {
+        'requests': len(results),
+        'errors': sum(1 for _, status in results if status >= 400),
+        'requests_per_second': round(len(results) / seconds, 1) if seconds else 0.0,
+        'p50_ms': round(_percentile(latencies, 50), 3),
+        'p95_ms': round(_percentile(latencies, 95), 3),
+        'p99_ms': round(_percentile(latencies, 99), 3),
+    }
+
+
+def run_wsgi(paths, benchmark, concurrency):
+    """
+    Sends every request through a WSGIHandler from `concurrency` threads.
+    """
+    handler = WSGIHandler()
+    factories = _factories(RequestFactory, benchmark)
+    environs = [factories[logged_in].get(path).environ for path, logged_in in paths]
+
+    def send(environ):
+        status = []
+        started = time.perf_counter()
+        response = handler(environ, lambda line, headers, exc_info=None: status.append(line))
+        try:
+            b''.join(response)
+        finally:
+            response.close()
+        return (time.perf_counter() - started) * 1000, int(status[0].split()[0])
+
+    def close_connection():
+        connections.close_all()
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        started = time.perf_counter()
+        results = list(pool.map(send, environs))
+        seconds = time.perf_counter() - started
+        # Each thread opened its own database connection.
+        list(pool.map(lambda _: close_connection(), range(concurrency)))
+    return _summary(results, seconds)
+
+
+def run_asgi(paths, benchmark, concurrency):
+    """
+    Sends every request through an ASGIHandler, at most `concurrency` at a time on one event loop.
+    """
+    handler = ASGIHandler()
+    factories = _factories(AsyncRequestFactory, benchmark)
+    scopes = [factories[logged_in].get(path).scope for path, logged_in in paths]
+
+    async def send_all():
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def send_one(scope):
+            request_sent = False
+            status = []
+
+            async def receive():
+                nonlocal request_sent
+                if not request_sent:
+                    request_sent = True
+                    return {'type': 'http.request', 'body': b'', 'more_body': False}
+                # The client never disconnects; the handler cancels this wait once it has responded.
+                await asyncio.Event().wait()
+
+            async def send(message):
+                if message['type'] == 'http.response.start':
+                    status.append(message['status'])
+
+            async with semaphore:
+                started = time.perf_counter()
+                await handler(scope, receive, send)
+                return (time.perf_counter() - started) * 1000, status[0]
+
+        started = time.perf_counter()
+        results = await asyncio.gather(*(send_one(scope) for scope in scopes))
+        return results, time.perf_counter() - started
+
+    results, seconds = asyncio.run(send_all())
+    return _summary(results, seconds)
+
+
+RUNNERS = {'wsgi': run_wsgi, 'asgi': run_asgi}
+
+
+class Command(BaseCommand):
+    help = "Compare storefront throughput under WSGI (threads) and ASGI (event loop) at high concurrency."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, default=1000, help="Products in the seeded catalog.")
+        parser.add_argument('--users', type=int, default=100, help="Users in the seeded catalog.")
+        parser.add_argument('--reviews', type=int, default=3000, help="Reviews in the seeded catalog.")
+        parser.add_argument('--concurrency', type=int, default=64, help="Requests in flight at once.")
+        parser.add_argument('--requests', type=int, default=1000, help="Timed requests per route and interface.")
+        parser.add_argument('--warmup', type=int, default=50, help="Untimed requests per route and interface first.")
+        parser.add_argument('--routes', default=','.join(ROUTES), help="Comma-separated routes to measure.")
+        parser.add_argument('--seed', type=int, default=0, help="Random seed for the catalog and the requests.")
+        parser.add_argument('--output', help="Write the results to this JSON file.")
+
+    def handle(self, *args, **options):
+        routes = [route.strip() for route in options['routes'].split(',') if route.strip()]
+        unknown = set(routes) - set(ROUTES)
+        if unknown:
+            raise CommandError(f"Unknown routes: {', '.join(sorted(unknown))}. Choose from {', '.join(ROUTES)}.")
+        if connection.vendor != 'sqlite':
+            raise CommandError("bench_asgi only supports SQLite.")
+        results = {}
+        with tempfile.TemporaryDirectory() as directory:
+            connection.settings_dict.setdefault('TEST', {})['NAME'] = os.path.join(directory, 'bench.sqlite3')
+            setup_test_environment()
+            old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+            try:
+                self.stdout.write(f"Seeding {options['products']} products...")
+                seed_catalog(options['products'], max(1, options['users']), options['reviews'], seed=options['seed'])
+                benchmark = StorefrontBenchmark(seed=options['seed'])
+                connections.close_all()
+                for route in routes:
+                    rng = random.Random(options['seed'])
+                    warmup = _paths(route, benchmark, rng, options['warmup'])
+                    paths = _paths(route, benchmark, rng, options['requests'])
+                    for interface, run in RUNNERS.items():
+                        run(warmup, benchmark, options['concurrency'])
+                        results.setdefault(route, {})[interface] = run(paths, benchmark, options['concurrency'])
+            finally:
+                connection.creation.destroy_test_db(old_name, verbosity=0)
+                teardown_test_environment()
+
+        self.stdout.write(
+            f"{'route':<16}{'interface':<10}{'req/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'errors':>8}"
+        )
+        for route, interfaces in results.items():
+            for interface, result in interfaces.items():
+                self.stdout.write(
+                    f"{route:<16}{interface:<10}{result['requests_per_second']:>10.1f}{result['p50_ms']:>10.2f}"
+                    f"{result['p95_ms']:>10.2f}{result['p99_ms']:>10.2f}{result['errors']:>8}"
+                )
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                json.dump({'concurrency': options['concurrency'], 'routes': results}, output, indent=2)
+            self.stdout.write(f"Results written to {options['output']}.")
@@ -0,0 +1,214 @@
+# shop/management/commands/bench_sessions.py
+# Usage: python manage.py bench_sessions [--visitors 200] [--clicks 10] [--concurrency 16] [--output results.json]
+# Measures "Add to cart" throughput for visitors who are not logged in (their cart lives in the session)
+# under each session engine:
+#   - db: django.contrib.sessions.backends.db, one django_session row write per click;
+#   - cached_db: django.contrib.sessions.backends.cached_db, reads from the cache, still one row write per click;
+#   - coalesced: shop.sessions, changed sessions written to the database in batches. Coalescing needs a
+#     sessions cache shared between processes and a SESSION_WRITE_DELAY (--write-delay), which this run
+#     sets up with a file-based cache in the throwaway directory.
+# Every click goes through Django's WSGIHandler from --concurrency threads, against a seeded throwaway
+# SQLite file (see bench_asgi). After each run the carts are read back from the database, bypassing the
+# cache, to check that no click was lost.
+# Reports clicks per second, latency percentiles, session row writes and lost clicks per engine.
+
+import json
+import os
+import random
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.cookies import SimpleCookie
+
+from django.conf import settings
+from django.contrib.sessions.models import Session
+from django.core.cache import caches
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+from django.db.backends.signals import connection_created
+from django.test import RequestFactory
+from django.test.utils import override_settings, setup_test_environment, teardown_test_environment
+from django.urls import reverse
+from django.utils.crypto import get_random_string
+
+from shop.benchmarking import _percentile, seed_catalog
+from shop.cart import CART_SESSION_KEY
+from shop.models import Product
+from shop.sessions import flush_sessions
+
+ENGINES = {
+    'db': 'django.contrib.sessions.backends.db',
+    'cached_db': 'django.contrib.sessions.backends.cached_db',
+    'coalesced': 'shop.sessions',
+}
+
+
+class _Visitor:
+    """
+    One browser: its CSRF token, and its session cookie once the first click has created it.
+    """
+    def __init__(self):
+        self.csrf_token = get_random_string(32)
+        self.session_key = None
+
+    def environ(self, factory, path):
+        cookies = f'{settings.CSRF_COOKIE_NAME}={self.csrf_token}'
+        if self.session_key:
+            cookies += f'; {settings.SESSION_COOKIE_NAME}={self.session_key}'
+        return factory.post(
+            path, HTTP_COOKIE=cookies, HTTP_X_CSRFTOKEN=self.csrf_token, HTTP_X_REQUESTED_WITH='XMLHttpRequest',
+        ).environ
+
+
+def _run(engine, visitors, slugs, clicks, concurrency, seed):
+    """
+    Sends `clicks` add-to-cart requests per visitor with the given session engine and returns its result dict.
+    A visitor's clicks are sent one after the other, like a browser would; --concurrency visitors click at once.
+    """
+    handler = WSGIHandler()
+    factory = RequestFactory()
+    rng = random.Random(seed)
+    plans = {visitor: [rng.choice(slugs) for _ in range(clicks)] for visitor in visitors}
+
+    def click(visitor, slug):
+        headers = []
+        started = time.perf_counter()
+        response = handler(
+            visitor.environ(factory, reverse('add_to_cart', args=[slug])),
+            lambda status, response_headers, exc_info=None: headers.extend([('status', status)] + response_headers),
+        )
+        try:
+            b''.join(response)
+        finally:
+            response.close()
+        latency = (time.perf_counter() - started) * 1000
+        for name, value in headers:
+            cookie = SimpleCookie(value) if name == 'Set-Cookie' else {}
+            if settings.SESSION_COOKIE_NAME in cookie:
+                visitor.session_key = cookie[settings.SESSION_COOKIE_NAME].value
+        return latency, int(headers[0][1].split()[0])
+
+    writes = []
+
+    def count_writes(execute, sql, params, many, context):
+        if sql.startswith(('INSERT INTO "django_session"', 'UPDATE "django_session"')):
+            writes.append(1)
+        return execute(sql, params, many, context)
+
+    def instrument(sender, connection, **kwargs):
+        # Every connection opened from here on, including the session writer thread's, counts its writes.
+        # It goes first: connection.execute_wrapper() (used by shop/profiling.py) removes the last wrapper.
+        connection.execute_wrappers.insert(0, count_writes)
+
+    connections.close_all()
+    connection_created.connect(instrument)
+    try:
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            # Each visitor's first click creates its session and is not timed.
+            list(pool.map(lambda visitor: click(visitor, plans[visitor][0]), visitors))
+            if engine == 'coalesced':
+                flush_sessions()
+            writes.clear()
+            started = time.perf_counter()
+            results = [
+                result
+                for visitor_results in pool.map(
+                    lambda visitor: [click(visitor, slug) for slug in plans[visitor][1:]], visitors,
+                )
+                for result in visitor_results
+            ]
+            seconds = time.perf_counter() - started
+            if engine == 'coalesced':
+                flush_sessions()
+            list(pool.map(lambda _: connections.close_all(), range(concurrency)))
+    finally:
+        connection_created.disconnect(instrument)
+        connections.close_all()
+
+    latencies = sorted(latency for latency, _ in results)
+    # Every click adds one item, so each stored cart should hold `clicks` items.
+    lost = 0
+    for session in Session.objects.filter(session_key__in=[visitor.session_key for visitor in visitors]):
+        lost += clicks - sum(session.get_decoded().get(CART_SESSION_KEY, {}).values())
+    lost += clicks * sum(1 for visitor in visitors if visitor.session_key is None)
+    return {
+        'clicks': len(results),
+        'errors': sum(1 for _, status in results if status >= 400),
+        'clicks_per_second': round(len(results) / seconds, 1) if seconds else 0.0,
+        'p50_ms': round(_percentile(latencies, 50), 3),
+        'p95_ms': round(_percentile(latencies, 95), 3),
+        'p99_ms': round(_percentile(latencies, 99), 3),
+        'session_writes': len(writes),
+        'lost_clicks': lost,
+    }
+
+
+class Command(BaseCommand):
+    help = "Compare add-to-cart throughput for anonymous visitors under each session engine."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, default=200, help="Products in the seeded catalog.")
+        parser.add_argument('--visitors', type=int, default=200, help="Visitors (sessions) clicking at once.")
+        parser.add_argument('--clicks', type=int, default=10, help="Add-to-cart clicks per visitor.")
+        parser.add_argument('--concurrency', type=int, default=16, help="Requests in flight at once.")
+        parser.add_argument('--engines', default=','.join(ENGINES), help="Comma-separated engines to measure.")
+        parser.add_argument('--write-delay', type=float, default=1.0, help="SESSION_WRITE_DELAY of the coalesced run.")
+        parser.add_argument('--seed', type=int, default=0, help="Random seed for the catalog and the clicks.")
+        parser.add_argument('--output', help="Write the results to this JSON file.")
+
+    def handle(self, *args, **options):
+        engines = [engine.strip() for engine in options['engines'].split(',') if engine.strip()]
+        unknown = set(engines) - set(ENGINES)
+        if unknown:
+            raise CommandError(f"Unknown engines: {', '.join(sorted(unknown))}. Choose from {', '.join(ENGINES)}.")
+        if connection.vendor != 'sqlite':
+            raise CommandError("bench_sessions only supports SQLite.")
+        if options['clicks'] < 2:
+            raise CommandError("--clicks must be at least 2 (the first click of each visitor is not timed).")
+        results = {}
+        with tempfile.TemporaryDirectory() as directory:
+            connection.settings_dict.setdefault('TEST', {})['NAME'] = os.path.join(directory, 'bench.sqlite3')
+            setup_test_environment()
+            old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+            try:
+                self.stdout.write(f"Seeding {options['products']} products...")
+                seed_catalog(options['products'], 1, 0, seed=options['seed'])
+                slugs = list(Product.objects.values_list('slug', flat=True))
+                connections.close_all()
+                coalescing = {
+                    'CACHES': {**settings.CACHES, settings.SESSION_CACHE_ALIAS: {
+                        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+                        'LOCATION': os.path.join(directory, 'sessions'),
+                        'OPTIONS': {'MAX_ENTRIES': 100000},
+                    }},
+                    'SESSION_WRITE_DELAY': options['write_delay'],
+                }
+                for name in engines:
+                    Session.objects.all().delete()
+                    visitors = [_Visitor() for _ in range(options['visitors'])]
+                    with override_settings(SESSION_ENGINE=ENGINES[name], **(coalescing if name == 'coalesced' else {})):
+                        caches[settings.SESSION_CACHE_ALIAS].clear()
+                        results[name] = _run(
+                            name, visitors, slugs, options['clicks'], options['concurrency'], options['seed'],
+                        )
+            finally:
+                connection.creation.destroy_test_db(old_name, verbosity=0)
+                teardown_test_environment()
+
+        self.stdout.write(
+            f"{'engine':<12}{'clicks/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}"
+            f"{'writes':>8}{'errors':>8}{'lost':>6}"
+        )
+        for name, result in results.items():
+            self.stdout.write(
+                f"{name:<12}{result['clicks_per_second']:>10.1f}{result['p50_ms']:>10.2f}{result['p95_ms']:>10.2f}"
+                f"{result['p99_ms']:>10.2f}{result['session_writes']:>8}{result['errors']:>8}{result['lost_clicks']:>6}"
+            )
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                json.dump({
+                    'visitors': options['visitors'], 'clicks': options['clicks'],
+                    'concurrency': options['concurrency'], 'write_delay': options['write_delay'], 'engines': results,
+                }, output, indent=2)
+            self.stdout.write(f"Results written to {options['output']}.")
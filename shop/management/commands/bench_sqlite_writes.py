@@ -0,0 +1,157 @@
+# shop/management/commands/bench_sqlite_writes.py
+# Usage: python manage.py bench_sqlite_writes [--threads 8] [--transactions 200] [--output results.json]
+# Measures SQLite write throughput under concurrent writers, before and after the tuning in config/database.py.
+# Each transaction imitates a review submission plus a session save: read the product, insert a review row,
+# bump the product's rating counters, and upsert a session row. Two setups run against fresh temporary files:
+#   - default: SQLite's defaults (rollback journal, synchronous=FULL, deferred transactions, 5 s timeout)
+#     and a new connection for every transaction, like Django with CONN_MAX_AGE = 0;
+#   - tuned: SQLITE_PRAGMAS, IMMEDIATE transactions and one persistent connection per thread.
+# Reports commits per second, latency percentiles and how many transactions failed with "database is locked".
+
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+
+from django.core.management.base import BaseCommand
+
+from config.database import apply_pragmas, sqlite_pragmas
+
+SCHEMA = [
+    "CREATE TABLE product (id INTEGER PRIMARY KEY, rating_count INTEGER NOT NULL, rating_sum INTEGER NOT NULL)",
+    "CREATE TABLE review (id INTEGER PRIMARY KEY, product_id INTEGER NOT NULL, rating INTEGER NOT NULL, comment TEXT NOT NULL)",
+    "CREATE INDEX review_product ON review (product_id)",
+    "CREATE TABLE session (session_key TEXT PRIMARY KEY, session_data TEXT NOT NULL, expire_date REAL NOT NULL)",
+]
+
+PRODUCTS = 1000
+
+
+def _percentile(sorted_values, percent):
+    if not sorted_values:
+        return 0.0
+    rank = max(1, round(percent / 100 * len(sorted_values)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+def _create_database(path):
+    connection = sqlite3.connect(path)
+    for statement in SCHEMA:
+        connection.execute(statement)
+    connection.executemany(
+        "INSERT INTO product (id, rating_count, rating_sum) VALUES (?, 0, 0)", [(i,) for i in range(PRODUCTS)],
+    )
+    connection.commit()
+    connection.close()
+
+
+def _transaction(connection, thread_id, number, begin):
+    product_id = (thread_id * 7919 + number) % PRODUCTS
+    connection.execute(begin)
+    try:
+        # Views read before they write (get_object_or_404, then save), which is what makes deferred
+        # transactions fail: their read lock cannot be upgraded while another connection writes.
+        connection.execute("SELECT rating_count FROM product WHERE id = ?", (product_id,)).fetchone()
+        connection.execute(
+            "INSERT INTO review (product_id, rating, comment) VALUES (?, ?, ?)",
+            (product_id, number % 5 + 1, "Benchmark review " * 10),
+        )
+        connection.execute(
+            "UPDATE product SET rating_count = rating_count + 1, rating_sum = rating_sum + ? WHERE id = ?",
+            (number % 5 + 1, product_id),
+        )
+        connection.execute(
+            "INSERT INTO session (session_key, session_data, expire_date) VALUES (?, ?, ?) "
+            "ON CONFLICT (session_key) DO UPDATE SET session_data = excluded.session_data, expire_date = excluded.expire_date",
+            (f'session-{thread_id}', 'x' * 512, time.time() + 3600),
+        )
+        connection.execute("COMMIT")
+    except Exception:
+        if connection.in_transaction:
+            connection.execute("ROLLBACK")
+        raise
+
+
+def _run(path, tuned, threads, transactions):
+    latencies = []
+    locked = []
+    lock = threading.Lock()
+
+    def worker(thread_id):
+        own_latencies = []
+        own_locked = 0
+        persistent = None
+        if tuned:
+            persistent = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+            apply_pragmas(persistent, sqlite_pragmas())
+        for number in range(transactions):
+            started = time.perf_counter()
+            connection = persistent or sqlite3.connect(path, isolation_level=None, timeout=5)
+            try:
+                _transaction(connection, thread_id, number, "BEGIN IMMEDIATE" if tuned else "BEGIN")
+                own_latencies.append((time.perf_counter() - started) * 1000)
+            except sqlite3.OperationalError as error:
+                if 'locked' not in str(error):
+                    raise
+                own_locked += 1
+            finally:
+                if persistent is None:
+                    connection.close()
+        if persistent is not None:
+            persistent.close()
+        with lock:
+            latencies.extend(own_latencies)
+            locked.append(own_locked)
+
+    workers = [threading.Thread(target=worker, args=(thread_id,)) for thread_id in range(threads)]
+    started = time.perf_counter()
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    return {
+        'committed': len(latencies),
+        'locked_errors': sum(locked),
+        'seconds': round(elapsed, 3),
+        'commits_per_second': round(len(latencies) / elapsed, 1) if elapsed else 0.0,
+        'p50_ms': round(_percentile(latencies, 50), 3),
+        'p95_ms': round(_percentile(latencies, 95), 3),
+        'p99_ms': round(_percentile(latencies, 99), 3),
+    }
+
+
+class Command(BaseCommand):
+    help = "Compare SQLite write throughput with default settings and with the project's tuning."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=8, help="Concurrent writers.")
+        parser.add_argument('--transactions', type=int, default=200, help="Transactions per writer.")
+        parser.add_argument('--output', help="Write the results to this JSON file.")
+
+    def handle(self, *args, **options):
+        results = {}
+        with tempfile.TemporaryDirectory() as directory:
+            for name, tuned in (('default', False), ('tuned', True)):
+                path = os.path.join(directory, f'{name}.sqlite3')
+                _create_database(path)
+                results[name] = _run(path, tuned, options['threads'], options['transactions'])
+
+        self.stdout.write(
+            f"{'setup':<10}{'commits/s':>12}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'locked':>8}"
+        )
+        for name, result in results.items():
+            self.stdout.write(
+                f"{name:<10}{result['commits_per_second']:>12.1f}{result['p50_ms']:>10.2f}"
+                f"{result['p95_ms']:>10.2f}{result['p99_ms']:>10.2f}{result['locked_errors']:>8}"
+            )
+        if results['default']['commits_per_second']:
+            speedup = results['tuned']['commits_per_second'] / results['default']['commits_per_second']
+            self.stdout.write(self.style.SUCCESS(f"Tuned settings: {speedup:.1f}x the write throughput."))
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                json.dump({'threads': options['threads'], 'transactions': options['transactions'], 'results': results}, output, indent=2)
+            self.stdout.write(f"Results written to {options['output']}.")
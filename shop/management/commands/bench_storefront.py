@@ -0,0 +1,96 @@
+# shop/management/commands/bench_storefront.py
+# Usage: python manage.py bench_storefront [--size small|medium|large] [--products N] [--users N] [--reviews N]
+#                                          [--requests N] [--routes home,shop,...] [--output results.json]
+#                                          [--compare baseline.json] [--threshold 0.2] [--db-file bench.sqlite3]
+# Benchmarks the storefront request paths (see shop/benchmarking.py) against a freshly seeded
+# throwaway SQLite database; the project's own database is never touched.
+# Prints p50/p95/p99 latency, queries per request and peak memory per route, optionally saves them as JSON,
+# and with --compare exits with an error if p95 latency or query counts regressed against an earlier run.
+
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import setup_test_environment, teardown_test_environment
+from django.utils import timezone
+
+from shop.benchmarking import ROUTES, SIZES, compare, environment, run_benchmark, seed_catalog
+from shop.review_queue import flush_reviews
+
+
+class Command(BaseCommand):
+    help = "Benchmark the storefront routes against a seeded throwaway database."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--size', choices=sorted(SIZES), default='small', help="Catalog size preset.")
+        parser.add_argument('--products', type=int, help="Override the number of products.")
+        parser.add_argument('--users', type=int, help="Override the number of users.")
+        parser.add_argument('--reviews', type=int, help="Override the number of reviews.")
+        parser.add_argument('--requests', type=int, default=200, help="Timed requests per route.")
+        parser.add_argument('--warmup', type=int, default=10, help="Untimed requests per route before timing.")
+        parser.add_argument('--memory-samples', type=int, default=5, help="Requests per route traced for peak memory.")
+        parser.add_argument('--routes', default=','.join(ROUTES), help="Comma-separated routes to measure.")
+        parser.add_argument('--seed', type=int, default=0, help="Random seed for the catalog and the requests.")
+        parser.add_argument('--db-file', help="Keep the seeded database in this file instead of in memory.")
+        parser.add_argument('--output', help="Write the results to this JSON file.")
+        parser.add_argument('--compare', help="Earlier JSON results to check for regressions.")
+        parser.add_argument('--threshold', type=float, default=0.2, help="Allowed growth before a regression (0.2 = 20%%).")
+
+    def handle(self, *args, **options):
+        routes = [route.strip() for route in options['routes'].split(',') if route.strip()]
+        unknown = set(routes) - set(ROUTES)
+        if unknown:
+            raise CommandError(f"Unknown routes: {', '.join(sorted(unknown))}. Choose from {', '.join(ROUTES)}.")
+        products, users, reviews = SIZES[options['size']]
+        products = options['products'] if options['products'] is not None else products
+        users = max(1, options['users'] if options['users'] is not None else users)
+        reviews = options['reviews'] if options['reviews'] is not None else reviews
+
+        if options['db_file']:
+            connection.settings_dict.setdefault('TEST', {})['NAME'] = options['db_file']
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            self.stdout.write(f"Seeding {products} products, {users} users and {reviews} reviews...")
+            seconds = seed_catalog(products, users, reviews, seed=options['seed'])
+            self.stdout.write(f"Seeded in {seconds:.1f}s.")
+            results = run_benchmark(
+                routes=routes,
+                requests=options['requests'],
+                warmup=options['warmup'],
+                memory_samples=options['memory_samples'],
+                seed=options['seed'],
+            )
+        finally:
+            # Reviews still in the write-behind queue (with --db-file) go to the database before it is closed.
+            flush_reviews()
+            connection.creation.destroy_test_db(old_name, verbosity=0, keepdb=bool(options['db_file']))
+            teardown_test_environment()
+
+        self.stdout.write(f"{'route':<16}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'queries':>10}{'peak KB':>10}{'errors':>8}")
+        for route, result in results.items():
+            self.stdout.write(
+                f"{route:<16}{result['p50_ms']:>10.2f}{result['p95_ms']:>10.2f}{result['p99_ms']:>10.2f}"
+                f"{result['queries_mean']:>10.1f}{result['peak_memory_kb']:>10.1f}{result['errors']:>8}"
+            )
+
+        report = {
+            'created_at': timezone.now().isoformat(),
+            'environment': environment(),
+            'catalog': {'products': products, 'users': users, 'reviews': reviews, 'seed': options['seed']},
+            'routes': results,
+        }
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                json.dump(report, output, indent=2)
+            self.stdout.write(f"Results written to {options['output']}.")
+
+        if options['compare']:
+            with open(options['compare']) as baseline_file:
+                baseline = json.load(baseline_file)
+            regressions = compare(results, baseline.get('routes', {}), options['threshold'])
+            for route, metric, old, new in regressions:
+                self.stderr.write(f"{route}: {metric} went from {old} to {new}")
+            if regressions:
+                raise CommandError(f"{len(regressions)} regression(s) against {options['compare']}.")
+            self.stdout.write(self.style.SUCCESS(f"No regressions against {options['compare']}."))
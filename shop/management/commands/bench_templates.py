@@ -0,0 +1,198 @@
+# shop/management/commands/bench_templates.py
+# Usage: python manage.py bench_templates [--iterations 200] [--products 200] [--output results.json]
+# Measures what each template costs, against a seeded throwaway in-memory database (see bench_storefront).
+# The storefront pages are requested once through the test client, and the context every template
+# (page, layout, include, crispy form template) was rendered with is recorded. Each template is then:
+#   - parsed from its source (what the cached loader saves on every later use);
+#   - rendered cold, right after the template cache was emptied (the first request of a worker without
+#     the startup warmup of shop/templating.py);
+#   - rendered warm --iterations times, with the {% cache %} fragments in use and with them disabled.
+# The recommendations sections of detail.html (two loops over the same products) are measured apart,
+# by rendering the page with and without them.
+# Templates that no page renders (e.g. most of the crispy pack) are only parsed.
+
+import json
+import time
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.template import engines
+from django.test import Client
+from django.test.signals import template_rendered
+from django.test.utils import (
+    CaptureQueriesContext, override_settings, setup_test_environment, teardown_test_environment,
+)
+from django.urls import reverse
+
+from shop.benchmarking import _percentile, seed_catalog
+from shop.models import Product, ProductRecommendation
+from shop.templating import warmup_template_names
+
+# Fragment caching off: {% cache %} uses the default cache, which never stores anything here.
+NO_FRAGMENT_CACHE = {**settings.CACHES, 'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}}
+
+
+def _capture_contexts():
+    """
+    Requests every storefront page once and returns {template name: (context dict, request)}
+    with the first context each template was rendered with.
+    """
+    contexts = {}
+
+    def record(sender, template, context, **kwargs):
+        if template.name and template.name not in contexts:
+            contexts[template.name] = (context.flatten(), getattr(context, 'request', None))
+
+    staff = User.objects.create_user('bench-staff', is_staff=True)
+    product = Product.objects.get(pk=ProductRecommendation.objects.exclude(product_ids=[]).values('pk')[:1])
+    Product.objects.filter(pk=product.pk).update(created_by=staff)
+    anonymous, customer = Client(), Client()
+    customer.force_login(staff)
+    customer.post(reverse('add_to_cart', args=[product.slug]), HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+    caches['default'].clear()  # So no page comes from the page cache
+    template_rendered.connect(record)
+    try:
+        for path in [
+            reverse('home'), reverse('about'), reverse('shop'), reverse('product_feed'), reverse('contact'),
+            reverse('product_detail', args=[product.slug]), f"{reverse('search')}?q={product.name.split()[0]}",
+            # reverse('login') finds django.contrib.auth's login view (config/urls.py), not the shop's.
+            '/login/', reverse('register'),
+        ]:
+            anonymous.get(path)
+        for path in [
+            reverse('dashboard'), reverse('cart'), reverse('checkout'), reverse('add_product'),
+            reverse('edit_product', args=[product.slug]), reverse('profiling_dashboard'),
+        ]:
+            customer.get(path)
+    finally:
+        template_rendered.disconnect(record)
+    return contexts
+
+
+def _render_times(template, context, request, iterations):
+    times = []
+    for _ in range(iterations):
+        started = time.perf_counter()
+        template.render(context, request)
+        times.append((time.perf_counter() - started) * 1000)
+    return sorted(times)
+
+
+def _measure(name, captured, iterations):
+    """
+    Returns the result dict of one template (only the parse time if no page rendered it).
+    """
+    engine = engines['django']
+    source = engine.get_template(name).template.source
+    parses = []
+    for _ in range(20):
+        started = time.perf_counter()
+        engine.from_string(source)
+        parses.append((time.perf_counter() - started) * 1000)
+    result = {'parse_ms': round(sorted(parses)[len(parses) // 2], 3)}
+    if name not in captured:
+        return result
+    context, request = captured[name]
+
+    engine.engine.template_loaders[0].reset()  # The cached loader
+    started = time.perf_counter()
+    engine.get_template(name).render(context, request)
+    result['cold_ms'] = round((time.perf_counter() - started) * 1000, 3)
+
+    template = engine.get_template(name)
+    with CaptureQueriesContext(connection) as queries:
+        template.render(context, request)
+    warm = _render_times(template, context, request, iterations)
+    with override_settings(CACHES=NO_FRAGMENT_CACHE):
+        uncached = _render_times(template, context, request, iterations)
+    result.update({
+        'warm_p50_ms': round(_percentile(warm, 50), 3),
+        'warm_p95_ms': round(_percentile(warm, 95), 3),
+        'no_fragment_cache_p50_ms': round(_percentile(uncached, 50), 3),
+        'queries': len(queries),
+    })
+    return result
+
+
+def _measure_recommendations(captured, iterations):
+    """
+    Renders detail.html (fragment caching off) with and without its recommendations. Returns the result dict.
+    """
+    context, request = captured['shop/detail.html']
+    template = engines['django'].get_template('shop/detail.html')
+    with override_settings(CACHES=NO_FRAGMENT_CACHE):
+        full = _render_times(template, context, request, iterations)
+        without = _render_times(template, {**context, 'recommendations': []}, request, iterations)
+    full, without = _percentile(full, 50), _percentile(without, 50)
+    return {
+        'products': len(context['recommendations']),
+        'page_p50_ms': round(full, 3),
+        'without_recommendations_p50_ms': round(without, 3),
+        'recommendations_ms': round(full - without, 3),
+        'share': round((full - without) / full, 3) if full else 0.0,
+    }
+
+
+class Command(BaseCommand):
+    help = "Measure the parse and render time of every template."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=200, help="Timed renders per template.")
+        parser.add_argument('--products', type=int, default=200, help="Products in the seeded catalog.")
+        parser.add_argument('--reviews', type=int, default=1000, help="Reviews in the seeded catalog.")
+        parser.add_argument('--seed', type=int, default=0, help="Random seed for the catalog.")
+        parser.add_argument('--output', help="Write the results to this JSON file.")
+
+    def handle(self, *args, **options):
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            self.stdout.write(f"Seeding {options['products']} products and {options['reviews']} reviews...")
+            seed_catalog(options['products'], 20, options['reviews'], seed=options['seed'])
+            captured = _capture_contexts()
+            names = warmup_template_names()
+            # Cold compile of everything shop/templating.py warms at startup.
+            engines['django'].engine.template_loaders[0].reset()
+            started = time.perf_counter()
+            for name in names:
+                engines['django'].get_template(name)
+            warmup_ms = (time.perf_counter() - started) * 1000
+            results = {name: _measure(name, captured, options['iterations']) for name in names}
+            recommendations = _measure_recommendations(captured, options['iterations'])
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+        self.stdout.write(
+            f"{'template':<44}{'parse ms':>10}{'cold ms':>10}{'p50 ms':>10}{'p95 ms':>10}"
+            f"{'no frag ms':>12}{'queries':>9}"
+        )
+        for name, result in results.items():
+            if 'cold_ms' not in result:
+                continue
+            self.stdout.write(
+                f"{name:<44}{result['parse_ms']:>10.3f}{result['cold_ms']:>10.3f}{result['warm_p50_ms']:>10.3f}"
+                f"{result['warm_p95_ms']:>10.3f}{result['no_fragment_cache_p50_ms']:>12.3f}{result['queries']:>9}"
+            )
+        parsed_only = [name for name, result in results.items() if 'cold_ms' not in result]
+        self.stdout.write(
+            f"Not rendered by any page (parse ms only): "
+            + ', '.join(f"{name} {results[name]['parse_ms']:.3f}" for name in parsed_only if name.startswith('shop/'))
+            + f" and {sum(1 for name in parsed_only if not name.startswith('shop/'))} crispy templates."
+        )
+        self.stdout.write(f"Startup warmup: {len(names)} templates compiled in {warmup_ms:.1f} ms.")
+        self.stdout.write(
+            f"detail.html recommendations ({recommendations['products']} products, two loops): "
+            f"{recommendations['recommendations_ms']:.3f} ms of {recommendations['page_p50_ms']:.3f} ms "
+            f"({recommendations['share']:.0%}) without fragment caching."
+        )
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                json.dump({
+                    'iterations': options['iterations'], 'warmup_ms': round(warmup_ms, 3),
+                    'templates': results, 'detail_recommendations': recommendations,
+                }, output, indent=2)
+            self.stdout.write(f"Results written to {options['output']}.")
@@ -0,0 +1,53 @@
+# shop/management/commands/build_image_variants.py
+# Usage: python manage.py build_image_variants [--all] [--workers N]
+# Backfills the resized WebP/JPEG variants of product images (see shop/images.py).
+# By default only products whose variants are missing or out of date are processed.
+# The catalog and cart snapshot versions are bumped once at the end, if any product's variants changed.
+
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from shop.images import build_variants, bump_image_versions, needs_variants
+from shop.models import Product
+
+
+def _build(product, force):
+    """
+    Returns True if the product's recorded variants changed.
+    """
+    before = product.image_variants
+    try:
+        return build_variants(product, force=force, bump=False) != before
+    finally:
+        connection.close()
+
+
+class Command(BaseCommand):
+    help = "Generate resized image variants for product images."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true', help="Rebuild (and rewrite) variants even if they are up to date.")
+        parser.add_argument('--workers', type=int, default=4, help="Images resized in parallel.")
+
+    def handle(self, *args, **options):
+        products = Product.objects.exclude(image='').only('id', 'name', 'image', 'image_variants')
+        pending = [
+            product for product in products.iterator()
+            if options['all'] or needs_variants(product)
+        ]
+        built = failed = changed = 0
+        with ThreadPoolExecutor(max_workers=options['workers']) as pool:
+            futures = {pool.submit(_build, product, options['all']): product for product in pending}
+            for future in as_completed(futures):
+                product = futures[future]
+                try:
+                    changed += future.result()
+                    built += 1
+                except Exception as error:
+                    failed += 1
+                    self.stderr.write(f"{product.image.name}: {error}")
+        if changed:
+            bump_image_versions()
+        self.stdout.write(self.style.SUCCESS(f"Built variants for {built} products ({failed} failed)."))
@@ -0,0 +1,22 @@
+# shop/management/commands/build_recommendations.py
+# Usage: python manage.py build_recommendations [--stale-only] [--batch-size N]
+# Precomputes the "related items" of every product (see shop/recommendations.py).
+# Run it nightly so cart and order co-occurrences are picked up, and with --stale-only every few
+# minutes: a product save only rebuilds a bounded number of the rows it marks stale (see shop/signals.py),
+# and product pages never rebuild theirs. `migrate` builds the missing rows itself.
+
+from django.core.management.base import BaseCommand
+
+from shop.recommendations import build_all
+
+
+class Command(BaseCommand):
+    help = "Rebuild the precomputed related-item recommendations of every product."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--stale-only', action='store_true', help="Only rebuild missing or stale rows.")
+        parser.add_argument('--batch-size', type=int, default=1000, help="Rows written per bulk upsert.")
+
+    def handle(self, *args, **options):
+        written = build_all(batch_size=options['batch_size'], stale_only=options['stale_only'])
+        self.stdout.write(self.style.SUCCESS(f"Built recommendations for {written} products."))
@@ -0,0 +1,157 @@
+# shop/management/commands/explain_queries.py
+# Usage: python manage.py explain_queries [--products N] [--reviews N] [--verbose]
+# Checks that the storefront's queries use indexes. It seeds a throwaway SQLite database
+# (see shop/benchmarking.py), requests every main page with an empty cache, and runs
+# EXPLAIN QUERY PLAN on each SELECT the page made. A query is flagged when SQLite plans:
+#   - a full table scan ("SCAN <table>" without an index) that is not cut short by a LIMIT, or
+#   - a sort it cannot take from an index ("USE TEMP B-TREE FOR ORDER BY").
+# Full-text queries are exempt from the sort check: ranking by relevance always needs a sort.
+# Exits with an error when anything is flagged, so it can run in CI to catch index regressions.
+
+import json
+import re
+
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import CaptureQueriesContext, setup_test_environment, teardown_test_environment
+from django.urls import reverse
+
+from shop.benchmarking import StorefrontBenchmark, seed_catalog
+from shop.catalog import encode_cursor
+from shop.models import Category, Product
+
+# Tables that are read in full on purpose (the sidebar lists every category, and sums its counts
+# over the facet count index, which has at most a few hundred rows; the version counters, one row each,
+# are read together by shop/versioning.py).
+ALLOWED_SCANS = {'shop_category', 'shop_facetcount', 'shop_versioncounter'}
+
+_SCAN = re.compile(r'\bSCAN (\w+)')
+_TABLE = re.compile(r'\b(?:SCAN|SEARCH) (\w+)')
+
+
+def _pages(benchmark):
+    """
+    Yields (label, send) for each page to check; send() makes the request.
+    """
+    product = Product.objects.order_by('-rating_count').first()
+    category = Category.objects.first()
+    second_page = encode_cursor(product.name, product.id)
+    anonymous, customer = benchmark.anonymous, benchmark.customer
+    yield 'home', lambda: anonymous.get(reverse('home'))
+    yield 'shop', lambda: anonymous.get(reverse('shop'))
+    yield 'shop (category)', lambda: anonymous.get(reverse('shop'), {'category': category.slug})
+    yield 'shop (filtered)', lambda: anonymous.get(reverse('shop'), {'price': [0, 1], 'rating': 3})
+    yield 'product feed (next page)', lambda: anonymous.get(reverse('product_feed'), {'after': second_page})
+    yield 'product feed (category, next page)', lambda: anonymous.get(
+        reverse('product_feed'), {'category': category.slug, 'after': second_page},
+    )
+    yield 'search', lambda: anonymous.get(reverse('search'), {'q': product.name.split()[0]})
+    yield 'search autocomplete', lambda: anonymous.get(reverse('search_autocomplete'), {'q': product.name[:3]})
+    yield 'product detail', lambda: anonymous.get(reverse('product_detail', args=[product.slug]))
+    yield 'product reviews', lambda: anonymous.get(reverse('product_reviews', args=[product.slug]))
+    yield 'add to cart', lambda: customer.post(
+        reverse('add_to_cart', args=[product.slug]), HTTP_X_REQUESTED_WITH='XMLHttpRequest',
+    )
+    yield 'cart', lambda: customer.get(reverse('cart'))
+    yield 'checkout', lambda: customer.get(reverse('checkout'))
+    yield 'dashboard', lambda: customer.get(reverse('dashboard'))
+    yield 'submit review', lambda: customer.post(
+        reverse('submit_review', args=[product.slug]),
+        data=json.dumps({'rating': 5, 'comment': "Explain check."}), content_type='application/json',
+    )
+
+
+def problems_in(sql, plan, tables):
+    """
+    Returns the plan lines that show a full table scan or a sort without an index.
+    `tables` are the database's table names (scans of subqueries and virtual tables are not table scans).
+    A scan without a sort in a query with a LIMIT walks the table in the requested order and stops
+    early (e.g. ORDER BY id DESC LIMIT 3), so it is not flagged.
+    """
+    used = {match.group(1) for line in plan for match in _TABLE.finditer(line)}
+    if used and used <= ALLOWED_SCANS:
+        return []
+    full_text = any('VIRTUAL TABLE' in line for line in plan)
+    sorts = [line for line in plan if 'USE TEMP B-TREE FOR ORDER BY' in line]
+    limited = ' LIMIT ' in sql.upper()
+    problems = []
+    for line in plan:
+        match = _SCAN.search(line)
+        if (
+            match and match.group(1) in tables and match.group(1) not in ALLOWED_SCANS
+            and 'USING' not in line and 'VIRTUAL TABLE' not in line
+            and not (limited and not sorts)
+        ):
+            problems.append(line)
+    if not full_text:
+        problems.extend(sorts)
+    return problems
+
+
+def explain(sql):
+    """
+    Returns the EXPLAIN QUERY PLAN lines for an already interpolated SQL statement.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(f"EXPLAIN QUERY PLAN {sql}")
+        return [row[-1] for row in cursor.fetchall()]
+
+
+class Command(BaseCommand):
+    help = "Run EXPLAIN QUERY PLAN on every storefront page's queries and flag full table scans."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, default=2000, help="Products in the seeded catalog.")
+        parser.add_argument('--users', type=int, default=50, help="Users in the seeded catalog.")
+        parser.add_argument('--reviews', type=int, default=6000, help="Reviews in the seeded catalog.")
+        parser.add_argument('--verbose', action='store_true', help="Print every query plan, not only flagged ones.")
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'sqlite':
+            raise CommandError("explain_queries only supports SQLite.")
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            seed_catalog(options['products'], max(1, options['users']), options['reviews'])
+            # Let the planner see real table statistics, as it would on a production database.
+            with connection.cursor() as cursor:
+                cursor.execute("ANALYZE")
+            flagged = self._check(StorefrontBenchmark(), options['verbose'])
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+        if flagged:
+            raise CommandError(f"{flagged} queries scan a table or sort without an index.")
+        self.stdout.write(self.style.SUCCESS("Every query uses an index."))
+
+    def _check(self, benchmark, verbose):
+        flagged = 0
+        tables = set(connection.introspection.table_names())
+        for label, send in _pages(benchmark):
+            # Cached fragments and pages would hide the queries behind them.
+            cache.clear()
+            with CaptureQueriesContext(connection) as context:
+                response = send()
+            selects = [
+                query['sql'] for query in context.captured_queries
+                if query['sql'].lstrip().upper().startswith(('SELECT', 'WITH'))
+            ]
+            self.stdout.write(f"{label}: {response.status_code}, {len(context.captured_queries)} queries")
+            for sql in dict.fromkeys(selects):
+                try:
+                    plan = explain(sql)
+                except Exception as error:
+                    self.stderr.write(f"  could not explain ({error}): {sql[:200]}")
+                    continue
+                problems = problems_in(sql, plan, tables)
+                if problems:
+                    flagged += 1
+                    self.stdout.write(self.style.ERROR(f"  {sql[:300]}"))
+                    for line in problems:
+                        self.stdout.write(self.style.ERROR(f"    {line}"))
+                elif verbose:
+                    self.stdout.write(f"  {sql[:300]}")
+                    for line in plan:
+                        self.stdout.write(f"    {line}")
+        return flagged
@@ -0,0 +1,32 @@
+# shop/management/commands/export_catalog.py
+# Usage: python manage.py export_catalog products.csv [--format csv|jsonl] [--batch-size 2000]
+# Streams every product, with its category, to a CSV or JSONL file that import_catalog can read back
+# (see shop/catalog_io.py). Pass '-' to write to standard output.
+
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from shop.catalog_io import detect_format, export_catalog
+
+
+class Command(BaseCommand):
+    help = "Export products and categories to a CSV or JSONL file."
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="File to write, or '-' for standard output.")
+        parser.add_argument('--format', choices=['csv', 'jsonl'], help="File format (default: from the file extension).")
+        parser.add_argument('--batch-size', type=int, default=2000, help="Rows read from the database at a time.")
+
+    def handle(self, *args, **options):
+        fmt = detect_format(options['path'], options['format'])
+        if options['path'] == '-':
+            export_catalog(sys.stdout, fmt, options['batch_size'])
+            return
+        try:
+            stream = open(options['path'], 'w', newline='', encoding='utf-8')
+        except OSError as error:
+            raise CommandError(f"Cannot write {options['path']}: {error}")
+        with stream:
+            count = export_catalog(stream, fmt, options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f"Exported {count} products to {options['path']}."))
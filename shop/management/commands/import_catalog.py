@@ -0,0 +1,50 @@
+# shop/management/commands/import_catalog.py
+# Usage: python manage.py import_catalog products.csv [--format csv|jsonl] [--batch-size 2000] [--workers 8] [--dry-run]
+# Streams products (and the categories they name) from a CSV or JSONL file into the database (see shop/catalog_io.py).
+# Pass '-' to read from standard input. Rows with a slug that already exists update that product.
+# Invalid rows (missing name, bad price, unknown image, ...) are skipped and reported; the rest are imported.
+# Afterwards run build_image_variants to make the resized images of the new products.
+
+import sys
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from shop.catalog_io import detect_format, import_catalog
+
+
+class Command(BaseCommand):
+    help = "Import products and categories from a CSV or JSONL file."
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="CSV or JSONL file to import, or '-' for standard input.")
+        parser.add_argument('--format', choices=['csv', 'jsonl'], help="File format (default: from the file extension).")
+        parser.add_argument('--batch-size', type=int, default=2000, help="Rows written per transaction.")
+        parser.add_argument('--workers', type=int, default=8, help="Threads checking image paths.")
+        parser.add_argument('--dry-run', action='store_true', help="Validate and write every chunk, then roll it back.")
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1:
+            raise CommandError("--batch-size must be at least 1.")
+        fmt = detect_format(options['path'], options['format'])
+        started = time.perf_counter()
+        if options['path'] == '-':
+            stats = import_catalog(sys.stdin, fmt, options['batch_size'], options['workers'], options['dry_run'])
+        else:
+            try:
+                stream = open(options['path'], newline='', encoding='utf-8')
+            except OSError as error:
+                raise CommandError(f"Cannot read {options['path']}: {error}")
+            with stream:
+                stats = import_catalog(stream, fmt, options['batch_size'], options['workers'], options['dry_run'])
+        elapsed = time.perf_counter() - started
+
+        for message in stats.errors:
+            self.stderr.write(message)
+        if stats.failed > len(stats.errors):
+            self.stderr.write(f"... and {stats.failed - len(stats.errors)} more invalid rows.")
+        prefix = "Dry run: would have" if options['dry_run'] else "Imported"
+        self.stdout.write(self.style.SUCCESS(
+            f"{prefix} {stats.created} new and {stats.updated} updated products from {stats.rows} rows "
+            f"({stats.failed} skipped) in {elapsed:.1f}s."
+        ))
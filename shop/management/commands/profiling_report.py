@@ -0,0 +1,53 @@
+# shop/management/commands/profiling_report.py
+# Usage: python manage.py profiling_report [--sort avg_ms|avg_queries|avg_sql_ms|requests] [--json] [--reset]
+# Dumps the per-route request stats collected by the profiling middleware (see shop/profiling.py).
+
+import json
+
+from django.core.management.base import BaseCommand
+
+from shop.models import RouteStat
+
+SORT_KEYS = ['avg_ms', 'avg_sql_ms', 'avg_template_ms', 'avg_queries', 'max_ms', 'requests']
+
+
+class Command(BaseCommand):
+    help = "Show aggregated request profiling stats per route."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sort', choices=SORT_KEYS, default='avg_ms', help="Order routes by this value, largest first.")
+        parser.add_argument('--json', action='store_true', help="Print the stats as JSON.")
+        parser.add_argument('--reset', action='store_true', help="Delete the stats after printing them.")
+
+    def handle(self, *args, **options):
+        stats = sorted(RouteStat.objects.all(), key=lambda stat: getattr(stat, options['sort']), reverse=True)
+        if options['json']:
+            self.stdout.write(json.dumps([
+                {
+                    'route': stat.route,
+                    'requests': stat.requests,
+                    'avg_ms': round(stat.avg_ms, 3),
+                    'max_ms': round(stat.max_ms, 3),
+                    'avg_sql_ms': round(stat.avg_sql_ms, 3),
+                    'avg_template_ms': round(stat.avg_template_ms, 3),
+                    'avg_queries': round(stat.avg_queries, 2),
+                    'max_queries': stat.max_queries,
+                    'slowest_queries': stat.slowest_queries,
+                }
+                for stat in stats
+            ], indent=2))
+        else:
+            self.stdout.write(
+                f"{'route':<28}{'sampled':>9}{'avg ms':>9}{'max ms':>9}{'sql ms':>9}{'tpl ms':>9}{'queries':>9}{'max q':>7}"
+            )
+            for stat in stats:
+                self.stdout.write(
+                    f"{stat.route:<28}{stat.requests:>9}{stat.avg_ms:>9.1f}{stat.max_ms:>9.1f}{stat.avg_sql_ms:>9.1f}"
+                    f"{stat.avg_template_ms:>9.1f}{stat.avg_queries:>9.1f}{stat.max_queries:>7}"
+                )
+                if stat.slowest_queries:
+                    slowest = stat.slowest_queries[0]
+                    self.stdout.write(f"    slowest query {slowest['ms']:.2f} ms: {slowest['sql'][:160]}")
+        if options['reset']:
+            deleted, _ = RouteStat.objects.all().delete()
+            self.stdout.write(self.style.SUCCESS(f"Deleted the stats of {deleted} routes."))
@@ -0,0 +1,19 @@
+# shop/management/commands/rebuild_facets.py
+# Usage: python manage.py rebuild_facets
+# Rebuilds the facet count index behind the shop sidebar from the product table (see shop/facets.py).
+# The index is normally kept in sync by model signals; run this after raw SQL changes to products.
+
+from django.core.management.base import BaseCommand
+
+from shop.facets import rebuild_facet_counts
+from shop.versioning import CATALOG, bump_version
+
+
+class Command(BaseCommand):
+    help = "Rebuild the facet counts shown in the shop sidebar."
+
+    def handle(self, *args, **options):
+        cells = rebuild_facet_counts()
+        # The sidebar is a cached fragment keyed by the catalog version.
+        bump_version(CATALOG)
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {cells} facet cells."))
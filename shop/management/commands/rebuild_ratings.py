@@ -0,0 +1,19 @@
+# shop/management/commands/rebuild_ratings.py
+# Usage: python manage.py rebuild_ratings [--batch-size N]
+# Recomputes the review aggregates (count, average, histogram) on every product from the Review table.
+# Normally they are kept up to date incrementally; run this after bulk data changes or to repair drift.
+
+from django.core.management.base import BaseCommand
+
+from shop.ratings import rebuild_all_ratings
+
+
+class Command(BaseCommand):
+    help = "Rebuild the precomputed review aggregates on every product."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help="Products written per bulk_update.")
+
+    def handle(self, *args, **options):
+        rebuilt = rebuild_all_ratings(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt rating aggregates for {rebuilt} reviewed products."))
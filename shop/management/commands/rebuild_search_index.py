@@ -0,0 +1,18 @@
+# shop/management/commands/rebuild_search_index.py
+# Usage: python manage.py rebuild_search_index
+# Rebuilds the FTS5 product search index from scratch (see shop/search.py).
+# The index is normally kept in sync by model signals; run this after bulk imports or raw SQL changes.
+
+from django.core.management.base import BaseCommand, CommandError
+
+from shop.search import fts_enabled, rebuild_index
+
+
+class Command(BaseCommand):
+    help = "Rebuild the full-text product search index."
+
+    def handle(self, *args, **options):
+        if not fts_enabled():
+            raise CommandError("The search index needs SQLite (FTS5); other databases use the name__icontains fallback.")
+        indexed = rebuild_index()
+        self.stdout.write(self.style.SUCCESS(f"Indexed {indexed} products."))
@@ -0,0 +1,32 @@
+# Generated by Django 5.2.4 on 2026-10-18 09:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0008_product_image_variants'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RouteStat',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('route', models.CharField(max_length=200, unique=True)),
+                ('requests', models.PositiveIntegerField(default=0)),
+                ('total_ms', models.FloatField(default=0)),
+                ('sql_ms', models.FloatField(default=0)),
+                ('template_ms', models.FloatField(default=0)),
+                ('queries', models.PositiveIntegerField(default=0)),
+                ('max_ms', models.FloatField(default=0)),
+                ('max_queries', models.PositiveIntegerField(default=0)),
+                ('slowest_queries', models.JSONField(default=list)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'ordering': ['route'],
+            },
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 5.2.4 on 2026-10-18 09:39
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Min, Sum
+
+
+def merge_duplicate_cart_items(apps, schema_editor):
+    """
+    Folds duplicate (user, product) rows into the oldest one, adding up their quantities,
+    so the unique constraint can be created.
+    """
+    CartItem = apps.get_model('shop', 'CartItem')
+    duplicates = (
+        CartItem.objects.order_by().values('user_id', 'product_id')
+        .annotate(rows=Count('id'), keep_id=Min('id'), quantity=Sum('quantity')).filter(rows__gt=1)
+    )
+    for row in duplicates:
+        CartItem.objects.filter(pk=row['keep_id']).update(quantity=row['quantity'])
+        CartItem.objects.filter(user_id=row['user_id'], product_id=row['product_id']).exclude(pk=row['keep_id']).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0009_routestat'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_cart_items, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='cartitem',
+            constraint=models.UniqueConstraint(fields=('user', 'product'), name='unique_cart_item_per_user'),
+        ),
+    ]
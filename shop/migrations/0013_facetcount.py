@@ -0,0 +1,59 @@
+# Generated by Django 5.2.4 on 2026-10-18 09:59
+
+import bisect
+import django.db.models.deletion
+import math
+from collections import Counter
+from decimal import Decimal
+
+from django.db import migrations, models
+
+# A copy of the buckets of shop/facets.py as they were when this migration was written: migrations must not
+# import app code, which can change after they are applied.
+PRICE_BOUNDS = [Decimal('0'), Decimal('25'), Decimal('50'), Decimal('100'), Decimal('200')]
+
+
+def product_cell(category_id, price, rating_avg):
+    price_bucket = max(0, bisect.bisect_right(PRICE_BOUNDS, Decimal(str(price))) - 1)
+    rating_bucket = min(5, max(0, math.floor(rating_avg or 0)))
+    return (category_id, price_bucket, rating_bucket)
+
+
+def build_facet_counts(apps, schema_editor):
+    """
+    Fills the facet count index from the existing products.
+    """
+    Product = apps.get_model('shop', 'Product')
+    FacetCount = apps.get_model('shop', 'FacetCount')
+    counts = Counter(
+        product_cell(*values)
+        for values in Product.objects.order_by().values_list('category_id', 'price', 'rating_avg').iterator()
+    )
+    FacetCount.objects.bulk_create(
+        FacetCount(category_id=category_id, price_bucket=price, rating_bucket=rating, count=count)
+        for (category_id, price, rating), count in counts.items()
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0012_storefront_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FacetCount',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('price_bucket', models.PositiveSmallIntegerField()),
+                ('rating_bucket', models.PositiveSmallIntegerField()),
+                ('count', models.IntegerField(default=0)),
+                ('category', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='facet_counts', to='shop.category')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('category', 'price_bucket', 'rating_bucket'), name='unique_facet_cell')],
+            },
+        ),
+        migrations.RunPython(build_facet_counts, migrations.RunPython.noop),
+    ]
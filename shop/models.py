@@ -32,6 +32,10 @@ class Product(models.Model):
       - price: The product's price.
       - image: An uploaded image of the product.
       - category: Links this product to a Category (many products can belong to one category).
+      - rating_count, rating_sum, rating_avg: Precomputed review aggregates (kept up to date by shop/ratings.py).
+      - rating_1_count ... rating_5_count: How many reviews gave each star rating (the histogram).
+      - image_variants: Resized WebP/JPEG copies of the image (built in the background by shop/images.py).
+      - updated_at: When the product (including its rating aggregates and image variants) last changed.
     """
     name = models.CharField(max_length=200)
     slug = models.SlugField(unique=True, blank=True, null=True)
@@ -40,13 +44,63 @@ class Product(models.Model):
     image = models.ImageField(upload_to="products/")
     category = models.ForeignKey(Category, on_delete=models.CASCADE)  # Many products to one category
     created_by = models.ForeignKey(User, on_delete=models.CASCADE, related_name='products', null=True, blank=True)
+    # Review aggregates, so listing pages can show ratings without touching the Review table
+    rating_count = models.PositiveIntegerField(default=0, editable=False)
+    rating_sum = models.PositiveIntegerField(default=0, editable=False)
+    rating_avg = models.FloatField(default=0, editable=False)
+    rating_1_count = models.PositiveIntegerField(default=0, editable=False)
+    rating_2_count = models.PositiveIntegerField(default=0, editable=False)
+    rating_3_count = models.PositiveIntegerField(default=0, editable=False)
+    rating_4_count = models.PositiveIntegerField(default=0, editable=False)
+    rating_5_count = models.PositiveIntegerField(default=0, editable=False)
+    # {'source': image name, 'webp': {width: file name}, 'jpeg': {width: file name}}
+    image_variants = models.JSONField(default=dict, blank=True, editable=False)
+    # auto_now only covers save(); the queryset .update()s in shop/ratings.py and shop/images.py set it themselves
+    updated_at = models.DateTimeField(auto_now=True)
 
     class Meta:
         ordering = ['name']
+        indexes = [
+            # The shop listing: ordered by name, keyset-paginated on (name, id)
+            models.Index(fields=['name', 'id'], name='product_name_id_idx'),
+            # The shop listing filtered by category
+            models.Index(fields=['category', 'name', 'id'], name='product_category_name_idx'),
+        ]
+
+    # Columns only written by queryset updates (shop/ratings.py, shop/images.py). Saving an instance that was
+    # loaded before a review or an image variant build would otherwise write their old values back.
+    DERIVED_FIELDS = (
+        'rating_count', 'rating_sum', 'rating_avg',
+        'rating_1_count', 'rating_2_count', 'rating_3_count', 'rating_4_count', 'rating_5_count',
+        'image_variants',
+    )
 
     def __str__(self):
         return self.name
 
+    def save(self, *args, **kwargs):
+        """
+        Saves the product. Updating an existing row leaves DERIVED_FIELDS out, unless update_fields names them.
+        """
+        if not self._state.adding and not kwargs.get('force_insert') and kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in self.DERIVED_FIELDS
+            ]
+        super().save(*args, **kwargs)
+
+    @property
+    def rating_histogram(self):
+        """
+        Returns [(stars, count, percent), ...] from 5 stars down to 1, for rating bars in templates.
+        """
+        histogram = []
+        for stars in range(5, 0, -1):
+            count = getattr(self, f'rating_{stars}_count')
+            percent = round(100 * count / self.rating_count) if self.rating_count else 0
+            histogram.append((stars, count, percent))
+        return histogram
+
 class Review(models.Model):
     """
     Stores a review left by a user for a product.
@@ -56,23 +110,32 @@ class Review(models.Model):
       - rating: Integer rating (1-5).
       - comment: The review text.
       - created_at: When the review was created.
+      - updated_at: When the review was last edited.
     """
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     product = models.ForeignKey(Product, on_delete=models.CASCADE)
     rating = models.IntegerField()
     comment = models.TextField()
     created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
 
     class Meta:
         ordering = ['-created_at']  # Newest reviews first
+        indexes = [
+            # A product's reviews, newest first, keyset-paginated on (created_at, id) (see shop/catalog.py)
+            models.Index(fields=['product', '-created_at', '-id'], name='review_product_recent_idx'),
+            # The admin's rating filter, newest first (see shop/admin.py)
+            models.Index(fields=['rating', '-id'], name='review_rating_idx'),
+        ]
 
     def __str__(self):
         return f"Review by {str(self.user)} for {str(self.product)}"
 
 class CartItem(models.Model):
     """
-    (Not used in session-based cart, but kept for reference.)
-    Represents an item in a user's cart (if using database cart).
+    Represents an item in a logged-in user's cart (see shop/cart.py; visitors who are not logged in
+    keep their cart in the session, and it is merged into these rows when they log in).
+    There is at most one row per user and product; adding more of a product increases its quantity.
     Fields:
       - user: The user who owns the cart item.
       - product: The product in the cart.
@@ -86,19 +149,25 @@ class CartItem(models.Model):
 
     class Meta:
         ordering = ['-added_at']
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'product'], name='unique_cart_item_per_user'),
+        ]
 
     def __str__(self):
         return f"{self.quantity} x {str(self.product)} for {str(self.user)}"
 
 class Order(models.Model):
     """
-    Represents a completed order placed by a user.
+    Represents a completed order placed by a user (created by shop/checkout.py).
     Fields:
       - user: The user who placed the order.
-      - items: The cart items included in the order (many-to-many relationship).
+      - items: The cart items included in the order (many-to-many relationship; kept for older orders,
+        new orders store their products as OrderItem rows in `lines`).
       - total: The total price of the order.
       - status: The order status (e.g., Pending, Shipped).
       - created_at: When the order was created.
+      - checkout_token: The token of the checkout form that placed the order, so submitting it twice
+        returns the same order instead of creating a second one.
     """
     STATUS_CHOICES = [
         ("Pending", "Pending"),
@@ -109,9 +178,151 @@ class Order(models.Model):
     total = models.DecimalField(max_digits=10, decimal_places=2)
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default="Pending")
     created_at = models.DateTimeField(auto_now_add=True)
+    checkout_token = models.CharField(max_length=64, unique=True, null=True, blank=True, editable=False)
 
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            # A user's orders, newest first (the dashboard)
+            models.Index(fields=['user', '-created_at'], name='order_user_recent_idx'),
+            # The admin's status filter, newest first (see shop/admin.py)
+            models.Index(fields=['status', '-id'], name='order_status_idx'),
+        ]
 
     def __str__(self):
         return f"Order #{self.pk} by {str(self.user)}"
+
+
+class OrderItem(models.Model):
+    """
+    One line of an order, with the price copied from the product at checkout.
+    Fields:
+      - order: The order this line belongs to.
+      - product: The product bought (set to NULL if the product is deleted later).
+      - product_name: The product's name at checkout, so the order still reads correctly if the product changes.
+      - unit_price: The price of one unit at checkout.
+      - quantity: How many units were bought.
+    """
+    order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name='lines')
+    product = models.ForeignKey(Product, on_delete=models.SET_NULL, null=True, blank=True, related_name='order_items')
+    product_name = models.CharField(max_length=200)
+    unit_price = models.DecimalField(max_digits=10, decimal_places=2)
+    quantity = models.PositiveIntegerField()
+
+    def __str__(self):
+        return f"{self.quantity} x {self.product_name} in order #{self.order_id}"
+
+    @property
+    def subtotal(self):
+        return self.unit_price * self.quantity
+
+
+class ProductRecommendation(models.Model):
+    """
+    Precomputed "related items" for one product (built by shop/recommendations.py).
+    Fields:
+      - product: The product these recommendations are for.
+      - product_ids: IDs of the recommended products, best first.
+      - is_stale: Set when the catalog around this product changed; the row is rebuilt on its next read.
+      - updated_at: When the row was last built.
+    """
+    product = models.OneToOneField(Product, on_delete=models.CASCADE, primary_key=True, related_name='recommendation')
+    product_ids = models.JSONField(default=list)
+    is_stale = models.BooleanField(default=False)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Recommendations for {str(self.product)}"
+
+
+class FacetCount(models.Model):
+    """
+    One cell of the facet count index used by the shop sidebar (maintained by shop/facets.py):
+    how many products share a category, price bucket and rating bucket.
+    Fields:
+      - category: The products' category.
+      - price_bucket: Index of the products' price range in facets.PRICE_BUCKETS.
+      - rating_bucket: The products' average rating rounded down (0 for products without reviews).
+      - count: How many products are in this cell.
+    """
+    category = models.ForeignKey(Category, on_delete=models.CASCADE, related_name='facet_counts')
+    price_bucket = models.PositiveSmallIntegerField()
+    rating_bucket = models.PositiveSmallIntegerField()
+    count = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['category', 'price_bucket', 'rating_bucket'], name='unique_facet_cell'),
+        ]
+
+    def __str__(self):
+        return f"{self.count} products in category {self.category_id}, price {self.price_bucket}, rating {self.rating_bucket}"
+
+
+class VersionCounter(models.Model):
+    """
+    A version counter (see shop/versioning.py), kept in the database so that every process agrees on it:
+    the catalog version in cache keys and page ETags, the cart snapshot version.
+    Fields:
+      - name: The counter's name (e.g. 'catalog').
+      - value: Moves forward by one on every bump.
+      - updated_at: When it was last bumped.
+    """
+    name = models.CharField(max_length=50, unique=True)
+    value = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.name} version {self.value}"
+
+
+class RouteStat(models.Model):
+    """
+    Aggregated request profile of one URL route, from the sampled requests (see shop/profiling.py).
+    Fields:
+      - route: The resolved URL name (e.g. 'product_detail').
+      - requests: How many requests were sampled.
+      - total_ms, sql_ms, template_ms: Summed request, SQL and template rendering time of those requests.
+      - queries: Summed number of SQL queries.
+      - max_ms, max_queries: The slowest sampled request, and the most queries a sampled request made.
+      - slowest_queries: The slowest SQL statements seen, as [{'sql': ..., 'ms': ...}], slowest first.
+      - updated_at: When the stats were last flushed.
+    """
+    route = models.CharField(max_length=200, unique=True)
+    requests = models.PositiveIntegerField(default=0)
+    total_ms = models.FloatField(default=0)
+    sql_ms = models.FloatField(default=0)
+    template_ms = models.FloatField(default=0)
+    queries = models.PositiveIntegerField(default=0)
+    max_ms = models.FloatField(default=0)
+    max_queries = models.PositiveIntegerField(default=0)
+    slowest_queries = models.JSONField(default=list)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ['route']
+
+    def __str__(self):
+        return self.route
+
+    def average(self, field):
+        """
+        Returns the per-request average of a summed field (e.g. 'sql_ms'), or 0 if nothing was sampled.
+        """
+        return getattr(self, field) / self.requests if self.requests else 0
+
+    @property
+    def avg_ms(self):
+        return self.average('total_ms')
+
+    @property
+    def avg_sql_ms(self):
+        return self.average('sql_ms')
+
+    @property
+    def avg_template_ms(self):
+        return self.average('template_ms')
+
+    @property
+    def avg_queries(self):
+        return self.average('queries')
@@ -0,0 +1,242 @@
+# shop/profiling.py
+# This file contains the request profiling middleware.
+# A sample of requests (PROFILING_SAMPLE_RATE) is instrumented: every SQL query is timed through a
+# database execute wrapper and template rendering is timed around the template backend's render().
+# The numbers are added up per resolved URL name in memory and flushed to RouteStat rows every
+# PROFILING_FLUSH_INTERVAL seconds, so the database sees one small write per route per interval.
+#
+# Every response gets a Server-Timing header ("app" total time); sampled ones also get "db" and "tpl",
+# which show up in the browser's developer tools.
+# Stats are shown to staff at /staff/profiling/ and dumped by `python manage.py profiling_report`.
+
+import random
+import threading
+import time
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import F
+from django.db.models.functions import Greatest
+from django.template.backends.django import Template as DjangoTemplate
+
+from .models import RouteStat
+
+# The profile of the request being handled on this thread/task, or None if it is not sampled.
+_current_profile = ContextVar('shop_request_profile', default=None)
+
+_template_timer_installed = False
+
+
+class RequestProfile:
+    """
+    Timings collected while one sampled request is handled.
+    """
+    def __init__(self):
+        self.queries = 0
+        self.sql_ms = 0.0
+        self.template_ms = 0.0
+        self.slowest = []  # [(ms, sql)], at most PROFILING_SLOW_QUERIES, slowest first
+        self._template_depth = 0
+
+    def record_query(self, sql, ms):
+        self.queries += 1
+        self.sql_ms += ms
+        _keep_slowest(self.slowest, (ms, sql))
+
+    def __call__(self, execute, sql, params, many, context):
+        # Database execute wrapper (connection.execute_wrapper)
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.record_query(sql, (time.perf_counter() - started) * 1000)
+
+
+def _keep_slowest(slowest, entry):
+    slowest.append(entry)
+    slowest.sort(key=lambda item: item[0], reverse=True)
+    del slowest[settings.PROFILING_SLOW_QUERIES:]
+
+
+def _install_template_timer():
+    """
+    Wraps the Django template backend's render() so sampled requests add up their rendering time.
+    Only the outermost render is timed (includes and render_to_string calls inside it are part of it).
+    Unsampled requests pay one context variable lookup.
+    """
+    global _template_timer_installed
+    if _template_timer_installed:
+        return
+    original_render = DjangoTemplate.render
+
+    def render(self, context=None, request=None):
+        profile = _current_profile.get()
+        if profile is None or profile._template_depth:
+            return original_render(self, context, request)
+        profile._template_depth += 1
+        started = time.perf_counter()
+        try:
+            return original_render(self, context, request)
+        finally:
+            profile._template_depth -= 1
+            profile.template_ms += (time.perf_counter() - started) * 1000
+
+    DjangoTemplate.render = render
+    _template_timer_installed = True
+
+
+class RouteStats:
+    """
+    In-memory totals per route, shared by all threads of the process and flushed to RouteStat.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._last_flush = time.monotonic()
+
+    def add(self, route, total_ms, profile):
+        with self._lock:
+            stat = self._pending.setdefault(route, {
+                'requests': 0, 'total_ms': 0.0, 'sql_ms': 0.0, 'template_ms': 0.0,
+                'queries': 0, 'max_ms': 0.0, 'max_queries': 0, 'slowest': [],
+            })
+            stat['requests'] += 1
+            stat['total_ms'] += total_ms
+            stat['sql_ms'] += profile.sql_ms
+            stat['template_ms'] += profile.template_ms
+            stat['queries'] += profile.queries
+            stat['max_ms'] = max(stat['max_ms'], total_ms)
+            stat['max_queries'] = max(stat['max_queries'], profile.queries)
+            for entry in profile.slowest:
+                _keep_slowest(stat['slowest'], entry)
+
+    def flush_due(self):
+        return time.monotonic() - self._last_flush >= settings.PROFILING_FLUSH_INTERVAL
+
+    def flush(self):
+        """
+        Writes the pending totals to RouteStat with F() increments, so several processes can flush
+        into the same rows without losing counts. Returns the number of routes written.
+        """
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            self._last_flush = time.monotonic()
+        if not pending:
+            return 0
+        with transaction.atomic():
+            existing = RouteStat.objects.select_for_update().in_bulk(pending, field_name='route')
+            missing = [RouteStat(route=route) for route in pending if route not in existing]
+            if missing:
+                RouteStat.objects.bulk_create(missing, ignore_conflicts=True)
+                existing = RouteStat.objects.in_bulk(pending, field_name='route')
+            for route, stat in pending.items():
+                slowest = [(entry['ms'], entry['sql']) for entry in existing[route].slowest_queries]
+                for entry in stat['slowest']:
+                    _keep_slowest(slowest, entry)
+                RouteStat.objects.filter(route=route).update(
+                    requests=F('requests') + stat['requests'],
+                    total_ms=F('total_ms') + stat['total_ms'],
+                    sql_ms=F('sql_ms') + stat['sql_ms'],
+                    template_ms=F('template_ms') + stat['template_ms'],
+                    queries=F('queries') + stat['queries'],
+                    max_ms=Greatest('max_ms', stat['max_ms']),
+                    max_queries=Greatest('max_queries', stat['max_queries']),
+                    slowest_queries=[{'sql': sql, 'ms': round(ms, 3)} for ms, sql in slowest],
+                )
+        return len(pending)
+
+
+route_stats = RouteStats()
+
+
+def _server_timing(total_ms, profile):
+    metrics = [f'app;dur={total_ms:.1f}']
+    if profile is not None:
+        metrics.append(f'db;dur={profile.sql_ms:.1f};desc="{profile.queries} queries"')
+        metrics.append(f'tpl;dur={profile.template_ms:.1f}')
+    return ', '.join(metrics)
+
+
+def _add_wrapper(profile):
+    connection.execute_wrappers.append(profile)
+
+
+def _remove_wrapper(profile):
+    connection.execute_wrappers.remove(profile)
+
+
+class ProfilingMiddleware:
+    """
+    Samples requests, times their SQL and template rendering, and records the totals per URL name.
+    Disabled entirely when PROFILING_SAMPLE_RATE is 0.
+    Works in both sync (WSGI) and async (ASGI) stacks, so async views are not pushed into a thread by it.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+        _install_template_timer()
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        rate = settings.PROFILING_SAMPLE_RATE
+        if not rate:
+            return self.get_response(request)
+        started = time.perf_counter()
+        if random.random() >= rate:
+            response = self.get_response(request)
+            response['Server-Timing'] = _server_timing((time.perf_counter() - started) * 1000, None)
+            return response
+
+        profile = RequestProfile()
+        token = _current_profile.set(profile)
+        try:
+            with connection.execute_wrapper(profile):
+                response = self.get_response(request)
+        finally:
+            _current_profile.reset(token)
+        if self._record(request, response, started, profile):
+            route_stats.flush()
+        return response
+
+    async def __acall__(self, request):
+        rate = settings.PROFILING_SAMPLE_RATE
+        if not rate:
+            return await self.get_response(request)
+        started = time.perf_counter()
+        if random.random() >= rate:
+            response = await self.get_response(request)
+            response['Server-Timing'] = _server_timing((time.perf_counter() - started) * 1000, None)
+            return response
+
+        profile = RequestProfile()
+        token = _current_profile.set(profile)
+        # Database connections belong to threads, and the async ORM runs this request's queries in the
+        # request's own worker thread (ASGIHandler gives each request one), so the wrapper is added there.
+        await sync_to_async(_add_wrapper)(profile)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current_profile.reset(token)
+            await sync_to_async(_remove_wrapper)(profile)
+        if self._record(request, response, started, profile):
+            await sync_to_async(route_stats.flush)()
+        return response
+
+    def _record(self, request, response, started, profile):
+        """
+        Adds a sampled request to the route's totals. Returns True when the totals are due to be flushed.
+        """
+        total_ms = (time.perf_counter() - started) * 1000
+        response['Server-Timing'] = _server_timing(total_ms, profile)
+        match = getattr(request, 'resolver_match', None)
+        route = match.view_name if match else '<unresolved>'
+        route_stats.add(route, total_ms, profile)
+        return route_stats.flush_due()
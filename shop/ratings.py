@@ -0,0 +1,120 @@
+# shop/ratings.py
+# This file keeps the review aggregates on Product (count, sum, average and 1-5 histogram) up to date.
+# New and deleted reviews adjust the aggregates with a single UPDATE using F() expressions,
+# so concurrent reviews never overwrite each other's counts.
+
+from django.db import transaction
+from django.db.models import Case, Count, F, FloatField, Q, Sum, Value, When
+from django.db.models.functions import Cast
+from django.utils import timezone
+
+from .facets import rebuild_facet_counts, tracking
+from .models import Product, Review
+from .versioning import CATALOG, bump_version
+
+RATING_VALUES = range(1, 6)
+
+
+def validate_rating(value):
+    """
+    Returns `value` as an int between 1 and 5, or None if it is not a valid rating.
+    """
+    try:
+        rating = int(value)
+    except (TypeError, ValueError):
+        return None
+    return rating if rating in RATING_VALUES else None
+
+
+def rating_updates(changes):
+    """
+    Builds the Product.objects.update() keyword arguments for a batch of rating changes.
+    `changes` maps a star rating to how many reviews with that rating were added (or removed, if negative).
+    """
+    added = sum(changes.values())
+    added_sum = sum(stars * count for stars, count in changes.items())
+    new_count = F('rating_count') + added
+    updates = {
+        'updated_at': timezone.now(),  # .update() skips auto_now
+        'rating_count': new_count,
+        'rating_sum': F('rating_sum') + added_sum,
+        'rating_avg': Case(
+            When(rating_count__gt=-added, then=Cast(F('rating_sum') + added_sum, FloatField()) / new_count),
+            default=Value(0.0),
+            output_field=FloatField(),
+        ),
+    }
+    for stars, count in changes.items():
+        if count:
+            updates[f'rating_{stars}_count'] = F(f'rating_{stars}_count') + count
+    return updates
+
+
+def apply_rating_changes(product_id, changes):
+    """
+    Applies a batch of rating changes ({stars: count}) to one product's aggregates.
+    """
+    if any(changes.values()):
+        # A new average can move the product to another rating bucket of the facet index.
+        with tracking([product_id]):
+            Product.objects.filter(pk=product_id).update(**rating_updates(changes))
+
+
+def recompute_product_ratings(product_id):
+    """
+    Recomputes one product's aggregates from its reviews (used when an existing review is edited).
+    """
+    row = _aggregate_reviews(Review.objects.filter(product_id=product_id)).order_by('product_id').first()
+    with tracking([product_id]):
+        Product.objects.filter(pk=product_id).update(**_aggregate_fields(row))
+
+
+def _aggregate_reviews(reviews):
+    return reviews.order_by().values('product_id').annotate(
+        count=Count('id'),
+        total=Sum('rating'),
+        **{f'stars_{stars}': Count('id', filter=Q(rating=stars)) for stars in RATING_VALUES},
+    )
+
+
+def _aggregate_fields(row):
+    """
+    Turns one row of _aggregate_reviews() (or None, for no reviews) into Product field values.
+    """
+    row = row or {}
+    count = row.get('count', 0)
+    total = row.get('total') or 0
+    fields = {
+        'updated_at': timezone.now(),  # .update() and bulk_update() skip auto_now
+        'rating_count': count,
+        'rating_sum': total,
+        'rating_avg': total / count if count else 0.0,
+    }
+    for stars in RATING_VALUES:
+        fields[f'rating_{stars}_count'] = row.get(f'stars_{stars}', 0)
+    return fields
+
+
+def rebuild_all_ratings(batch_size=1000):
+    """
+    Recomputes every product's aggregates from the Review table with one grouped query,
+    writing the results with bulk_update in batches. Returns the number of products with reviews.
+    """
+    fields = list(_aggregate_fields(None))
+    rebuilt = 0
+    with transaction.atomic():
+        Product.objects.exclude(rating_count=0).update(**_aggregate_fields(None))
+        batch = []
+        for row in _aggregate_reviews(Review.objects.all()).order_by('product_id').iterator(chunk_size=batch_size):
+            batch.append(Product(pk=row['product_id'], **_aggregate_fields(row)))
+            if len(batch) >= batch_size:
+                Product.objects.bulk_update(batch, fields)
+                rebuilt += len(batch)
+                batch = []
+        if batch:
+            Product.objects.bulk_update(batch, fields)
+            rebuilt += len(batch)
+    # bulk_update sends no signals, so the facet index and cached pages showing the old ratings are refreshed here.
+    rebuild_facet_counts()
+    bump_version(CATALOG)
+    return rebuilt
@@ -0,0 +1,256 @@
+# shop/recommendations.py
+# This file builds the "related items" shown on the product detail page.
+# Each product's top recommendations are precomputed into one ProductRecommendation row, so
+# product_detail reads a single row instead of scanning the product's category on every view.
+#
+# Candidates are scored by:
+#   - being in the same category,
+#   - how close their price is,
+#   - how often they were in the same cart (CartItem rows of the same user) or the same order.
+#
+# When a product is added, changed or moved, the rows of every product in its old and new category are
+# marked stale (see shop/signals.py); once the save commits, the product's own row and a bounded number of
+# those stale rows are rebuilt (rebuild_on_commit). Pages never rebuild anything: they keep showing a stale
+# row (in_bulk skips deleted products) until it is rebuilt, and a product without a row yet shows the first
+# products of its category. Rows missing after `migrate` are built right away (build_missing); run
+# `python manage.py build_recommendations --stale-only` every few minutes for large categories, and the
+# full rebuild nightly, to pick up new cart and order co-occurrences.
+
+import bisect
+import math
+from collections import Counter, defaultdict
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.db.models import Count
+
+from .models import CartItem, OrderItem, Product, ProductRecommendation
+from .versioning import CATALOG, bump_version
+
+CATEGORY_WEIGHT = 1.0
+PRICE_WEIGHT = 0.5
+CO_OCCURRENCE_WEIGHT = 1.0
+
+# How many same-category neighbours (by price) are considered per product.
+PRICE_NEIGHBOURS = 25
+
+
+def stored_count():
+    """
+    How many recommendations are stored per product. More are kept than shown,
+    so a deleted product can be skipped without rebuilding the row.
+    """
+    return settings.RECOMMENDATIONS_PER_PRODUCT * 2
+
+
+def _score(price, candidate_price, same_category, co_occurrences):
+    score = CO_OCCURRENCE_WEIGHT * math.log1p(co_occurrences)
+    if same_category:
+        score += CATEGORY_WEIGHT
+        largest = max(price, candidate_price)
+        if largest > 0:
+            score += PRICE_WEIGHT * (1 - abs(price - candidate_price) / largest)
+    return score
+
+
+def _top_ids(scores):
+    ranked = sorted(scores.items(), key=lambda item: (-item[1], item[0]))
+    return [product_id for product_id, score in ranked[:stored_count()]]
+
+
+def _co_occurrences_for(product_id):
+    """
+    Returns a Counter of {other_product_id: how often it shared a cart or an order with product_id}.
+    """
+    counts = Counter()
+    cart_users = CartItem.objects.filter(product_id=product_id).values('user_id')
+    shared_carts = (
+        CartItem.objects.filter(user_id__in=cart_users).exclude(product_id=product_id)
+        .values('product_id').annotate(n=Count('user_id', distinct=True)).order_by()
+    )
+    for row in shared_carts:
+        counts[row['product_id']] += row['n']
+    orders = OrderItem.objects.filter(product_id=product_id).values('order_id')
+    shared_orders = (
+        OrderItem.objects.filter(order_id__in=orders, product__isnull=False).exclude(product_id=product_id)
+        .values('product_id').annotate(n=Count('order_id', distinct=True)).order_by()
+    )
+    for row in shared_orders:
+        counts[row['product_id']] += row['n']
+    return counts
+
+
+def build_for_product(product):
+    """
+    Computes and saves the recommendation row of one product. Returns the recommended product IDs.
+    """
+    price = float(product.price)
+    scores = {}
+    same_category = (
+        Product.objects.filter(category_id=product.category_id).exclude(pk=product.pk)
+        .values_list('id', 'price')
+    )
+    # Nearest prices first; the rest of a large category could never make the top list.
+    neighbours = sorted(same_category, key=lambda row: abs(float(row[1]) - price))[:PRICE_NEIGHBOURS]
+    for candidate_id, candidate_price in neighbours:
+        scores[candidate_id] = _score(price, float(candidate_price), True, 0)
+    co_occurrences = _co_occurrences_for(product.pk)
+    if co_occurrences:
+        candidates = Product.objects.filter(pk__in=co_occurrences).values_list('id', 'category_id', 'price')
+        for candidate_id, category_id, candidate_price in candidates:
+            scores[candidate_id] = _score(
+                price, float(candidate_price), category_id == product.category_id, co_occurrences[candidate_id],
+            )
+    product_ids = _top_ids(scores)
+    ProductRecommendation.objects.update_or_create(
+        product_id=product.pk, defaults={'product_ids': product_ids, 'is_stale': False},
+    )
+    return product_ids
+
+
+def _all_co_occurrences():
+    """
+    Counts cart and order co-occurrences for every pair of products in two passes over the data.
+    Returns {product_id: Counter({other_product_id: count})}.
+    """
+    pairs = defaultdict(Counter)
+    groups = defaultdict(set)
+    for user_id, product_id in CartItem.objects.values_list('user_id', 'product_id').order_by().iterator():
+        groups[('cart', user_id)].add(product_id)
+    order_lines = OrderItem.objects.filter(product__isnull=False).values_list('order_id', 'product_id').order_by()
+    for order_id, product_id in order_lines.iterator():
+        groups[('order', order_id)].add(product_id)
+    for product_ids in groups.values():
+        for product_id in product_ids:
+            for other_id in product_ids:
+                if other_id != product_id:
+                    pairs[product_id][other_id] += 1
+    return pairs
+
+
+def build_all(batch_size=1000, stale_only=False):
+    """
+    Rebuilds recommendation rows in bulk: products are grouped by category and sorted by price in
+    memory, so each product's price neighbours are found with a binary search instead of a query.
+    With stale_only, only missing or stale rows are written. Returns the number of rows written.
+    """
+    rows = list(Product.objects.values_list('id', 'category_id', 'price').order_by())
+    by_category = defaultdict(list)
+    info = {}
+    for product_id, category_id, price in rows:
+        by_category[category_id].append((float(price), product_id))
+        info[product_id] = (category_id, float(price))
+    for members in by_category.values():
+        members.sort()
+    co_occurrences = _all_co_occurrences()
+
+    targets = info.keys()
+    if stale_only:
+        fresh = set(ProductRecommendation.objects.filter(is_stale=False).values_list('product_id', flat=True))
+        targets = [product_id for product_id in info if product_id not in fresh]
+
+    written = 0
+    batch = []
+    for product_id in targets:
+        category_id, price = info[product_id]
+        members = by_category[category_id]
+        position = bisect.bisect_left(members, (price, product_id))
+        window = members[max(0, position - PRICE_NEIGHBOURS):position + PRICE_NEIGHBOURS + 1]
+        scores = {
+            candidate_id: _score(price, candidate_price, True, 0)
+            for candidate_price, candidate_id in window if candidate_id != product_id
+        }
+        for other_id, count in co_occurrences.get(product_id, {}).items():
+            if other_id in info:
+                other_category, other_price = info[other_id]
+                scores[other_id] = _score(price, other_price, other_category == category_id, count)
+        batch.append(ProductRecommendation(product_id=product_id, product_ids=_top_ids(scores), is_stale=False))
+        if len(batch) >= batch_size:
+            written += _write(batch)
+            batch = []
+    if batch:
+        written += _write(batch)
+    # Cached recommendation blocks were rendered from the old rows.
+    bump_version(CATALOG)
+    return written
+
+
+def _write(batch):
+    ProductRecommendation.objects.bulk_create(
+        batch,
+        update_conflicts=True,
+        unique_fields=['product'],
+        update_fields=['product_ids', 'is_stale', 'updated_at'],
+    )
+    return len(batch)
+
+
+def mark_stale(category_ids):
+    """
+    Marks the rows of every product in the given categories as stale (after a product in them changed).
+    """
+    ProductRecommendation.objects.filter(product__category_id__in=category_ids).update(is_stale=True)
+
+
+def rebuild_on_commit(product_id, category_ids):
+    """
+    Once the current transaction commits, rebuilds the row of one product (if it still exists) and up to
+    RECOMMENDATION_REBUILDS_PER_SAVE stale rows of the given categories, so the products next to a new or
+    changed one pick it up right away. Larger categories are finished by build_recommendations --stale-only.
+    """
+    def rebuild():
+        stale = (
+            ProductRecommendation.objects.filter(product__category_id__in=category_ids, is_stale=True)
+            .exclude(product_id=product_id).values_list('product_id', flat=True)
+        )
+        targets = [product_id, *stale[:settings.RECOMMENDATION_REBUILDS_PER_SAVE]]
+        for product in Product.objects.filter(pk__in=targets).only('id', 'category_id', 'price').order_by():
+            build_for_product(product)
+    transaction.on_commit(rebuild)
+
+
+def build_missing(using=DEFAULT_DB_ALIAS, **kwargs):
+    """
+    post_migrate receiver (see ShopConfig.ready()): builds the rows of products that have none yet,
+    e.g. every product right after the migration that added the table.
+    """
+    if using == DEFAULT_DB_ALIAS and Product.objects.filter(recommendation__isnull=True).exists():
+        build_all(stale_only=True)
+
+
+def _stored_ids(product):
+    return ProductRecommendation.objects.filter(product_id=product.pk).values_list('product_ids', flat=True)
+
+
+def _same_category(product):
+    # Used until the product has a row: the first products of its category, by name (product_category_name_idx).
+    return Product.objects.filter(category_id=product.category_id).exclude(pk=product.pk)[
+        :settings.RECOMMENDATIONS_PER_PRODUCT
+    ]
+
+
+def get_recommendations(product):
+    """
+    Returns up to RECOMMENDATIONS_PER_PRODUCT recommended products for `product`, best first.
+    Reads the precomputed row (one query, stale or not) and the recommended products (one query);
+    a product without a row yet gets the first products of its category.
+    """
+    product_ids = _stored_ids(product).first()
+    if product_ids is None:
+        return list(_same_category(product))
+    # in_bulk returns a dict, so skip the Meta ordering (a sort the database would do for nothing).
+    products = Product.objects.order_by().in_bulk(product_ids)
+    recommended = [products[product_id] for product_id in product_ids if product_id in products]
+    return recommended[:settings.RECOMMENDATIONS_PER_PRODUCT]
+
+
+async def aget_recommendations(product):
+    """
+    Async version of get_recommendations(), for the async product page.
+    """
+    product_ids = await _stored_ids(product).afirst()
+    if product_ids is None:
+        return [recommended async for recommended in _same_category(product)]
+    products = await Product.objects.order_by().ain_bulk(product_ids)
+    recommended = [products[product_id] for product_id in product_ids if product_id in products]
+    return recommended[:settings.RECOMMENDATIONS_PER_PRODUCT]
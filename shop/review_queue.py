@@ -0,0 +1,144 @@
+# shop/review_queue.py
+# This file contains the write-behind queue for new reviews.
+# submit_review validates a review and puts it on an in-process queue instead of writing it inside the request.
+# A single background thread drains the queue and writes up to REVIEW_QUEUE_BATCH_SIZE reviews per transaction:
+# one bulk INSERT for the reviews and one F() update of the rating aggregates per product (see shop/ratings.py).
+# During a review spike the SQLite write lock is then taken once per batch instead of once per review,
+# so page reads and other writes are not stuck behind a line of single-row transactions.
+#
+# The queue lives in the web process: reviews still queued when the process is killed are lost
+# (a normal shutdown flushes them, see atexit below). With REVIEW_WRITE_BEHIND = False, or on an
+# in-memory database, reviews are written directly, one transaction each.
+
+import atexit
+import logging
+import queue
+import threading
+import time
+from collections import Counter, defaultdict
+
+from django.conf import settings
+from django.db import connection, transaction
+
+from .models import Review
+from .ratings import apply_rating_changes
+from .versioning import CATALOG, bump_version
+
+logger = logging.getLogger(__name__)
+
+_queue = None
+_worker = None
+_worker_guard = threading.Lock()
+
+
+def _get_queue():
+    global _queue, _worker
+    with _worker_guard:
+        if _queue is None:
+            _queue = queue.Queue(maxsize=settings.REVIEW_QUEUE_MAX_SIZE)
+        if _worker is None or not _worker.is_alive():
+            _worker = threading.Thread(target=_run_worker, name='review-writer', daemon=True)
+            _worker.start()
+    return _queue
+
+
+def _write_behind():
+    # A shared in-memory SQLite database (tests, benchmarks) locks whole tables instead of waiting
+    # for busy_timeout, so it cannot be written from another thread while requests read it.
+    return settings.REVIEW_WRITE_BEHIND and not (connection.vendor == 'sqlite' and connection.is_in_memory_db())
+
+
+def save_review(user_id, product_id, rating, comment):
+    """
+    Writes one review, and its product's rating aggregates, in a single transaction.
+    """
+    with transaction.atomic():
+        # The post_save signals update the aggregates and invalidate cached pages.
+        return Review.objects.create(user_id=user_id, product_id=product_id, rating=rating, comment=comment)
+
+
+def enqueue_review(user_id, product_id, rating, comment):
+    """
+    Queues a validated review for the background writer. Returns False if it was written
+    directly instead (write-behind turned off, an in-memory database, or the queue is full and the caller has to wait).
+    """
+    if not _write_behind():
+        save_review(user_id, product_id, rating, comment)
+        return False
+    try:
+        _get_queue().put_nowait(Review(user_id=user_id, product_id=product_id, rating=rating, comment=comment))
+    except queue.Full:
+        save_review(user_id, product_id, rating, comment)
+        return False
+    return True
+
+
+def write_batch(reviews):
+    """
+    Saves a list of unsaved Review objects with one INSERT and one rating update per product.
+    bulk_create sends no signals, so the aggregates and the catalog version are updated here, in the same
+    transaction: if any step fails (e.g. "database is locked" on the version bump), nothing was written
+    and _write() can safely retry the reviews one by one.
+    """
+    changes = defaultdict(Counter)
+    for review in reviews:
+        changes[review.product_id][review.rating] += 1
+    with transaction.atomic():
+        Review.objects.bulk_create(reviews)
+        for product_id, product_changes in sorted(changes.items()):
+            apply_rating_changes(product_id, product_changes)
+        bump_version(CATALOG)
+
+
+def _write(reviews):
+    try:
+        write_batch(reviews)
+    except Exception:
+        # One bad review (e.g. its product was deleted meanwhile) must not lose the rest of the batch.
+        logger.exception("Could not write a batch of %s reviews; retrying one by one", len(reviews))
+        for review in reviews:
+            try:
+                save_review(review.user_id, review.product_id, review.rating, review.comment)
+            except Exception:
+                logger.exception("Dropped the review of user %s for product %s", review.user_id, review.product_id)
+
+
+def _take_batch():
+    """
+    Returns the next batch from the queue: waits for a first review, then gives others
+    REVIEW_QUEUE_FLUSH_DELAY seconds to arrive, up to REVIEW_QUEUE_BATCH_SIZE reviews.
+    """
+    batch = [_queue.get()]
+    deadline = time.monotonic() + settings.REVIEW_QUEUE_FLUSH_DELAY
+    while len(batch) < settings.REVIEW_QUEUE_BATCH_SIZE:
+        try:
+            batch.append(_queue.get(timeout=max(0, deadline - time.monotonic())))
+        except queue.Empty:
+            break
+    return batch
+
+
+def _run_worker():
+    while True:
+        batch = _take_batch()
+        try:
+            _write(batch)
+        finally:
+            for _ in batch:
+                _queue.task_done()
+            # The worker thread has its own database connection; don't keep it open while idle.
+            connection.close()
+
+
+def flush_reviews():
+    """
+    Blocks until every review queued so far is written (used at shutdown and by management commands).
+    """
+    if _queue is not None:
+        _queue.join()
+
+
+@atexit.register
+def _flush_at_exit():
+    if _queue is not None and _worker is not None and _worker.is_alive():
+        flush_reviews()
@@ -0,0 +1,165 @@
+# shop/search.py
+# This file contains the product search index.
+# On SQLite, products are mirrored into an FTS5 virtual table (name, description, category name)
+# that is kept in sync by the signal receivers in shop/signals.py, and can be rebuilt with
+# `python manage.py rebuild_search_index`. Results are ranked with BM25 and every search word
+# is treated as a prefix, so "den jac" finds "Denim Jacket".
+# On other databases search falls back to a simple name__icontains filter.
+
+import re
+
+from django.db import connection
+
+from .models import Product
+
+FTS_TABLE = 'shop_product_fts'
+
+# BM25 column weights: a match in the name counts far more than one in the category or description.
+BM25_WEIGHTS = (10.0, 1.0, 4.0)
+
+# Autocomplete ranks at most this many candidate rows, so very common prefixes ("sh") stay as fast as rare ones.
+AUTOCOMPLETE_CANDIDATES = 200
+
+CREATE_FTS_TABLE = (
+    f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5("
+    "name, description, category, "
+    # Prefix indexes make 2- and 3-character prefix queries (autocomplete) index lookups.
+    "prefix='2 3', "
+    "tokenize='unicode61 remove_diacritics 2')"
+)
+
+_INSERT_SELECT = (
+    f"INSERT INTO {FTS_TABLE} (rowid, name, description, category) "
+    "SELECT p.id, p.name, p.description, c.name "
+    "FROM shop_product p JOIN shop_category c ON c.id = p.category_id"
+)
+
+# Keep IN (...) lists well under SQLite's bound-parameter limit.
+_CHUNK_SIZE = 500
+
+
+def fts_enabled(using=None):
+    """
+    Returns True if the search index is available (the database is SQLite).
+    """
+    return (using or connection).vendor == 'sqlite'
+
+
+def build_match_query(text, column=None):
+    """
+    Turns free text typed by a customer into an FTS5 MATCH expression.
+    Each word becomes a quoted prefix term ("word"*) and all of them must match.
+    Returns '' if the text has no searchable words.
+    """
+    words = re.findall(r'\w+', text.lower())
+    if not words:
+        return ''
+    query = ' AND '.join(f'"{word}"*' for word in words)
+    if column:
+        query = f'{{{column}}} : ({query})'
+    return query
+
+
+def _chunks(ids):
+    ids = list(ids)
+    for start in range(0, len(ids), _CHUNK_SIZE):
+        yield ids[start:start + _CHUNK_SIZE]
+
+
+def index_products(product_ids):
+    """
+    Adds or refreshes the index rows of the given products.
+    """
+    if not fts_enabled():
+        return
+    with connection.cursor() as cursor:
+        for chunk in _chunks(product_ids):
+            placeholders = ', '.join(['%s'] * len(chunk))
+            cursor.execute(f"DELETE FROM {FTS_TABLE} WHERE rowid IN ({placeholders})", chunk)
+            cursor.execute(f"{_INSERT_SELECT} WHERE p.id IN ({placeholders})", chunk)
+
+
+def index_category(category_id):
+    """
+    Refreshes the index rows of every product in a category (after the category was renamed).
+    """
+    if not fts_enabled():
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"DELETE FROM {FTS_TABLE} WHERE rowid IN (SELECT id FROM shop_product WHERE category_id = %s)",
+            [category_id],
+        )
+        cursor.execute(f"{_INSERT_SELECT} WHERE p.category_id = %s", [category_id])
+
+
+def remove_products(product_ids):
+    """
+    Removes the index rows of the given products.
+    """
+    if not fts_enabled():
+        return
+    with connection.cursor() as cursor:
+        for chunk in _chunks(product_ids):
+            placeholders = ', '.join(['%s'] * len(chunk))
+            cursor.execute(f"DELETE FROM {FTS_TABLE} WHERE rowid IN ({placeholders})", chunk)
+
+
+def rebuild_index():
+    """
+    Recreates the whole index from the product table in one INSERT ... SELECT,
+    then merges the index segments. Returns the number of indexed products.
+    """
+    if not fts_enabled():
+        return 0
+    with connection.cursor() as cursor:
+        cursor.execute(CREATE_FTS_TABLE)
+        cursor.execute(f"DELETE FROM {FTS_TABLE}")
+        cursor.execute(_INSERT_SELECT)
+        cursor.execute(f"INSERT INTO {FTS_TABLE} ({FTS_TABLE}) VALUES ('optimize')")
+        cursor.execute(f"SELECT COUNT(*) FROM {FTS_TABLE}")
+        return cursor.fetchone()[0]
+
+
+def search_products(text, limit=48):
+    """
+    Returns up to `limit` products matching `text`, best match first.
+    """
+    if not fts_enabled():
+        return list(Product.objects.filter(name__icontains=text.strip())[:limit]) if text.strip() else []
+    query = build_match_query(text)
+    if not query:
+        return []
+    weights = ', '.join(str(weight) for weight in BM25_WEIGHTS)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s "
+            f"ORDER BY bm25({FTS_TABLE}, {weights}) LIMIT %s",
+            [query, limit],
+        )
+        ids = [row[0] for row in cursor.fetchall()]
+    products = Product.objects.select_related('category').order_by().in_bulk(ids)
+    return [products[product_id] for product_id in ids if product_id in products]
+
+
+def autocomplete(text, limit=8):
+    """
+    Returns up to `limit` (name, slug) pairs whose name matches every word of `text` as a prefix.
+    The first AUTOCOMPLETE_CANDIDATES matches are ranked by BM25 and the best ones returned.
+    Reads only the index and the product primary key, so it stays fast on large catalogs.
+    """
+    if not fts_enabled():
+        if not text.strip():
+            return []
+        return list(Product.objects.filter(name__icontains=text.strip()).values_list('name', 'slug')[:limit])
+    query = build_match_query(text, column='name')
+    if not query:
+        return []
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT c.name, p.slug FROM ("
+            f"  SELECT rowid, name, rank FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s LIMIT %s"
+            ") c JOIN shop_product p ON p.id = c.rowid ORDER BY c.rank LIMIT %s",
+            [query, AUTOCOMPLETE_CANDIDATES, limit],
+        )
+        return cursor.fetchall()
@@ -0,0 +1,236 @@
+# shop/sessions.py
+# This file contains the session engine (SESSION_ENGINE = 'shop.sessions'): Django's cached_db sessions,
+# with fewer writes to the django_session table, whose rows every cart click and message used to rewrite.
+# It needs a sessions cache shared by every worker process (SHOP_CACHE_DIR, see config/settings.py): with a
+# per-process cache, workers would keep reading their own stale copy of a session after another one changed
+# or deleted it, so the settings only select this engine when SHOP_CACHE_DIR is set.
+#   - Reads come from the 'sessions' cache (SESSION_CACHE_ALIAS), falling back to the database.
+#   - A save whose serialized data is the same as what was loaded or last saved writes nothing.
+#   - A changed session goes to the cache at once, and to the database within SESSION_WRITE_DELAY seconds:
+#     a background thread upserts every session changed in that window in one transaction, so a visitor
+#     clicking "Add to cart" five times in a second costs one row write instead of five.
+#     Sessions waiting for that write are kept in process (not only in the cache, which may evict them),
+#     and a normal shutdown writes them (see atexit below); a killed process loses them.
+#     This is off by default: SESSION_WRITE_DELAY = 0, an in-process (locmem) sessions cache that other
+#     workers cannot read, or an in-memory database writes every change through to the database inside
+#     the request, like cached_db (see config/settings.py).
+#   - Expired rows are deleted in batches of SESSION_CLEANUP_BATCH_SIZE, each its own short transaction:
+#     one batch after a session save, at most every SESSION_CLEANUP_INTERVAL seconds per process, and all
+#     of them, still batch by batch, from `python manage.py clearsessions`.
+
+import atexit
+import logging
+import threading
+import time
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.sessions.backends import cached_db
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import connection, transaction
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+# session_key -> (session_data, expire_date) of the changed sessions not written to the database yet.
+_pending = {}
+_pending_lock = threading.Lock()
+# Held while a batch is written, so a deleted session cannot be written back by a batch already under way.
+_write_lock = threading.Lock()
+_wake = threading.Event()
+_writer = None
+_writer_guard = threading.Lock()
+# When this process last deleted a batch of expired sessions.
+_last_cleanup = None
+_cleanup_lock = threading.Lock()
+
+
+def _write_behind():
+    # Another worker process must find a pending session in the cache, not its stale database row.
+    if settings.SESSION_WRITE_DELAY <= 0 or isinstance(caches[settings.SESSION_CACHE_ALIAS], LocMemCache):
+        return False
+    # A shared in-memory SQLite database (tests, benchmarks) locks whole tables between threads (see shop/review_queue.py).
+    return not (connection.vendor == 'sqlite' and connection.is_in_memory_db())
+
+
+def _queue_write(session_key, session_data, expire_date):
+    global _writer
+    with _pending_lock:
+        # A newer save of the same session replaces the one still waiting: this is the coalescing.
+        _pending[session_key] = (session_data, expire_date)
+    with _writer_guard:
+        if _writer is None or not _writer.is_alive():
+            _writer = threading.Thread(target=_run_writer, name='session-writer', daemon=True)
+            _writer.start()
+    _wake.set()
+
+
+def flush_sessions():
+    """
+    Writes every session waiting for the database with one upsert. Returns how many were written.
+    """
+    with _write_lock:
+        with _pending_lock:
+            batch = dict(_pending)
+        if not batch:
+            return 0
+        model = SessionStore.get_model_class()
+        with transaction.atomic():
+            model.objects.bulk_create(
+                [
+                    model(session_key=session_key, session_data=session_data, expire_date=expire_date)
+                    for session_key, (session_data, expire_date) in batch.items()
+                ],
+                update_conflicts=True,
+                unique_fields=['session_key'],
+                update_fields=['session_data', 'expire_date'],
+            )
+        with _pending_lock:
+            for session_key, entry in batch.items():
+                # Sessions saved again during the write stay pending with their newer data.
+                if _pending.get(session_key) is entry:
+                    del _pending[session_key]
+    return len(batch)
+
+
+def _run_writer():
+    while True:
+        _wake.wait()
+        # Let the other changes of this window arrive before writing.
+        time.sleep(settings.SESSION_WRITE_DELAY)
+        _wake.clear()
+        try:
+            flush_sessions()
+        except Exception:
+            # The sessions stay pending and are retried with the next window.
+            logger.exception("Could not write %s sessions to the database", len(_pending))
+            _wake.set()
+        finally:
+            # The writer thread has its own database connection; don't keep it open while idle.
+            connection.close()
+
+
+def _clear_expired_if_due():
+    """
+    Deletes one batch of expired sessions if this process has not done so for SESSION_CLEANUP_INTERVAL seconds.
+    """
+    global _last_cleanup
+    with _cleanup_lock:
+        now = time.monotonic()
+        if _last_cleanup is not None and now - _last_cleanup < settings.SESSION_CLEANUP_INTERVAL:
+            return
+        _last_cleanup = now
+    try:
+        SessionStore.clear_expired_batch()
+    except Exception:
+        # Cleanup is best effort; the next batch (or clearsessions) gets these rows.
+        logger.exception("Could not delete expired sessions")
+
+
+@atexit.register
+def _flush_at_exit():
+    if _pending:
+        flush_sessions()
+
+
+class SessionStore(cached_db.SessionStore):
+    """
+    cached_db session store that skips unchanged saves and coalesces database writes (see above).
+    """
+    # The serialized data as it was loaded or last saved, to recognise saves that change nothing.
+    _saved_state = None
+
+    def _state(self, data):
+        return self.serializer().dumps(data)
+
+    def _pending_session(self, entry):
+        session_data, expire_date = entry
+        if expire_date <= timezone.now():
+            return None
+        return self.model(session_key=self.session_key, session_data=session_data, expire_date=expire_date)
+
+    def _get_session_from_db(self):
+        # A session evicted from the cache may not have reached the database yet.
+        entry = _pending.get(self.session_key)
+        return super()._get_session_from_db() if entry is None else self._pending_session(entry)
+
+    async def _aget_session_from_db(self):
+        entry = _pending.get(self.session_key)
+        return await super()._aget_session_from_db() if entry is None else self._pending_session(entry)
+
+    def load(self):
+        data = super().load()
+        self._saved_state = self._state(data)
+        return data
+
+    async def aload(self):
+        data = await super().aload()
+        self._saved_state = self._state(data)
+        return data
+
+    def exists(self, session_key):
+        return session_key in _pending or super().exists(session_key)
+
+    async def aexists(self, session_key):
+        return session_key in _pending or await super().aexists(session_key)
+
+    def save(self, must_create=False):
+        if self.session_key is None:
+            return self.create()
+        data = self._get_session(no_load=must_create)
+        state = self._state(data)
+        # With SESSION_SAVE_EVERY_REQUEST, saves refresh the expiry date, so none of them are skipped.
+        if not must_create and state == self._saved_state and not settings.SESSION_SAVE_EVERY_REQUEST:
+            return
+        if must_create or not _write_behind():
+            super().save(must_create)
+        else:
+            try:
+                self._cache.set(self.cache_key, data, self.get_expiry_age())
+            except Exception:
+                logger.exception("Error saving to cache (%s)", self._cache)
+            _queue_write(self.session_key, self.encode(data), self.get_expiry_date())
+        self._saved_state = state
+        _clear_expired_if_due()
+
+    async def asave(self, must_create=False):
+        await sync_to_async(self.save)(must_create)
+
+    def delete(self, session_key=None):
+        session_key = session_key or self.session_key
+        if session_key is None:
+            return
+        with _write_lock:
+            with _pending_lock:
+                _pending.pop(session_key, None)
+            super().delete(session_key)
+
+    async def adelete(self, session_key=None):
+        await sync_to_async(self.delete)(session_key)
+
+    @classmethod
+    def clear_expired_batch(cls, batch_size=None):
+        """
+        Deletes up to `batch_size` expired sessions (default SESSION_CLEANUP_BATCH_SIZE). Returns how many were deleted.
+        """
+        model = cls.get_model_class()
+        keys = list(
+            model.objects.filter(expire_date__lt=timezone.now())
+            .values_list('session_key', flat=True)[:batch_size or settings.SESSION_CLEANUP_BATCH_SIZE]
+        )
+        if not keys:
+            return 0
+        return model.objects.filter(session_key__in=keys).delete()[0]
+
+    @classmethod
+    def clear_expired(cls):
+        """
+        Deletes every expired session, one batch per transaction (used by `manage.py clearsessions`).
+        """
+        while cls.clear_expired_batch() >= settings.SESSION_CLEANUP_BATCH_SIZE:
+            pass
+
+    @classmethod
+    async def aclear_expired(cls):
+        await sync_to_async(cls.clear_expired)()
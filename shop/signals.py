@@ -0,0 +1,140 @@
+# shop/signals.py
+# This file connects model signals to the caches that depend on them.
+# It is imported from ShopConfig.ready() so the receivers are registered once at startup.
+
+from django.contrib.auth.signals import user_logged_in
+from django.db.models import QuerySet
+from django.db.models.signals import post_delete, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+
+from .cart import merge_session_cart
+from .facets import current_cells, move_product, product_cell
+from .models import Category, Product, Review
+from .images import needs_variants, schedule_variants
+from .ratings import apply_rating_changes, recompute_product_ratings
+from .recommendations import mark_stale, rebuild_on_commit
+from .search import index_category, index_products, remove_products
+from .versioning import CART_SNAPSHOT, CATALOG, bump_version
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def invalidate_cart_snapshots(sender, **kwargs):
+    """
+    A product's name, price, slug or image may have changed (or it is gone),
+    so every cart snapshot stored in a session has to be rebuilt on its next read.
+    """
+    bump_version(CART_SNAPSHOT)
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+@receiver(post_save, sender=Review)
+@receiver(post_delete, sender=Review)
+def invalidate_catalog_caches(sender, **kwargs):
+    """
+    Cached pages and template fragments (shop/caching.py) are keyed by the catalog version,
+    so any change to a product, category or review makes them all miss on their next read.
+    """
+    bump_version(CATALOG)
+
+
+@receiver(post_save, sender=Review)
+def update_ratings_on_review_save(sender, instance, created, **kwargs):
+    """
+    A new review adds to its product's rating aggregates in the same transaction as the insert.
+    An edited review may have changed its rating, so that product is recomputed instead.
+    """
+    if created:
+        apply_rating_changes(instance.product_id, {instance.rating: 1})
+    else:
+        recompute_product_ratings(instance.product_id)
+
+
+@receiver(post_delete, sender=Review)
+def update_ratings_on_review_delete(sender, instance, origin=None, **kwargs):
+    """
+    Reviews deleted along with their product (or its category) are skipped: the product row is about to go,
+    and updating it first would move it to another facet cell than the one its own delete removes it from.
+    """
+    model = origin.model if isinstance(origin, QuerySet) else type(origin)
+    if model not in (Product, Category):
+        apply_rating_changes(instance.product_id, {instance.rating: -1})
+
+
+@receiver(post_save, sender=Product)
+def update_search_index_on_product_save(sender, instance, **kwargs):
+    index_products([instance.pk])
+
+
+@receiver(post_delete, sender=Product)
+def update_search_index_on_product_delete(sender, instance, **kwargs):
+    remove_products([instance.pk])
+
+
+@receiver(post_save, sender=Category)
+def update_search_index_on_category_save(sender, instance, created, **kwargs):
+    """
+    The category name is part of every product's index row, so a renamed category reindexes its products.
+    """
+    if not created:
+        index_category(instance.pk)
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def mark_recommendations_stale(sender, instance, **kwargs):
+    """
+    Adding, changing or removing a product can change the related items of every product in its category,
+    and in the category it was moved out of (read before the save by remember_facet_cell below).
+    The rows are rebuilt after the commit (see rebuild_on_commit).
+    """
+    old_cell = getattr(instance, '_facet_cell', None)
+    category_ids = {instance.category_id, old_cell[0]} if old_cell else {instance.category_id}
+    mark_stale(category_ids)
+    rebuild_on_commit(instance.pk, category_ids)
+
+
+@receiver(post_save, sender=Product)
+def build_image_variants(sender, instance, **kwargs):
+    """
+    A new or replaced image gets its resized variants built in the background after the save commits.
+    """
+    if needs_variants(instance):
+        schedule_variants(instance)
+
+
+@receiver(pre_save, sender=Product)
+@receiver(pre_delete, sender=Product)
+def remember_facet_cell(sender, instance, **kwargs):
+    """
+    Reads the product's facet index cell as stored in the database, before it is changed or deleted.
+    """
+    instance._facet_cell = current_cells([instance.pk]).get(instance.pk) if instance.pk else None
+
+
+@receiver(post_save, sender=Product)
+def update_facet_counts_on_product_save(sender, instance, **kwargs):
+    """
+    Moves the product to the facet cell of its new category and price. The rating is taken from the
+    database row: it is only changed by F() updates (shop/ratings.py), so the instance may hold an old one.
+    """
+    old_cell = getattr(instance, '_facet_cell', None)
+    rating = old_cell[2] if old_cell else instance.rating_avg
+    move_product(old_cell, product_cell(instance.category_id, instance.price, rating))
+
+
+@receiver(post_delete, sender=Product)
+def update_facet_counts_on_product_delete(sender, instance, **kwargs):
+    move_product(getattr(instance, '_facet_cell', None), None)
+
+
+@receiver(user_logged_in)
+def merge_cart_on_login(sender, request, user, **kwargs):
+    """
+    Items added to the cart before logging in are moved into the user's database cart.
+    """
+    if request is not None and hasattr(request, 'session'):
+        merge_session_cart(request, user)
@@ -0,0 +1,43 @@
+# shop/templatetags/shop_images.py
+# Template tags for product images.
+# Usage:
+#   {% load shop_images %}
+#   {% responsive_image product sizes="(max-width: 768px) 100vw, 33vw" class="card-img-top" style="height: 200px;" %}
+# Renders a <picture> with WebP and JPEG srcsets built from Product.image_variants, so browsers download
+# the smallest copy that fits. Products without variants yet get a plain <img> of the original upload.
+
+from django import template
+from django.utils.html import format_html, format_html_join
+
+from shop.images import variant_srcset
+
+register = template.Library()
+
+PLACEHOLDER_URL = 'https://via.placeholder.com/300x200?text=No+Image'
+
+
+@register.simple_tag
+def responsive_image(product, sizes='100vw', **attrs):
+    """
+    Renders the product's image. Extra keyword arguments (class, style, onerror, ...) become <img> attributes.
+    """
+    attrs.setdefault('alt', product.name)
+    attrs.setdefault('loading', 'lazy')
+    attrs.setdefault('decoding', 'async')
+    if not product.image:
+        attrs['src'] = PLACEHOLDER_URL
+        return format_html('<img {}>', _attributes(attrs))
+    attrs['src'] = product.image.url
+    variants = product.image_variants
+    if variants.get('source') != product.image.name:
+        return format_html('<img {}>', _attributes(attrs))
+    attrs['srcset'] = variant_srcset(product, 'jpeg')
+    attrs['sizes'] = sizes
+    return format_html(
+        '<picture><source type="image/webp" srcset="{}" sizes="{}"><img {}></picture>',
+        variant_srcset(product, 'webp'), sizes, _attributes(attrs),
+    )
+
+
+def _attributes(attrs):
+    return format_html_join(' ', '{}="{}"', sorted(attrs.items()))
@@ -0,0 +1,57 @@
+# shop/templating.py
+# This file contains the template warmup run when a server process starts (config/wsgi.py, config/asgi.py).
+# The template engine keeps every compiled template in memory (the cached loader, see TEMPLATES in
+# config/settings.py), but only once a request has needed it, so the first requests of every new worker
+# used to pay for reading and parsing layout.html, the page, its includes and the crispy form templates.
+# warm_templates() compiles all of them up front.
+
+import logging
+import os
+
+from django.conf import settings
+from django.template import TemplateSyntaxError, engines
+from django.template.utils import get_app_template_dirs
+
+logger = logging.getLogger(__name__)
+
+
+def _html_files(directory, prefix):
+    """
+    Returns the template names of the .html files under directory/prefix, e.g. 'shop/home.html'.
+    """
+    names = []
+    for root, _, files in os.walk(os.path.join(directory, prefix)):
+        for name in files:
+            if name.endswith('.html'):
+                names.append(os.path.relpath(os.path.join(root, name), directory).replace(os.sep, '/'))
+    return names
+
+
+def warmup_template_names():
+    """
+    Returns the names of the templates compiled at startup: layout.html, every shop/ template,
+    and the templates of the crispy forms template pack (CRISPY_TEMPLATE_PACK).
+    """
+    names = ['layout.html']
+    for directory in settings.TEMPLATES[0]['DIRS']:
+        names += _html_files(directory, 'shop')
+    for directory in get_app_template_dirs('templates'):
+        names += _html_files(directory, settings.CRISPY_TEMPLATE_PACK)
+    return sorted(set(names))
+
+
+def warm_templates():
+    """
+    Compiles the templates of warmup_template_names() into the cached loader. Returns how many were compiled.
+    A template that does not compile is logged and skipped: the request that needs it will show the error.
+    """
+    engine = engines['django']
+    compiled = 0
+    for name in warmup_template_names():
+        try:
+            engine.get_template(name)
+        except TemplateSyntaxError:
+            logger.exception("Could not compile template %s", name)
+        else:
+            compiled += 1
+    return compiled
@@ -1,3 +1,1310 @@
-from django.test import TestCase
+# shop/tests.py
+# This file contains the tests of the shop app. Run them with `python manage.py test shop`.
 
-# Create your tests here.
+import gzip
+import io
+import json
+import os
+import tempfile
+from collections import Counter
+from datetime import timedelta
+from decimal import Decimal
+from importlib import import_module
+from unittest import mock
+from wsgiref.util import setup_testing_defaults
+
+from asgiref.sync import iscoroutinefunction
+from django.apps import apps as django_apps
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser, User
+from django.contrib.sessions.backends.db import SessionStore
+from django.contrib.sessions.models import Session
+from django.contrib.staticfiles.storage import staticfiles_storage
+from django.core.cache import cache, caches
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management import CommandError, call_command
+from django.db import OperationalError, connection
+from django.db.utils import ConnectionHandler
+from django.db.models import Max
+from django.db.models.signals import pre_save
+from django.template import engines
+from django.template.loaders.filesystem import Loader as FilesystemLoader
+from django.templatetags.static import static
+from django.test import Client, RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.text import slugify
+from PIL import Image as PILImage
+
+from config.database import DEFAULT_SQLITE_PRAGMAS, sqlite_database
+
+from . import images, profiling, review_queue, sessions, views
+from .assets import StaticFilesApplication, minify_css, minify_js
+from .benchmarking import ROUTES, compare, run_benchmark, seed_catalog
+from .cart import CART_SESSION_KEY, MAX_ITEM_QUANTITY, SNAPSHOT_SESSION_KEY, add_item, get_cart_summary
+from .catalog import encode_cursor
+from .catalog_io import export_catalog, import_catalog
+from .checkout import TOKEN_MAX_LENGTH, CheckoutError, place_order
+from .facets import FacetSelection, current_cells, facet_cells
+from .management.commands.explain_queries import problems_in
+from .models import (
+    CartItem, Category, FacetCount, Order, OrderItem, Product, ProductRecommendation, Review, RouteStat,
+    VersionCounter,
+)
+from .recommendations import build_all, mark_stale
+from .search import autocomplete, search_products
+from .templating import warm_templates, warmup_template_names
+from .versioning import CART_SNAPSHOT, CATALOG, bump_version, get_version
+
+
+class CatalogImportTests(TestCase):
+    """
+    Imports and exports of shop/catalog_io.py.
+    """
+    def setUp(self):
+        self.category = Category.objects.create(name="Home Office", slug="Home-Office")
+        Product.objects.create(
+            name="Desk Lamp", slug="Desk-Lamp", description="A lamp.", price='19.99', category=self.category,
+        )
+        Product.objects.create(
+            name="Desk Lamp", slug="desk-lamp-2", description="Another lamp.", price='24.99', category=self.category,
+        )
+
+    def _import(self, text, fmt='csv'):
+        return import_catalog(io.StringIO(text), fmt, batch_size=10, workers=1)
+
+    def test_export_then_import_changes_nothing(self):
+        exported = io.StringIO()
+        export_catalog(exported, 'csv')
+        stats = self._import(exported.getvalue())
+        self.assertEqual((stats.created, stats.updated, stats.errors), (0, 2, []))
+        self.assertEqual(Product.objects.count(), 2)
+        self.assertEqual(Category.objects.count(), 1)
+        again = io.StringIO()
+        export_catalog(again, 'csv')
+        self.assertEqual(again.getvalue(), exported.getvalue())
+
+    def test_generated_slugs_skip_slugs_taken_in_the_chunk_and_database(self):
+        stats = self._import(
+            "name,slug,price,category_slug\n"
+            "Desk Lamp,,10,Home-Office\n"
+            "Other,desk-lamp-3,11,Home-Office\n"
+            "Desk Lamp,,12,Home-Office\n"
+        )
+        self.assertEqual((stats.created, stats.errors), (3, []))
+        self.assertEqual(
+            sorted(Product.objects.values_list('slug', flat=True)),
+            ['Desk-Lamp', 'desk-lamp', 'desk-lamp-2', 'desk-lamp-3', 'desk-lamp-4'],
+        )
+
+    def test_repeated_and_invalid_explicit_slugs_are_row_errors(self):
+        stats = self._import(
+            "name,slug,price,category_slug\n"
+            "First,new-lamp,10,Home-Office\n"
+            "Second,new-lamp,11,Home-Office\n"
+            "Third,not a slug,12,Home-Office\n"
+        )
+        self.assertEqual(stats.created, 1)
+        self.assertEqual(stats.failed, 2)
+        self.assertEqual(sorted(stats.errors), [
+            "line 3: slug 'new-lamp' is already used on line 2", "line 4: invalid slug 'not a slug'",
+        ])
+        self.assertEqual(Product.objects.get(slug='new-lamp').name, "First")
+
+
+class VersionTests(TestCase):
+    """
+    The version counters of shop/versioning.py, shared by every process through the database.
+    """
+    def setUp(self):
+        cache.clear()
+        category = Category.objects.create(name="Lamps", slug="lamps")
+        self.product = Product.objects.create(
+            name="Desk Lamp", slug="desk-lamp", description="A lamp.", price='19.99', category=category,
+        )
+
+    def test_bump_is_seen_at_once_by_this_process(self):
+        before = get_version(CATALOG)
+        self.assertEqual(bump_version(CATALOG), before + 1)
+        self.assertEqual(get_version(CATALOG), before + 1)
+        self.assertEqual(VersionCounter.objects.get(name=CATALOG).value, before + 1)
+
+    @override_settings(VERSION_CHECK_INTERVAL=0)
+    def test_bump_by_another_process_invalidates_cached_pages(self):
+        self.assertContains(self.client.get(reverse('home')), "Desk Lamp")
+        # Another process renames the product and bumps the counter; this process only sees the database row.
+        Product.objects.filter(pk=self.product.pk).update(name="Floor Lamp")
+        VersionCounter.objects.update_or_create(name=CATALOG, defaults={'value': get_version(CATALOG) + 1})
+        response = self.client.get(reverse('home'))
+        self.assertContains(response, "Floor Lamp")
+        self.assertNotContains(response, "Desk Lamp")
+
+
+class ProductSaveTests(TestCase):
+    """
+    Saving a product must not write back stale review aggregates and image variants.
+    """
+    def setUp(self):
+        self.owner = User.objects.create_user('owner', password='secret')
+        self.category = Category.objects.create(name="Lamps", slug="lamps")
+        self.product = Product.objects.create(
+            name="Desk Lamp", slug="desk-lamp", description="A lamp.", price='19.99', category=self.category,
+            image='products/lamp.jpg', created_by=self.owner,
+        )
+        self.variants = {'source': 'products/lamp.jpg', 'webp': {'320': 'lamp-320.webp'}}
+
+    def _review_and_build_variants(self, **kwargs):
+        # What a review and a finished variant build write while an instance loaded earlier is held.
+        Product.objects.filter(pk=self.product.pk).update(
+            rating_count=1, rating_sum=4, rating_avg=4.0, rating_4_count=1, image_variants=self.variants,
+        )
+
+    def assertDerivedFieldsKept(self):
+        product = Product.objects.get(pk=self.product.pk)
+        self.assertEqual((product.rating_count, product.rating_sum, product.rating_4_count), (1, 4, 1))
+        self.assertEqual(product.image_variants, self.variants)
+
+    def test_save_of_a_stale_instance_keeps_derived_fields(self):
+        self._review_and_build_variants()
+        self.product.name = "Desk Lamp XL"
+        self.product.save()
+        self.assertEqual(Product.objects.get(pk=self.product.pk).name, "Desk Lamp XL")
+        self.assertDerivedFieldsKept()
+
+    def test_edit_product_keeps_derived_fields(self):
+        self.client.force_login(self.owner)
+        # The review lands between the view loading the product and saving the form.
+        pre_save.connect(self._review_and_build_variants, sender=Product)
+        try:
+            response = self.client.post(reverse('edit_product', args=['desk-lamp']), {
+                'name': "Desk Lamp XL", 'slug': 'desk-lamp', 'description': "A bigger lamp.", 'price': '24.99',
+                'category': self.category.pk,
+            })
+        finally:
+            pre_save.disconnect(self._review_and_build_variants, sender=Product)
+        self.assertRedirects(response, reverse('product_detail', args=['desk-lamp']), fetch_redirect_response=False)
+        self.assertEqual(Product.objects.get(pk=self.product.pk).name, "Desk Lamp XL")
+        self.assertDerivedFieldsKept()
+
+
+class PlaceOrderTests(TestCase):
+    """
+    place_order() of shop/checkout.py.
+    """
+    def setUp(self):
+        self.user = User.objects.create_user('buyer')
+        category = Category.objects.create(name="Lamps", slug="lamps")
+        self.lamp = Product.objects.create(
+            name="Desk Lamp", slug="desk-lamp", description="A lamp.", price='19.99', category=category,
+        )
+        self.bulb = Product.objects.create(
+            name="Bulb", slug="bulb", description="A bulb.", price='2.50', category=category,
+        )
+        CartItem.objects.create(user=self.user, product=self.lamp, quantity=2)
+        CartItem.objects.create(user=self.user, product=self.bulb, quantity=3)
+
+    def test_places_the_cart_and_empties_it(self):
+        order, created = place_order(self.user, 'token-1')
+        self.assertTrue(created)
+        self.assertEqual(order.total, Decimal('47.48'))
+        self.assertEqual(
+            list(order.lines.order_by('product_name').values_list(
+                'product_id', 'product_name', 'unit_price', 'quantity',
+            )),
+            [(self.bulb.pk, "Bulb", Decimal('2.50'), 3), (self.lamp.pk, "Desk Lamp", Decimal('19.99'), 2)],
+        )
+        self.assertFalse(CartItem.objects.filter(user=self.user).exists())
+
+    def test_reused_token_returns_the_same_order(self):
+        order, _ = place_order(self.user, 'token-1')
+        again, created = place_order(self.user, 'token-1')
+        self.assertFalse(created)
+        self.assertEqual(again.pk, order.pk)
+        self.assertEqual(Order.objects.count(), 1)
+        self.assertEqual(OrderItem.objects.count(), 2)
+
+    def test_empty_cart_is_rejected(self):
+        CartItem.objects.filter(user=self.user).delete()
+        with self.assertRaisesMessage(CheckoutError, "Your cart is empty."):
+            place_order(self.user, 'token-1')
+        self.assertFalse(Order.objects.exists())
+
+    def test_stale_tokens_are_rejected(self):
+        place_order(self.user, 'token-1')
+        other = User.objects.create_user('other')
+        CartItem.objects.create(user=other, product=self.lamp, quantity=1)
+        # Missing, too long, or already used by someone else's order.
+        for token in ['', 'x' * (TOKEN_MAX_LENGTH + 1), 'token-1']:
+            with self.subTest(token=token[:10]), self.assertRaises(CheckoutError):
+                place_order(other, token)
+        self.assertEqual(Order.objects.count(), 1)
+        self.assertEqual(CartItem.objects.filter(user=other).count(), 1)
+
+
+class CartBatchTests(TestCase):
+    """
+    The cart_batch view and apply_cart_operations() of shop/cart.py.
+    """
+    def setUp(self):
+        cache.clear()
+        category = Category.objects.create(name="Lamps", slug="lamps")
+        self.lamp = Product.objects.create(
+            name="Desk Lamp", slug="desk-lamp", description="A lamp.", price='19.99', category=category,
+        )
+        self.bulb = Product.objects.create(
+            name="Bulb", slug="bulb", description="A bulb.", price='2.50', category=category,
+        )
+        self.user = User.objects.create_user('buyer')
+
+    def _batch(self, operations=None, body=None):
+        if body is None:
+            body = json.dumps({'operations': operations})
+        return self.client.post(reverse('cart_batch'), body, content_type='application/json')
+
+    def _session_cart(self):
+        return self.client.session.get(CART_SESSION_KEY, {})
+
+    def _user_cart(self):
+        return dict(CartItem.objects.filter(user=self.user).values_list('product__slug', 'quantity'))
+
+    def test_malformed_bodies_are_rejected(self):
+        for body in ['not json', '[]', '{"operations": []}', '{"operations": [{"op": "buy", "slug": "bulb"}]}']:
+            with self.subTest(body=body):
+                response = self._batch(body=body)
+                self.assertEqual(response.status_code, 400)
+                self.assertFalse(response.json()['success'])
+
+    def test_unknown_slug_rejects_the_whole_batch(self):
+        response = self._batch([{'op': 'add', 'slug': 'bulb'}, {'op': 'add', 'slug': 'no-such-lamp'}])
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("no-such-lamp", response.json()['error'])
+        self.assertEqual(self._session_cart(), {})
+
+    def test_anonymous_cart(self):
+        response = self._batch([
+            {'op': 'add', 'slug': 'bulb'}, {'op': 'add', 'slug': 'bulb', 'quantity': 2},
+            {'op': 'add', 'slug': 'desk-lamp'}, {'op': 'remove', 'slug': 'desk-lamp'},
+        ])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['count'], 3)
+        self.assertEqual(self._session_cart(), {str(self.bulb.pk): 3})
+
+    def test_logged_in_cart(self):
+        self.client.force_login(self.user)
+        CartItem.objects.create(user=self.user, product=self.bulb, quantity=1)
+        response = self._batch([
+            {'op': 'add', 'slug': 'bulb', 'quantity': 2}, {'op': 'add', 'id': self.lamp.pk},
+            {'op': 'remove', 'slug': 'desk-lamp'}, {'op': 'add', 'slug': 'desk-lamp'},
+        ])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['count'], 4)
+        self.assertEqual(self._user_cart(), {'bulb': 3, 'desk-lamp': 1})
+
+    def test_add_then_remove_the_same_product_leaves_nothing(self):
+        self.client.force_login(self.user)
+        response = self._batch([{'op': 'add', 'slug': 'bulb', 'quantity': 5}, {'op': 'remove', 'slug': 'bulb'}])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self._user_cart(), {})
+
+    def test_adds_are_capped_against_the_stored_quantity(self):
+        self.client.force_login(self.user)
+        CartItem.objects.create(user=self.user, product=self.bulb, quantity=MAX_ITEM_QUANTITY - 1)
+        response = self._batch([{'op': 'add', 'slug': 'desk-lamp'}, {'op': 'add', 'slug': 'bulb', 'quantity': 2}])
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self._user_cart(), {'bulb': MAX_ITEM_QUANTITY - 1})
+        response = self._batch([{'op': 'add', 'slug': 'bulb'}])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self._user_cart(), {'bulb': MAX_ITEM_QUANTITY})
+
+    def test_folded_adds_are_capped_in_the_session_cart(self):
+        half = MAX_ITEM_QUANTITY // 2 + 1
+        self.assertEqual(self._batch([{'op': 'add', 'slug': 'bulb', 'quantity': half}]).status_code, 200)
+        response = self._batch([
+            {'op': 'add', 'slug': 'desk-lamp'}, {'op': 'add', 'slug': 'bulb', 'quantity': half},
+        ])
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self._session_cart(), {str(self.bulb.pk): half})
+        response = self._batch([
+            {'op': 'set', 'slug': 'bulb', 'quantity': half}, {'op': 'add', 'slug': 'bulb', 'quantity': half},
+        ])
+        self.assertEqual(response.status_code, 400)
+
+
+class CartSummaryTests(TestCase):
+    """
+    The per-request cart summary of shop/cart.py, shared by the views that show the cart.
+    """
+    def setUp(self):
+        cache.clear()
+        category = Category.objects.create(name="Lamps", slug="lamps")
+        self.lamp = Product.objects.create(
+            name="Desk Lamp", slug="desk-lamp", description="A lamp.", price='19.99', category=category,
+        )
+        self.bulb = Product.objects.create(
+            name="Bulb", slug="bulb", description="A bulb.", price='2.50', category=category,
+        )
+
+    def _request(self, cart=None):
+        request = RequestFactory().get('/')
+        request.user = AnonymousUser()
+        request.session = SessionStore()
+        if cart is not None:
+            request.session[CART_SESSION_KEY] = cart
+        return request
+
+    def test_summary_is_computed_once_per_request(self):
+        request = self._request({str(self.lamp.pk): 1, str(self.bulb.pk): 2})
+        with self.assertNumQueries(1):
+            summary = get_cart_summary(request)
+            self.assertEqual([item['name'] for item in summary.items], ["Bulb", "Desk Lamp"])
+            self.assertEqual((summary.count, summary.total), (3, Decimal('24.99')))
+            self.assertIs(get_cart_summary(request), summary)
+        add_item(request, self.bulb)
+        self.assertEqual(get_cart_summary(request).count, 4)
+
+    def test_empty_cart_needs_no_query(self):
+        with self.assertNumQueries(0):
+            self.assertEqual(get_cart_summary(self._request()).total, 0)
+
+    def test_pages_without_the_cart_do_not_read_it(self):
+        user = User.objects.create_user('buyer')
+        CartItem.objects.create(user=user, product=self.bulb, quantity=1)
+        self.client.force_login(user)
+        for url in [reverse('home'), reverse('shop'), reverse('product_detail', args=['desk-lamp'])]:
+            with self.subTest(url=url), CaptureQueriesContext(connection) as queries:
+                self.assertEqual(self.client.get(url).status_code, 200)
+            self.assertFalse([query for query in queries if 'shop_cartitem' in query['sql']])
+
+
+class CartSnapshotTests(TestCase):
+    """
+    The denormalized cart snapshot kept in a visitor's session (shop/cart.py).
+    """
+    def setUp(self):
+        cache.clear()
+        category = Category.objects.create(name="Lamps", slug="lamps")
+        self.lamp = Product.objects.create(
+            name="Desk Lamp", slug="desk-lamp", description="A lamp.", price='19.99', category=category,
+        )
+        self.bulb = Product.objects.create(
+            name="Bulb", slug="bulb", description="A bulb.", price='2.50', category=category,
+        )
+        self.client.post(reverse('add_to_cart', args=['bulb']))
+
+    def _summary(self):
+        with CaptureQueriesContext(connection) as queries:
+            summary = self.client.get(reverse('cart_summary')).json()
+        self.product_queries = [query for query in queries if 'shop_product' in query['sql']]
+        return summary
+
+    def test_add_to_cart_patches_the_snapshot_in_place(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.client.post(reverse('add_to_cart', args=['desk-lamp']))
+        self.assertEqual(len([query for query in queries if 'shop_product' in query['sql']]), 1)  # The slug lookup
+        snapshot = self.client.session[SNAPSHOT_SESSION_KEY]
+        self.assertEqual((snapshot['cart_count'], snapshot['cart_total']), (2, '22.49'))
+        summary = self._summary()
+        self.assertEqual(self.product_queries, [])
+        self.assertEqual((summary['count'], summary['total']), (2, '22.49'))
+        self.client.post(reverse('remove_from_cart', args=['desk-lamp']))
+        self.assertEqual(self.client.session[SNAPSHOT_SESSION_KEY]['cart_count'], 1)
+
+    def test_product_changes_rebuild_the_snapshot(self):
+        self.bulb.price = Decimal('3.00')
+        self.bulb.save()
+        summary = self._summary()
+        self.assertEqual(len(self.product_queries), 1)
+        self.assertEqual(summary['total'], '3.00')
+        self._summary()
+        self.assertEqual(self.product_queries, [])  # Stored again in the session
+        self.bulb.delete()
+        self.assertEqual(self._summary()['count'], 0)
+
+
+class MergeCartOnLoginTests(TestCase):
+    """
+    merge_session_cart() of shop/cart.py, run by the user_logged_in receiver of shop/signals.py.
+    """
+    def setUp(self):
+        cache.clear()
+        category = Category.objects.create(name="Lamps", slug="lamps")
+        self.lamp = Product.objects.create(
+            name="Desk Lamp", slug="desk-lamp", description="A lamp.", price='19.99', category=category,
+        )
+        self.bulb = Product.objects.create(
+            name="Bulb", slug="bulb", description="A bulb.", price='2.50', category=category,
+        )
+        self.user = User.objects.create_user('buyer', password='secret')
+        CartItem.objects.create(user=self.user, product=self.bulb, quantity=2)
+
+    def test_login_adds_the_session_cart_to_the_database_cart(self):
+        response = self.client.post(reverse('cart_batch'), json.dumps({'operations': [
+            {'op': 'add', 'slug': 'bulb', 'quantity': 3}, {'op': 'add', 'slug': 'desk-lamp'},
+        ]}), content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        response = self.client.post('/login/', {'username': 'buyer', 'password': 'secret'})
+        self.assertRedirects(response, reverse('dashboard'), fetch_redirect_response=False)
+        self.assertEqual(
+            dict(CartItem.objects.filter(user=self.user).values_list('product__slug', 'quantity')),
+            {'bulb': 5, 'desk-lamp': 1},
+        )
+        self.assertNotIn(CART_SESSION_KEY, self.client.session)
+        self.assertEqual(self.client.get(reverse('cart_summary')).json()['count'], 6)
+
+
+class RecommendationTests(TestCase):
+    """
+    Keeping the precomputed rows of shop/recommendations.py up to date.
+    """
+    def setUp(self):
+        cache.clear()
+        self.lamps = Category.objects.create(name="Lamps", slug="lamps")
+        self.bulbs = Category.objects.create(name="Bulbs", slug="bulbs")
+        self.products = {}
+        for name, category in [("Desk Lamp", self.lamps), ("Floor Lamp", self.lamps),
+                               ("LED Bulb", self.bulbs), ("Halogen Bulb", self.bulbs)]:
+            self.products[name] = Product.objects.create(
+                name=name, slug=slugify(name), description=name, price='10.00', category=category,
+            )
+        build_all()
+
+    def _stale(self):
+        return set(ProductRecommendation.objects.filter(is_stale=True).values_list('product__name', flat=True))
+
+    @override_settings(RECOMMENDATION_REBUILDS_PER_SAVE=0)
+    def test_moving_a_product_marks_both_categories_stale_and_rebuilds_its_row(self):
+        moved = self.products["Desk Lamp"]
+        moved.category = self.bulbs
+        with self.captureOnCommitCallbacks(execute=True):
+            moved.save()
+        self.assertEqual(self._stale(), {"Floor Lamp", "LED Bulb", "Halogen Bulb"})
+        row = ProductRecommendation.objects.get(product=moved)
+        self.assertFalse(row.is_stale)
+        self.assertEqual(
+            set(row.product_ids), {self.products["LED Bulb"].pk, self.products["Halogen Bulb"].pk},
+        )
+
+    def test_product_page_serves_a_stale_row_without_rebuilding_it(self):
+        mark_stale([self.lamps.pk])
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('product_detail', args=['desk-lamp']))
+        self.assertContains(response, "Floor Lamp")
+        self.assertFalse([query for query in queries if not query['sql'].startswith('SELECT')])
+        self.assertEqual(self._stale(), {"Desk Lamp", "Floor Lamp"})
+
+    def test_a_new_product_shows_up_in_its_category_once_the_save_commits(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            new = Product.objects.create(
+                name="Wall Lamp", slug="wall-lamp", description="A lamp.", price='10.00', category=self.lamps,
+            )
+        self.assertEqual(self._stale(), set())
+        self.assertIn(new.pk, ProductRecommendation.objects.get(product=self.products["Desk Lamp"]).product_ids)
+
+    def test_a_product_without_a_row_shows_products_of_its_category(self):
+        ProductRecommendation.objects.all().delete()
+        response = self.client.get(reverse('product_detail', args=['desk-lamp']))
+        self.assertEqual(response.context['recommendations'], [self.products["Floor Lamp"]])
+
+    def test_migrate_builds_the_missing_rows(self):
+        ProductRecommendation.objects.filter(product__category=self.bulbs).delete()
+        call_command('migrate', 'shop', verbosity=0)
+        self.assertEqual(ProductRecommendation.objects.count(), 4)
+        self.assertEqual(self._stale(), set())
+
+
+class ProductCardTests(TestCase):
+    """
+    The product cards of the shop page are cached and shared, so they must not need a CSRF token.
+    """
+    def test_add_to_cart_links_to_the_product_page_whose_form_has_a_token(self):
+        category = Category.objects.create(name="Lamps", slug="lamps")
+        Product.objects.create(
+            name="Desk Lamp", slug="desk-lamp", description="A lamp.", price='19.99', category=category,
+        )
+        cache.clear()
+        client = Client(enforce_csrf_checks=True)
+        response = client.get(reverse('shop'))
+        detail_url = reverse('product_detail', args=['desk-lamp'])
+        self.assertContains(response, f'<a href="{detail_url}" class="btn btn-sm btn-outline-primary mt-2 add-to-cart')
+        self.assertNotContains(response, reverse('add_to_cart', args=['desk-lamp']))
+        response = client.get(detail_url)
+        self.assertContains(response, 'name="csrfmiddlewaretoken"')
+        token = response.context['csrf_token']
+        response = client.post(reverse('add_to_cart', args=['desk-lamp']), {'csrfmiddlewaretoken': str(token)})
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(client.get(reverse('cart_summary')).json()['count'], 1)
+
+
+class SubmitReviewTests(TestCase):
+    """
+    Validation of the submit_review view.
+    """
+    def setUp(self):
+        category = Category.objects.create(name="Lamps", slug="lamps")
+        Product.objects.create(
+            name="Desk Lamp", slug="desk-lamp", description="A lamp.", price='19.99', category=category,
+        )
+        self.client.force_login(User.objects.create_user('reviewer'))
+
+    def test_bodies_that_are_not_a_review_object_are_rejected(self):
+        url = reverse('submit_review', args=['desk-lamp'])
+        for body in ['[1, 2]', '5', '"great"', 'null', '{"rating": 5, "comment": ["great"]}', '{"rating": 5}']:
+            with self.subTest(body=body):
+                response = self.client.post(url, body, content_type='application/json')
+                self.assertEqual(response.status_code, 400)
+                self.assertIn('error', response.json())
+
+
+@override_settings(REVIEWS_PAGE_SIZE=2, PROFILING_SAMPLE_RATE=0)
+class ReviewFeedTests(TestCase):
+    """
+    The cursor-paginated reviews of the product page and the product_reviews feed.
+    """
+    def setUp(self):
+        cache.clear()
+        category = Category.objects.create(name="Lamps", slug="lamps")
+        self.product = Product.objects.create(
+            name="Desk Lamp", slug="desk-lamp", description="A lamp.", price='19.99', category=category,
+        )
+        now = timezone.now()
+        for number, minutes_ago in enumerate([5, 4, 4, 4, 1]):  # Three reviews share a timestamp
+            review = Review.objects.create(
+                user=User.objects.create_user(f'reviewer{number}'), product=self.product, rating=4,
+                comment=f"Review {number}",
+            )
+            Review.objects.filter(pk=review.pk).update(created_at=now - timedelta(minutes=minutes_ago))
+        self.expected = ["Review 4", "Review 3", "Review 2", "Review 1", "Review 0"]
+
+    def test_page_shows_the_newest_reviews_and_the_feed_the_rest(self):
+        response = self.client.get(reverse('product_detail', args=['desk-lamp']))
+        comments = [review.comment for review in response.context['reviews']]
+        url = response.context['reviews_next_url']
+        while url:
+            with self.assertNumQueries(2):  # The product, then one page of reviews with their users
+                page = self.client.get(url).json()
+            comments += [review['comment'] for review in page['reviews']]
+            url = page['next_url']
+        self.assertEqual(comments, self.expected)
+
+    def test_malformed_cursor_starts_from_the_first_page(self):
+        url = reverse('product_reviews', args=['desk-lamp'])
+        for cursor in ['', 'garbage', encode_cursor('not a date', 1), encode_cursor(1, 2)]:
+            with self.subTest(cursor=cursor):
+                page = self.client.get(url, {'after': cursor}).json()
+                self.assertEqual([review['comment'] for review in page['reviews']], self.expected[:2])
+        self.assertEqual(self.client.get(reverse('product_reviews', args=['no-such-lamp'])).status_code, 404)
+
+
+class ReviewQueueTests(TransactionTestCase):
+    """
+    The write-behind review queue of shop/review_queue.py. The test database is in memory, where reviews
+    are normally written directly, so the queue is switched on explicitly.
+    """
+    def setUp(self):
+        category = Category.objects.create(name="Lamps", slug="lamps")
+        self.product = Product.objects.create(
+            name="Desk Lamp", slug="desk-lamp", description="A lamp.", price='19.99', category=category,
+        )
+        self.users = [User.objects.create_user(f'reviewer-{number}') for number in range(3)]
+
+    def _ratings(self):
+        product = Product.objects.get(pk=self.product.pk)
+        return product.rating_count, product.rating_sum
+
+    @override_settings(REVIEW_QUEUE_FLUSH_DELAY=0.5)
+    def test_submitted_reviews_are_queued_and_written_in_one_batch(self):
+        url = reverse('submit_review', args=['desk-lamp'])
+        with mock.patch('shop.review_queue._write_behind', return_value=True), \
+                mock.patch('shop.review_queue.write_batch', wraps=review_queue.write_batch) as write_batch:
+            for rating, user in enumerate(self.users, start=3):
+                self.client.force_login(user)
+                response = self.client.post(
+                    url, json.dumps({'rating': rating, 'comment': f"{rating} stars"}), content_type='application/json',
+                )
+                self.assertEqual(response.status_code, 202)
+                self.assertEqual(response.json()['rating'], rating)
+            review_queue.flush_reviews()
+        self.assertEqual(write_batch.call_count, 1)
+        self.assertEqual(len(write_batch.call_args.args[0]), 3)
+        self.assertEqual(Review.objects.filter(product=self.product).count(), 3)
+        self.assertEqual(self._ratings(), (3, 12))
+
+    def test_failed_batch_is_retried_one_by_one_without_duplicates(self):
+        reviews = [
+            Review(user=user, product=self.product, rating=4, comment="Good") for user in self.users
+        ]
+        catalog_version = get_version(CATALOG)
+        # The version bump is the last step of the batch; it failing must roll back the whole batch.
+        with mock.patch('shop.review_queue.bump_version', side_effect=OperationalError("database is locked")), \
+                self.assertLogs('shop.review_queue', 'ERROR'):
+            review_queue._write(reviews)
+        self.assertEqual(Review.objects.filter(product=self.product).count(), 3)
+        self.assertEqual(self._ratings(), (3, 12))
+        self.assertGreater(get_version(CATALOG), catalog_version)  # Bumped by the one-by-one saves
+
+
+@override_settings(SESSION_ENGINE='shop.sessions', SESSION_CLEANUP_BATCH_SIZE=2)
+class SessionEngineTests(TestCase):
+    """
+    The session engine of shop/sessions.py (used when the sessions cache is shared, see config/settings.py).
+    """
+    def setUp(self):
+        caches['sessions'].clear()
+        store = sessions.SessionStore()
+        store['cart'] = {'1': 1}
+        store.save()
+        self.session_key = store.session_key
+
+    def _stored(self):
+        return Session.objects.get(session_key=self.session_key).get_decoded()
+
+    @mock.patch.object(sessions, '_last_cleanup', float('inf'))
+    def test_unchanged_save_writes_nothing(self):
+        store = sessions.SessionStore(self.session_key)
+        store['cart'] = {'1': 1}
+        with self.assertNumQueries(0):
+            store.save()
+
+    @mock.patch.object(sessions, '_last_cleanup', float('inf'))
+    def test_changes_are_written_through(self):
+        store = sessions.SessionStore(self.session_key)
+        store['cart'] = {'1': 2}
+        store.save()
+        self.assertEqual(self._stored(), {'cart': {'1': 2}})
+        caches['sessions'].clear()
+        self.assertEqual(sessions.SessionStore(self.session_key)['cart'], {'1': 2})
+
+    def test_deleted_session_is_gone_from_the_cache_and_the_database(self):
+        sessions.SessionStore(self.session_key).delete()
+        self.assertFalse(Session.objects.filter(session_key=self.session_key).exists())
+        self.assertEqual(sessions.SessionStore(self.session_key).load(), {})
+
+    @override_settings(SESSION_WRITE_DELAY=1)
+    def test_no_write_behind_with_a_per_process_cache(self):
+        self.assertFalse(sessions._write_behind())
+
+    def test_expired_sessions_are_deleted_in_batches(self):
+        expired = timezone.now() - timedelta(days=1)
+        for number in range(5):
+            Session.objects.create(session_key=f'expired-{number}', session_data='', expire_date=expired)
+        store = sessions.SessionStore(self.session_key)
+        store['cart'] = {'1': 3}
+        with mock.patch.object(sessions, '_last_cleanup', None):
+            store.save()  # The first save of the process deletes one batch
+        self.assertEqual(Session.objects.filter(expire_date__lt=timezone.now()).count(), 3)
+        sessions.SessionStore.clear_expired()
+        self.assertEqual(list(Session.objects.values_list('session_key', flat=True)), [self.session_key])
+
+
+class UserCartSnapshotTests(TestCase):
+    """
+    The navbar summary of a logged-in user's database cart must follow changes made by other worker processes.
+    """
+    def setUp(self):
+        cache.clear()
+        category = Category.objects.create(name="Lamps", slug="lamps")
+        self.bulb = Product.objects.create(
+            name="Bulb", slug="bulb", description="A bulb.", price='2.50', category=category,
+        )
+        self.user = User.objects.create_user('buyer')
+        self.client.force_login(self.user)
+
+    def test_change_made_by_another_process_is_shown(self):
+        self.assertEqual(self.client.get(reverse('cart_summary')).json()['count'], 0)
+        # Another worker adds to the cart; it can only drop the snapshot from its own per-process cache.
+        CartItem.objects.create(user=self.user, product=self.bulb, quantity=2)
+        self.assertEqual(self.client.get(reverse('cart_summary')).json()['count'], 2)
+
+    def test_shared_cache_keeps_the_snapshot_until_the_cart_changes(self):
+        with tempfile.TemporaryDirectory() as directory, override_settings(CACHES={
+            **settings.CACHES,
+            'default': {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': directory},
+        }):
+            self.client.get(reverse('cart_summary'))
+            with self.assertNumQueries(2):  # The session and the user; the cart comes from the cache
+                self.client.get(reverse('cart_summary'))
+            self.client.post(
+                reverse('cart_batch'), json.dumps({'operations': [{'op': 'add', 'slug': 'bulb'}]}),
+                content_type='application/json',
+            )
+            self.assertEqual(self.client.get(reverse('cart_summary')).json()['count'], 1)
+
+
+class ImageVariantTests(TransactionTestCase):
+    """
+    Resized product images (shop/images.py) and the version bumps that make pages pick them up.
+    """
+    def setUp(self):
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        media = override_settings(MEDIA_ROOT=media_root.name, PRODUCT_IMAGE_WIDTHS=[320, 640, 1024])
+        media.enable()
+        self.addCleanup(media.disable)
+        buffer = io.BytesIO()
+        PILImage.new('RGBA', (800, 400), (200, 120, 40, 128)).save(buffer, 'PNG')
+        image_name = default_storage.save('products/lamp.png', ContentFile(buffer.getvalue()))
+        category = Category.objects.create(name="Lamps", slug="lamps")
+        with mock.patch('shop.signals.schedule_variants'):  # Built by the tests, not by the background pool
+            self.products = [
+                Product.objects.create(
+                    name=name, slug=slugify(name), description=name, price='10.00', category=category,
+                    image=image_name,
+                )
+                for name in ["Desk Lamp", "Floor Lamp"]
+            ]
+
+    def _versions(self):
+        return get_version(CATALOG), get_version(CART_SNAPSHOT)
+
+    def test_variants_are_smaller_than_the_original_and_bumped_only_when_they_change(self):
+        product = self.products[0]
+        before = self._versions()
+        variants = images.build_variants(product)
+        self.assertEqual(sorted(variants['webp'], key=int), ['320', '640'])
+        self.assertTrue(all(default_storage.exists(name) for name in variants['jpeg'].values()))
+        self.assertEqual(Product.objects.get(pk=product.pk).image_variants, variants)
+        self.assertEqual(self._versions(), (before[0] + 1, before[1] + 1))
+        images.build_variants(product, force=True)  # Same files, rewritten
+        self.assertEqual(self._versions(), (before[0] + 1, before[1] + 1))
+
+    def test_command_bumps_once_for_the_whole_run(self):
+        before = self._versions()
+        out = io.StringIO()
+        call_command('build_image_variants', workers=1, stdout=out)
+        self.assertIn("Built variants for 2 products (0 failed).", out.getvalue())
+        self.assertEqual(self._versions(), (before[0] + 1, before[1] + 1))
+        call_command('build_image_variants', stdout=out)  # Nothing left to build
+        self.assertEqual(self._versions(), (before[0] + 1, before[1] + 1))
+
+    def test_missing_upload_is_logged_without_a_traceback(self):
+        default_storage.delete(self.products[0].image.name)
+        with self.assertLogs('shop.images', 'WARNING') as logs:
+            images._build_in_background(self.products[0].pk)
+        self.assertEqual(len(logs.records), 1)
+        self.assertIsNone(logs.records[0].exc_info)
+        self.assertEqual(Product.objects.get(pk=self.products[0].pk).image_variants, {})
+
+
+class FacetTests(TestCase):
+    """
+    The facet count index of shop/facets.py and the sidebar counts computed from it.
+    """
+    def setUp(self):
+        self.lamps = Category.objects.create(name="Lamps", slug="lamps")
+        self.bulbs = Category.objects.create(name="Bulbs", slug="bulbs")
+        self.products = {}
+        for name, category, price in [("Desk Lamp", self.lamps, '10.00'), ("Floor Lamp", self.lamps, '30.00'),
+                                      ("LED Bulb", self.bulbs, '30.00'), ("Smart Bulb", self.bulbs, '150.00')]:
+            self.products[name] = Product.objects.create(
+                name=name, slug=slugify(name), description=name, price=price, category=category,
+            )
+
+    def _index(self):
+        return sorted(facet_cells())
+
+    def _expected_index(self):
+        cells = Counter(current_cells(Product.objects.values_list('id', flat=True)).values())
+        return sorted((*cell, count) for cell, count in cells.items())
+
+    def test_each_facet_is_counted_without_its_own_filter(self):
+        selection = FacetSelection([self.lamps], price_buckets=[1])
+        counts = selection.counts(facet_cells())
+        self.assertEqual(counts['categories'], {self.lamps.pk: 1, self.bulbs.pk: 1})
+        self.assertEqual(counts['prices'], {0: 1, 1: 1})
+        self.assertEqual(counts['total'], 1)
+        self.assertEqual(list(selection.filter(Product.objects.all())), [self.products["Floor Lamp"]])
+        selection = FacetSelection([self.lamps, self.bulbs], price_buckets=[1, 3])
+        self.assertEqual(selection.counts(facet_cells())['total'], 3)
+        self.assertEqual(selection.filter(Product.objects.all()).count(), 3)
+
+    def test_saving_a_product_moves_it_to_its_new_cell(self):
+        product = self.products["Desk Lamp"]
+        product.category = self.bulbs
+        product.price = Decimal('250.00')
+        product.save()
+        self.assertIn((self.bulbs.pk, 4, 0, 1), self._index())
+        self.assertEqual(self._index(), self._expected_index())
+        product.delete()
+        self.assertEqual(self._index(), self._expected_index())
+
+    def test_a_rating_change_moves_the_product_to_another_rating_bucket(self):
+        product = self.products["Smart Bulb"]
+        user = User.objects.create_user('reviewer')
+        review = Review.objects.create(user=user, product=product, rating=4, comment="Bright.")
+        self.assertIn((self.bulbs.pk, 3, 4, 1), self._index())
+        review.rating = 2
+        review.save()
+        self.assertIn((self.bulbs.pk, 3, 2, 1), self._index())
+        review.delete()
+        self.assertEqual(self._index(), self._expected_index())
+        counts = FacetSelection(min_rating=4).counts(facet_cells())
+        self.assertEqual((counts['ratings'][4], counts['total']), (0, 0))
+
+    def test_migration_builds_the_same_cells_as_the_app(self):
+        Review.objects.create(
+            user=User.objects.create_user('reviewer'), product=self.products["LED Bulb"], rating=5, comment="Good.",
+        )
+        FacetCount.objects.all().delete()
+        import_module('shop.migrations.0013_facetcount').build_facet_counts(django_apps, None)
+        self.assertEqual(self._index(), self._expected_index())
+
+
+class SearchTests(TestCase):
+    """
+    The full-text search index of shop/search.py and the signal receivers that keep it in sync.
+    """
+    def setUp(self):
+        self.clothes = Category.objects.create(name="Clothes", slug="clothes")
+        self.lamps = Category.objects.create(name="Lamps", slug="lamps")
+        for name, description, category in [
+            ("Denim Jacket", "A blue jacket.", self.clothes),
+            ("Rain Coat", "Goes well with a denim jacket.", self.clothes),
+            ("Desk Lamp", "A reading lamp.", self.lamps),
+        ]:
+            Product.objects.create(
+                name=name, slug=slugify(name), description=description, price='20.00', category=category,
+            )
+
+    def _names(self, text):
+        return [product.name for product in search_products(text)]
+
+    def test_name_matches_rank_above_description_matches(self):
+        self.assertEqual(self._names("denim jacket"), ["Denim Jacket", "Rain Coat"])
+        self.assertEqual(self._names("den jac"), ["Denim Jacket", "Rain Coat"])
+        self.assertEqual(self._names("jacket lamp"), [])
+        self.assertEqual(self._names("?!"), [])
+
+    def test_autocomplete_matches_name_prefixes_only(self):
+        self.assertEqual(sorted(autocomplete("de")), [("Denim Jacket", "denim-jacket"), ("Desk Lamp", "desk-lamp")])
+        self.assertEqual(autocomplete("ja"), [("Denim Jacket", "denim-jacket")])
+        self.assertEqual(autocomplete("reading"), [])
+        response = self.client.get(reverse('search_autocomplete'), {'q': 'desk l'})
+        self.assertEqual(
+            response.json()['suggestions'],
+            [{'name': "Desk Lamp", 'url': reverse('product_detail', args=['desk-lamp'])}],
+        )
+
+    def test_index_follows_product_and_category_changes(self):
+        lamp = Product.objects.get(slug='desk-lamp')
+        lamp.name = "Table Lamp"
+        lamp.save()
+        self.assertEqual(self._names("desk"), [])
+        self.assertEqual(self._names("table"), ["Table Lamp"])
+        self.lamps.name = "Lighting"
+        self.lamps.save()
+        self.assertEqual(self._names("lighting"), ["Table Lamp"])
+        lamp.delete()
+        self.assertEqual(self._names("table"), [])
+        response = self.client.get(reverse('search'), {'q': 'jacket'})
+        self.assertEqual([product.name for product in response.context['products']], ["Denim Jacket", "Rain Coat"])
+
+
+class ConditionalPageTests(TestCase):
+    """
+    Browser revalidation of cached pages (conditional_page in shop/caching.py).
+    """
+    def setUp(self):
+        cache.clear()
+        category = Category.objects.create(name="Lamps", slug="lamps")
+        self.lamp = Product.objects.create(
+            name="Desk Lamp", slug="desk-lamp", description="A lamp.", price='19.99', category=category,
+        )
+        self.url = reverse('shop')
+        first = self.client.get(self.url)
+        self.assertNotIn('ETag', first.headers)  # Rendered with a new CSRF secret
+        self.etag = self.client.get(self.url).headers['ETag']
+
+    def _revalidate(self, url=None):
+        return self.client.get(url or self.url, headers={'if-none-match': self.etag})
+
+    def test_unchanged_page_is_answered_with_304(self):
+        response = self._revalidate()
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b'')
+        last_modified = self.client.get(self.url).headers['Last-Modified']
+        response = self.client.get(self.url, headers={'if-modified-since': last_modified})
+        self.assertEqual(response.status_code, 304)
+
+    def test_catalog_change_gives_a_new_etag(self):
+        bump_version(CATALOG)
+        response = self._revalidate()
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.headers['ETag'], self.etag)
+        product_url = reverse('product_detail', args=['desk-lamp'])
+        self.etag = self.client.get(product_url).headers['ETag']
+        self.assertEqual(self._revalidate(product_url).status_code, 304)
+        self.lamp.price = Decimal('17.99')
+        self.lamp.save()
+        self.assertContains(self._revalidate(product_url), "17.99")
+
+    def test_new_csrf_cookie_gives_a_new_etag(self):
+        self.client.cookies[settings.CSRF_COOKIE_NAME] = 'a' * 32
+        response = self._revalidate()
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.headers['ETag'], self.etag)
+        self.client.force_login(User.objects.create_user('shopper'))
+        response = self._revalidate()
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('Last-Modified', response.headers)
+
+
+@mock.patch('shop.admin.COUNT_LIMIT', 2)
+class AdminChangelistTests(TestCase):
+    """
+    The admin changelists of shop/admin.py, with COUNT_LIMIT lowered so the estimated counts are used.
+    """
+    def setUp(self):
+        admin_user = User.objects.create_superuser('admin', password='x')
+        self.client.force_login(admin_user)
+        category = Category.objects.create(name="Lamps", slug="lamps")
+        products = [
+            Product.objects.create(
+                name=name, slug=slugify(name), description=name, price='10.00', category=category,
+            )
+            for name in ["Desk Lamp", "Floor Lamp", "Wall Lamp"]
+        ]
+        for product in products:
+            Review.objects.create(user=admin_user, product=product, rating=5, comment="Good.")
+            CartItem.objects.create(user=admin_user, product=product, quantity=1)
+            Order.objects.create(user=admin_user, total='10.00')
+        self.order = Order.objects.first()
+
+    def test_each_changelist_and_its_search(self):
+        for model, search, expected in [
+            (Category, "lamps", 1),
+            (Product, "desk", 1),
+            (Review, "floor", 1),
+            (Review, "admin", 2),  # Counted up to COUNT_LIMIT
+            (Order, str(self.order.pk), 1),
+            (CartItem, "admin", 2),
+        ]:
+            url = reverse(f'admin:shop_{model._meta.model_name}_changelist')
+            with self.subTest(model=model.__name__):
+                self.assertEqual(self.client.get(url).status_code, 200)
+            with self.subTest(model=model.__name__, search=search), CaptureQueriesContext(connection) as queries:
+                response = self.client.get(url, {'q': search})
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(response.context['cl'].result_count, expected)
+                if model is not Category:  # A small table, counted as usual
+                    counts = [query['sql'] for query in queries if 'COUNT(' in query['sql']]
+                    self.assertTrue(all('LIMIT' in sql for sql in counts), counts)
+
+    def test_unfiltered_large_list_shows_an_estimate(self):
+        Review.objects.filter(product__slug='desk-lamp').delete()
+        response = self.client.get(reverse('admin:shop_review_changelist'))
+        # The largest primary key: a deleted row makes it an overestimate, without a COUNT(*) of the table.
+        self.assertEqual(response.context['cl'].result_count, Review.objects.aggregate(last=Max('pk'))['last'])
+        self.assertGreater(response.context['cl'].result_count, Review.objects.count())
+
+
+@override_settings(PROFILING_SAMPLE_RATE=1, PROFILING_FLUSH_INTERVAL=3600, PROFILING_SLOW_QUERIES=2)
+class ProfilingTests(TestCase):
+    """
+    Request sampling and the per-route totals of shop/profiling.py.
+    """
+    def setUp(self):
+        cache.clear()
+        category = Category.objects.create(name="Lamps", slug="lamps")
+        Product.objects.create(
+            name="Desk Lamp", slug="desk-lamp", description="A lamp.", price='19.99', category=category,
+        )
+        patcher = mock.patch.object(profiling, 'route_stats', profiling.RouteStats())
+        self.route_stats = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _metrics(self, response):
+        return [metric.split(';')[0] for metric in response.headers['Server-Timing'].split(', ')]
+
+    def test_sampled_request_is_timed_and_flushed(self):
+        response = self.client.get(reverse('product_detail', args=['desk-lamp']))
+        self.assertEqual(self._metrics(response), ['app', 'db', 'tpl'])
+        self.assertFalse(RouteStat.objects.exists())  # Kept in memory until the flush is due
+        pending = self.route_stats._pending['product_detail']
+        self.assertEqual(pending['requests'], 1)
+        self.assertIn(f'"{pending["queries"]} queries"', response.headers['Server-Timing'])
+        self.client.get(reverse('product_detail', args=['desk-lamp']))
+        self.assertEqual(self.route_stats.flush(), 1)
+        stat = RouteStat.objects.get(route='product_detail')
+        self.assertEqual((stat.requests, stat.queries), (2, pending['queries']))
+        self.assertEqual(len(stat.slowest_queries), 2)
+        with override_settings(PROFILING_FLUSH_INTERVAL=0):  # Flushed by the request itself, into the same row
+            self.client.get(reverse('product_detail', args=['desk-lamp']))
+        self.assertEqual(RouteStat.objects.get(route='product_detail').requests, 3)
+
+    async def test_async_stack_times_the_request_too(self):
+        response = await self.async_client.get(reverse('shop'))
+        self.assertEqual(self._metrics(response), ['app', 'db', 'tpl'])
+        self.assertEqual(self.route_stats._pending['shop']['requests'], 1)
+
+    def test_unsampled_requests_only_get_the_total_time(self):
+        with mock.patch('shop.profiling.random.random', return_value=0.5), \
+                override_settings(PROFILING_SAMPLE_RATE=0.1):
+            response = self.client.get(reverse('shop'))
+        self.assertEqual(self._metrics(response), ['app'])
+        self.assertEqual(self.route_stats._pending, {})
+        with override_settings(PROFILING_SAMPLE_RATE=0):
+            self.assertNotIn('Server-Timing', self.client.get(reverse('shop')).headers)
+
+
+class BenchmarkTests(TestCase):
+    """
+    The storefront benchmark harness of shop/benchmarking.py, on a tiny catalog.
+    """
+    def test_every_route_is_measured_without_errors(self):
+        seed_catalog(products=20, users=3, reviews=40)
+        self.assertEqual(Product.objects.filter(recommendation__isnull=True).count(), 0)
+        results = run_benchmark(requests=3, warmup=1, memory_samples=1)
+        self.assertEqual(list(results), ROUTES)
+        for route, result in results.items():
+            with self.subTest(route=route):
+                self.assertEqual((result['requests'], result['errors']), (3, 0))
+                self.assertLessEqual(result['p50_ms'], result['p95_ms'])
+                self.assertLessEqual(result['p95_ms'], result['p99_ms'])
+                self.assertGreater(result['queries_max'], 0)
+        json.dumps(results)  # Saved as JSON by the command
+
+    def test_compare_flags_latency_and_query_regressions(self):
+        baseline = {
+            'home': {'p95_ms': 10.0, 'queries_mean': 2.0},
+            'shop': {'p95_ms': 10.0, 'queries_mean': 0},
+        }
+        results = {
+            'home': {'p95_ms': 11.0, 'queries_mean': 3.0},
+            'shop': {'p95_ms': 13.0, 'queries_mean': 5.0},
+            'cart': {'p95_ms': 99.0, 'queries_mean': 9.0},  # Not in the baseline
+        }
+        self.assertEqual(
+            compare(results, baseline, 0.2), [('home', 'queries_mean', 2.0, 3.0), ('shop', 'p95_ms', 10.0, 13.0)],
+        )
+
+    def test_command_rejects_unknown_routes(self):
+        with self.assertRaisesMessage(CommandError, "Unknown routes: checkout"):
+            call_command('bench_storefront', routes='home,checkout')
+
+
+class SQLiteSetupTests(TestCase):
+    """
+    The SQLite connection settings and pragmas of config/database.py.
+    """
+    def _pragma(self, connection, name):
+        with connection.cursor() as cursor:
+            cursor.execute(f'PRAGMA {name}')
+            return cursor.fetchone()[0]
+
+    def _open(self, path):
+        wrapper = ConnectionHandler({'default': sqlite_database(path)})['default']
+        wrapper.ensure_connection()
+        self.addCleanup(wrapper.close)
+        return wrapper
+
+    def test_new_file_connections_get_the_pragmas(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        wrapper = self._open(os.path.join(directory.name, 'shop.sqlite3'))
+        self.assertEqual(self._pragma(wrapper, 'journal_mode'), 'wal')
+        self.assertEqual(self._pragma(wrapper, 'synchronous'), 1)  # NORMAL
+        self.assertEqual(self._pragma(wrapper, 'busy_timeout'), DEFAULT_SQLITE_PRAGMAS['busy_timeout'])
+        self.assertEqual(self._pragma(wrapper, 'cache_size'), DEFAULT_SQLITE_PRAGMAS['cache_size'])
+        with override_settings(SQLITE_PRAGMAS={'busy_timeout': 1234}):
+            wrapper = self._open(os.path.join(directory.name, 'other.sqlite3'))
+            self.assertEqual(self._pragma(wrapper, 'busy_timeout'), 1234)
+            self.assertEqual(self._pragma(wrapper, 'journal_mode'), 'delete')
+
+    def test_database_settings(self):
+        with mock.patch.dict(os.environ, {'SHOP_DB_CONN_MAX_AGE': '0'}):
+            self.assertEqual(sqlite_database('db.sqlite3')['CONN_MAX_AGE'], 0)
+        database = sqlite_database('db.sqlite3')
+        self.assertEqual((database['CONN_MAX_AGE'], database['CONN_HEALTH_CHECKS']), (60, True))
+        self.assertEqual(database['OPTIONS']['transaction_mode'], 'IMMEDIATE')
+        self.assertEqual(connection.settings_dict['OPTIONS']['transaction_mode'], 'IMMEDIATE')
+
+
+class QueryPlanTests(TestCase):
+    """
+    The storefront indexes (shop/models.py) and the plan check of the explain_queries command.
+    """
+    def setUp(self):
+        self.category = Category.objects.create(name="Lamps", slug="lamps")
+        self.product = Product.objects.create(
+            name="Desk Lamp", slug="desk-lamp", description="A lamp.", price='19.99', category=self.category,
+        )
+        self.user = User.objects.create_user('buyer')
+
+    def test_hot_queries_read_their_index(self):
+        for queryset, index in [
+            (Product.objects.order_by('name', 'id')[:24], 'product_name_id_idx'),
+            (Product.objects.filter(category=self.category).order_by('name', 'id')[:24], 'product_category_name_idx'),
+            (Review.objects.filter(product=self.product).order_by('-created_at', '-id')[:10],
+             'review_product_recent_idx'),
+            (Order.objects.filter(user=self.user).order_by('-created_at'), 'order_user_recent_idx'),
+        ]:
+            with self.subTest(index=index):
+                plan = queryset.explain()
+                self.assertIn(index, plan)
+                self.assertNotIn('TEMP B-TREE', plan)
+
+    def test_problems_in_flags_scans_and_sorts(self):
+        tables = {'shop_product', 'shop_category'}
+        scan = ['SCAN shop_product']
+        self.assertEqual(problems_in('SELECT * FROM shop_product', scan, tables), scan)
+        self.assertEqual(problems_in('SELECT * FROM shop_product ORDER BY id DESC LIMIT 3', scan, tables), [])
+        self.assertEqual(problems_in('SELECT * FROM shop_category', ['SCAN shop_category'], tables), [])
+        self.assertEqual(
+            problems_in('SELECT * FROM shop_product', ['SCAN shop_product USING INDEX product_name_id_idx'], tables),
+            [],
+        )
+        sort = ['SEARCH shop_product USING INDEX x (category_id=?)', 'USE TEMP B-TREE FOR ORDER BY']
+        self.assertEqual(problems_in('SELECT * FROM shop_product LIMIT 24', sort, tables), sort[1:])
+        full_text = ['SCAN shop_product_fts VIRTUAL TABLE INDEX 0:M1', 'USE TEMP B-TREE FOR ORDER BY']
+        self.assertEqual(problems_in('SELECT rowid FROM shop_product_fts', full_text, tables), [])
+
+
+class AsyncViewTests(TestCase):
+    """
+    The async catalog and cart views, served through the ASGI handler.
+    Their templates render on the event loop, where a query would raise SynchronousOnlyOperation.
+    """
+    def setUp(self):
+        cache.clear()
+        category = Category.objects.create(name="Lamps", slug="lamps")
+        for name, price in [("Desk Lamp", '19.99'), ("Floor Lamp", '49.00')]:
+            Product.objects.create(
+                name=name, slug=slugify(name), description=name, price=price, category=category,
+            )
+        build_all()
+
+    def test_views_are_coroutines(self):
+        for view in [views.home, views.shop_view, views.product_feed, views.product_detail, views.add_to_cart,
+                     views.remove_from_cart, views.cart_view, views.cart_summary, views.cart_batch]:
+            with self.subTest(view=view.__name__):
+                self.assertTrue(iscoroutinefunction(view))
+
+    async def test_catalog_pages(self):
+        response = await self.async_client.get(reverse('home'))
+        self.assertEqual(response.status_code, 200)
+        response = await self.async_client.get(reverse('shop'), {'category': 'lamps'})
+        self.assertContains(response, "Floor Lamp")
+        response = await self.async_client.get(reverse('product_detail', args=['desk-lamp']))
+        self.assertContains(response, "Desk Lamp")
+        self.assertEqual([product.name for product in response.context['recommendations']], ["Floor Lamp"])
+        response = await self.async_client.get(reverse('product_detail', args=['no-such-lamp']))
+        self.assertEqual(response.status_code, 404)
+
+    async def test_cart_endpoints(self):
+        user = await User.objects.acreate(username='buyer')
+        await self.async_client.aforce_login(user)
+        response = await self.async_client.post(
+            reverse('add_to_cart', args=['desk-lamp']), headers={'x-requested-with': 'XMLHttpRequest'},
+        )
+        self.assertEqual(response.json()['cart_count'], 1)
+        response = await self.async_client.get(reverse('cart'))
+        self.assertEqual([item['name'] for item in response.context['cart_items']], ["Desk Lamp"])
+        response = await self.async_client.post(
+            reverse('remove_from_cart', args=['desk-lamp']), headers={'x-requested-with': 'XMLHttpRequest'},
+        )
+        self.assertEqual(response.json(), {'success': True, 'cart_count': 0})
+        response = await self.async_client.get(reverse('cart_summary'))
+        self.assertEqual(response.json()['count'], 0)
+
+
+class AssetPipelineTests(TestCase):
+    """
+    collectstatic through AssetStorage, and StaticFilesApplication serving its output (shop/assets.py).
+    """
+    CSS = "/* Layout */\nbody {\n  color:  red;\n  content: '  a  b  ';\n}\na :hover { margin: 0 ; }\n"
+    JS = "// Cart\nfunction add() {\n    // one more\n    return `line one\n    line two`;\n}\n"
+
+    def setUp(self):
+        source = tempfile.TemporaryDirectory()
+        root = tempfile.TemporaryDirectory()
+        self.addCleanup(source.cleanup)
+        self.addCleanup(root.cleanup)
+        for name, content in [('style.css', self.CSS * 20), ('main.js', self.JS * 20)]:
+            with open(os.path.join(source.name, name), 'w') as file:
+                file.write(content)
+        PILImage.new('RGB', (64, 64), (30, 90, 160)).save(os.path.join(source.name, 'logo.png'))
+        static = override_settings(
+            STATICFILES_DIRS=[source.name], STATIC_ROOT=root.name,
+            STATICFILES_FINDERS=['django.contrib.staticfiles.finders.FileSystemFinder'],
+        )
+        static.enable()
+        self.addCleanup(static.disable)
+        self.root = root.name
+        call_command('collectstatic', interactive=False, verbosity=0)
+        self.hashed_css = staticfiles_storage.stored_name('style.css')
+
+    def _django(self, environ, start_response):
+        start_response('200 OK', [])
+        return [b'from django']
+
+    def _serve(self, path, **headers):
+        """
+        Returns (status, headers, body) of a GET request to StaticFilesApplication.
+        """
+        environ = {'REQUEST_METHOD': 'GET', 'PATH_INFO': path, **headers}
+        setup_testing_defaults(environ)
+        started = []
+        body = StaticFilesApplication(self._django, root=self.root)(
+            environ, lambda status, response_headers: started.append((status, dict(response_headers))),
+        )
+        content = b''.join(body)
+        if hasattr(body, 'close'):
+            body.close()  # As WSGI servers do, closing the file
+        status, response_headers = started[0]
+        return status, response_headers, content
+
+    def test_minifiers(self):
+        self.assertEqual(minify_css(self.CSS), "body{color:red;content:'  a  b  '}a :hover{margin:0}")
+        self.assertEqual(minify_js(self.JS), "function add() {\nreturn `line one\n    line two`;\n}\n")
+
+    def test_collectstatic_minifies_hashes_and_precompresses(self):
+        self.assertRegex(self.hashed_css, r'^style\.[0-9a-f]{12}\.css$')
+        with open(os.path.join(self.root, self.hashed_css)) as file:
+            self.assertEqual(file.read(), minify_css(self.CSS * 20))
+        with gzip.open(os.path.join(self.root, self.hashed_css + '.gz'), 'rt') as file:
+            self.assertEqual(file.read(), minify_css(self.CSS * 20))
+        self.assertIn(self.hashed_css, static('style.css'))
+
+    def test_served_with_cache_headers_and_the_accepted_encoding(self):
+        status, headers, body = self._serve(f'/static/{self.hashed_css}', HTTP_ACCEPT_ENCODING='gzip, br;q=0')
+        self.assertEqual(status, '200 OK')
+        self.assertEqual(headers['Cache-Control'], 'public, max-age=31536000, immutable')
+        self.assertEqual((headers['Content-Encoding'], headers['Vary']), ('gzip', 'Accept-Encoding'))
+        self.assertEqual(gzip.decompress(body).decode(), minify_css(self.CSS * 20))
+        status, headers, body = self._serve('/static/style.css')
+        self.assertEqual(headers['Cache-Control'], 'public, no-cache')
+        self.assertNotIn('Content-Encoding', headers)
+        status, _, body = self._serve('/static/style.css', HTTP_IF_MODIFIED_SINCE=headers['Last-Modified'])
+        self.assertEqual((status, body), ('304 Not Modified', b''))
+        self.assertEqual(self._serve('/static/missing.css')[2], b'from django')
+
+
+class TemplateWarmupTests(TestCase):
+    """
+    The startup template warmup of shop/templating.py.
+    """
+    def _cached_loader(self):
+        return engines['django'].engine.template_loaders[0]
+
+    def test_warmup_compiles_every_page_into_the_cached_loader(self):
+        names = warmup_template_names()
+        self.assertTrue({'layout.html', 'shop/home.html', 'shop/detail.html'} <= set(names))
+        self.assertTrue(any(name.startswith(f'{settings.CRISPY_TEMPLATE_PACK}/') for name in names))
+        self._cached_loader().reset()
+        self.assertEqual(warm_templates(), len(names))
+        with mock.patch.object(FilesystemLoader, 'get_contents', side_effect=AssertionError("read from disk")):
+            for name in ['layout.html', 'shop/detail.html', f'{settings.CRISPY_TEMPLATE_PACK}/field.html']:
+                engines['django'].get_template(name)
+
+    def test_broken_template_is_logged_and_skipped(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        os.makedirs(os.path.join(directory.name, 'shop'))
+        with open(os.path.join(directory.name, 'shop', 'broken.html'), 'w') as file:
+            file.write("{% if %}")
+        templates = [{**settings.TEMPLATES[0], 'DIRS': [directory.name, *settings.TEMPLATES[0]['DIRS']]}]
+        with override_settings(TEMPLATES=templates), self.assertLogs('shop.templating', 'ERROR') as logs:
+            self.assertEqual(warm_templates(), len(warmup_template_names()) - 1)
+        self.assertIn("shop/broken.html", logs.output[0])
@@ -13,12 +13,19 @@ urlpatterns = [
     path('about/', views.about, name='about'),
     # Shop page (all products, with optional category filtering)
     path('shop/', views.shop_view, name='shop'),
+    # JSON feed of shop products, one keyset page at a time (used for infinite scroll)
+    path('api/products/', views.product_feed, name='product_feed'),
+    # Full-text product search, and name suggestions for the navbar search box
+    path('search/', views.search_view, name='search'),
+    path('search/autocomplete/', views.search_autocomplete, name='search_autocomplete'),
     # Add product (staff only)
     path('shop/add/', views.add_product, name='add_product'),
     # Product detail page (uses product slug for clean URLs)
     path('shop/<slug:slug>/', views.product_detail, name='product_detail'),
     # AJAX review submission for a product
     path('shop/<slug:slug>/review/', views.submit_review, name='submit_review'),
+    # JSON feed of a product's reviews, one page at a time (newest first)
+    path('shop/<slug:slug>/reviews/', views.product_reviews, name='product_reviews'),
     # User registration
     path('register/', views.register_request, name='register'),
     # User login
@@ -29,6 +36,10 @@ urlpatterns = [
     path('dashboard/', views.dashboard, name='dashboard'),
     # Shopping cart page (requires login)
     path('cart/', views.cart_view, name='cart'),
+    # The navbar cart as JSON, loaded by main.js on every page
+    path('cart/summary/', views.cart_summary, name='cart_summary'),
+    # Several cart changes in one request (add/remove/set quantity), as JSON
+    path('cart/batch/', views.cart_batch, name='cart_batch'),
     # Add a product to the cart (by slug)
     path('add-to-cart/<slug:slug>/', views.add_to_cart, name='add_to_cart'),
     # Remove a product from the cart (by slug)
@@ -36,4 +47,6 @@ urlpatterns = [
     # Checkout page (requires login)
     path('checkout/', views.checkout_view, name='checkout'),
     path('shop/<slug:slug>/edit/', views.edit_product, name='edit_product'),
+    # Per-route request profiling stats (staff only)
+    path('staff/profiling/', views.profiling_dashboard, name='profiling_dashboard'),
 ]
\ No newline at end of file
@@ -0,0 +1,127 @@
+# shop/versioning.py
+# This file keeps small version counters.
+# Anything derived from the catalog (cart snapshots, cached pages and fragments) stores or is keyed by
+# the version it was built with, and is treated as stale as soon as the counter moves on.
+#
+# The counters live in the database (VersionCounter), so every worker process agrees on them: a bump in
+# one process invalidates the pages and snapshots the others cached too. Each process keeps a copy of the
+# values in memory, which VersionCheckMiddleware refreshes with one query at most every
+# VERSION_CHECK_INTERVAL seconds, so another process's bump is seen within that interval, and a bump is
+# seen at once by the process that made it. Reading a version never queries the database once a request
+# has started, which matters for async views, whose templates render on the event loop.
+
+import threading
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import VersionCounter
+
+CART_SNAPSHOT = 'cart_snapshot'
+CATALOG = 'catalog'
+
+COUNTERS = (CART_SNAPSHOT, CATALOG)
+
+# name -> value last read from (or written to) the database, and when the values were last read.
+_versions = {}
+_checked_at = None
+_lock = threading.Lock()
+
+
+def _remember(values):
+    global _checked_at
+    with _lock:
+        _versions.update({name: values.get(name, 0) for name in COUNTERS})
+        _checked_at = time.monotonic()
+
+
+def _is_due():
+    return _checked_at is None or time.monotonic() - _checked_at >= settings.VERSION_CHECK_INTERVAL
+
+
+def refresh_versions():
+    """
+    Reads every counter from the database (one query over the few rows of the table)
+    if the copy in memory is older than VERSION_CHECK_INTERVAL.
+    """
+    if _is_due():
+        _remember(dict(VersionCounter.objects.values_list('name', 'value')))
+
+
+async def arefresh_versions():
+    """
+    Async version of refresh_versions().
+    """
+    if _is_due():
+        _remember({
+            name: value
+            async for name, value in VersionCounter.objects.values_list('name', 'value')
+        })
+
+
+def get_version(name):
+    """
+    Returns the current value of the counter called `name` (0 before its first bump).
+    Outside requests (management commands, background threads), the first read queries the database.
+    """
+    if name not in _versions:
+        refresh_versions()
+    return _versions[name]
+
+
+def bump_version(name):
+    """
+    Moves the counter called `name` forward, invalidating everything built with an older value.
+    Returns the new value.
+    """
+    rows = VersionCounter.objects.filter(name=name)
+    with transaction.atomic():
+        if not rows.update(value=F('value') + 1, updated_at=timezone.now()):
+            try:
+                with transaction.atomic():
+                    VersionCounter.objects.create(name=name, value=1)
+            except IntegrityError:
+                # Another process created the row first.
+                rows.update(value=F('value') + 1, updated_at=timezone.now())
+        value = rows.values_list('value', flat=True).get()
+    with _lock:
+        _versions[name] = value
+    return value
+
+
+async def aget_stored_version(name):
+    """
+    Returns (value, updated_at) of a counter as stored in the database, or (0, None) before its first bump.
+    Used where the time of the last change matters too (Last-Modified headers).
+    """
+    row = await VersionCounter.objects.filter(name=name).values_list('value', 'updated_at').afirst()
+    return row or (0, None)
+
+
+class VersionCheckMiddleware:
+    """
+    Refreshes the in-memory copy of the counters (see refresh_versions()) before the view runs.
+    Works in both sync (WSGI) and async (ASGI) stacks.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        refresh_versions()
+        return self.get_response(request)
+
+    async def __acall__(self, request):
+        await arefresh_versions()
+        return await self.get_response(request)
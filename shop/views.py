@@ -2,16 +2,37 @@
 # This file contains the logic for handling requests and returning responses for the shop app.
 # Each function is a 'view' that connects to a URL route and renders a template or returns data.
 
-from django.shortcuts import render, redirect, get_object_or_404
+from django.shortcuts import aget_object_or_404, render, redirect, get_object_or_404
 from django.contrib.auth import login, authenticate, logout
 from django.contrib.auth.forms import AuthenticationForm
 from django.contrib.auth.decorators import login_required, user_passes_test
 from django.contrib import messages
 from .forms import NewUserForm, ProductForm
-from .models import Product, Category, Review
-from decimal import Decimal
-from django.http import JsonResponse
+from .models import Product, Category, Order, Review, RouteStat
+from .caching import cache_public_page, conditional_page
+from .cart import (
+    CartOperationError, add_item, aget_cart_summary, apply_cart_operations, get_cart_summary,
+    invalidate_cart_summary, parse_cart_operations, remove_item,
+)
+from .checkout import CheckoutError, new_checkout_token, place_order
+from .facets import FacetSelection, afacet_cells
+from .catalog import aproduct_page, areview_page, page_size_from, review_page
+from .profiling import route_stats
+from .ratings import validate_rating
+from .recommendations import aget_recommendations
+from .review_queue import enqueue_review
+from .search import autocomplete, search_products
+from .versioning import CATALOG, aget_stored_version
+from django.conf import settings
+from django.http import Http404, JsonResponse
+from django.template.loader import render_to_string
+from django.urls import reverse
+from django.views.decorators.cache import never_cache
+from django.views.decorators.csrf import ensure_csrf_cookie
 from django.views.decorators.http import require_POST
+from asgiref.sync import sync_to_async
+from django.utils import timezone
+import asyncio
 import json
 from django.http import HttpResponseForbidden
 
@@ -25,157 +46,344 @@ def is_admin_or_staff(user):
     """
     return user.is_authenticated and (user.is_staff or user.is_superuser)
 
-# Context processor: Adds cart summary data to every template automatically.
-def cart_context(request):
-    """
-    This function runs for every request and adds cart info to the template context.
-    It lets you show cart items/count/total in the navbar on every page.
-    """
-    cart = request.session.get('cart', {})  # Get the cart dictionary from the session
-    products = Product.objects.filter(id__in=cart.keys())
-    cart_items = []
-    cart_count = 0
-    cart_total = Decimal('0.00')
-    for product in products:
-        quantity = cart.get(str(product.id), 0)
-        subtotal = product.price * quantity
-        cart_total += subtotal
-        cart_count += quantity
-        cart_items.append({
-            'product': product,
-            'quantity': quantity,
-            'subtotal': subtotal,
-        })
-    return {
-        'cart_items_nav': cart_items,
-        'cart_count': cart_count,
-        'cart_total': cart_total,
-    }
+# Helpers for the async views. Their templates render on the event loop, where the database cannot be
+# queried, so everything a page shows is loaded before render() (concurrently, with asyncio.gather).
+async def _alist(queryset):
+    return [obj async for obj in queryset]
+
+async def _aprime_request(request):
+    """
+    Loads what the context processors read: the user (which loads the session too).
+    The navbar cart is not rendered into pages; main.js fetches it from cart_summary.
+    """
+    request.user = await request.auser()
+
+# Validators for conditional_page (see shop/caching.py): every catalog change bumps the stored catalog version.
+async def _catalog_stamp(request, *args, **kwargs):
+    version, updated_at = await aget_stored_version(CATALOG)
+    return f'catalog-{version}', updated_at
+
+async def _product_stamp(request, slug):
+    product, (version, updated_at) = await asyncio.gather(
+        Product.objects.filter(slug=slug).values('id', 'updated_at').afirst(),
+        aget_stored_version(CATALOG),
+    )
+    if product is None:
+        return None  # Let the view show its 404
+    last_modified = max(filter(None, (product['updated_at'], updated_at)))
+    return f"product-{product['id']}-{product['updated_at'].timestamp()}:catalog-{version}", last_modified
 
 # Home page view: shows the landing page.
-def home(request):
+@conditional_page(_catalog_stamp)
+@cache_public_page
+async def home(request):
     """
     Renders the home page template with latest products.
-    """
-    from .models import Product
-    latest_products = Product.objects.order_by('-id')[:3]
+    Anonymous visitors get the whole page from the cache (see shop/caching.py), and browsers that
+    already have the current version get a 304.
+    The latest products and the navbar data are loaded concurrently through the async ORM.
+    """
+    latest_products, _ = await asyncio.gather(
+        _alist(Product.objects.order_by('-id')[:3]),
+        _aprime_request(request),
+    )
     return render(request, "shop/home.html", {"latest_products": latest_products})
 
 # About page view: shows info about the store.
+@cache_public_page
 def about(request):
     """
     Route: '/about/'
-    Renders the about page template.
+    Renders the about page template (served from the cache to anonymous visitors, like home).
     """
     return render(request, "shop/about.html")
 
-# Shop view: shows all products, with optional category filtering.
-def shop_view(request):
+# Helpers for the shop page and its JSON feed: the selected filters, and one page of the products they match.
+async def _afacet_selection(request):
+    """
+    Returns the FacetSelection for ?category= (repeatable), ?price= and ?rating= (see shop/facets.py).
+    Raises Http404 if a selected category does not exist.
+    """
+    slugs = set(request.GET.getlist('category'))
+    categories = await _alist(Category.objects.filter(slug__in=slugs)) if slugs else []
+    if len(categories) != len(slugs):
+        raise Http404("No category matches the given query.")
+    return FacetSelection.from_query(request.GET, categories)
+
+async def _ashop_listing(request, selection):
+    """
+    Reads ?after= and ?page_size= from the request and returns (products, next_query),
+    where next_query is the query string for the following page (or None on the last page).
+    """
+    products = selection.filter(Product.objects.all())
+    page_size = page_size_from(request.GET.get('page_size'))
+    products, next_cursor = await aproduct_page(products, request.GET.get('after'), page_size)
+    next_query = None
+    if next_cursor:
+        params = request.GET.copy()
+        params['after'] = next_cursor
+        next_query = params.urlencode()
+    return products, next_query
+
+# Shop view: shows the first page of products, with faceted filtering.
+@conditional_page(_catalog_stamp)
+@ensure_csrf_cookie
+async def shop_view(request):
     """
     Route: '/shop/'
-    Shows a list of all products. If a category is selected (via ?category=slug), filters products by that category.
-    Passes products, categories, and selected_category to the template for display and filtering UI.
-    """
-    category_slug = request.GET.get('category')
-    categories = Category.objects.all()
-    products = Product.objects.all()
-    selected_category = None
-    if category_slug:
-        selected_category = get_object_or_404(Category, slug=category_slug)
-        products = products.filter(category=selected_category)
+    Shows one page of products (keyset-paginated on name, id), filtered by any number of categories
+    (?category=slug, repeatable), price ranges (?price=bucket, repeatable) and a minimum rating (?rating=4).
+    The sidebar shows how many products each filter option matches, summed from the facet count index
+    (see shop/facets.py), so no products are counted per request.
+    Passes products, facets, selection and the next page URLs to the template.
+    The rest of the catalog is loaded by main.js from product_feed as the customer scrolls.
+    The categories, facet counts, the page of products and the navbar data are loaded concurrently through
+    the async ORM; the grid and the sidebar are cached template fragments, so they are only rendered when the cache misses.
+    The csrftoken cookie is always set, because the cached cards carry no token of their own.
+    Browsers that already have the current version get a 304 (see conditional_page in shop/caching.py).
+    """
+    selection = await _afacet_selection(request)
+    categories, cells, (products, next_query), _ = await asyncio.gather(
+        _alist(Category.objects.all()),
+        afacet_cells(),
+        _ashop_listing(request, selection),
+        _aprime_request(request),
+    )
+
+    def next_url(route):
+        return f"{reverse(route)}?{next_query}" if next_query else None
+
     context = {
-        'categories': categories,
+        'facets': selection.sidebar(categories, cells),
+        'selection': selection,
         'products': products,
-        'selected_category': selected_category,
+        'next_page_url': next_url('shop'),
+        'next_feed_url': next_url('product_feed'),
     }
     return render(request, "shop/shop.html", context)
 
+# Product feed view: the JSON endpoint main.js calls for infinite scroll on the shop page.
+async def product_feed(request):
+    """
+    Route: '/api/products/'
+    Accepts the same ?category=, ?price=, ?rating=, ?after= and ?page_size= parameters as the shop page.
+    Returns JSON with the products of the requested page, their rendered cards ('html')
+    and 'next_url' for the following page (null on the last page).
+    """
+    selection = await _afacet_selection(request)
+    # The cards show staff links, so the user is loaded alongside the products.
+    (products, next_query), request.user = await asyncio.gather(
+        _ashop_listing(request, selection),
+        request.auser(),
+    )
+    return JsonResponse({
+        'products': [
+            {
+                'id': product.id,
+                'name': product.name,
+                'slug': product.slug,
+                'price': str(product.price),
+                'rating_avg': product.rating_avg,
+                'rating_count': product.rating_count,
+                'url': reverse('product_detail', args=[product.slug]),
+            }
+            for product in products
+        ],
+        'html': render_to_string("shop/_product_cards.html", {'products': products}, request=request),
+        'next_url': f"{reverse('product_feed')}?{next_query}" if next_query else None,
+    })
+
+# Search view: full-text product search, best matches first.
+@ensure_csrf_cookie
+def search_view(request):
+    """
+    Route: '/search/'
+    Searches product names, descriptions and category names for ?q= (each word matches as a prefix).
+    Passes the query and the ranked products to the template.
+    """
+    query = request.GET.get('q', '').strip()
+    products = search_products(query, limit=settings.SEARCH_RESULTS_LIMIT) if query else []
+    return render(request, "shop/search.html", {"query": query, "products": products})
+
+# Search autocomplete view: product name suggestions for the navbar search box.
+def search_autocomplete(request):
+    """
+    Route: '/search/autocomplete/'
+    Returns JSON with up to 8 product names (and their URLs) whose words start with the words in ?q=.
+    """
+    query = request.GET.get('q', '').strip()
+    suggestions = autocomplete(query) if len(query) >= 2 else []
+    return JsonResponse({
+        'suggestions': [
+            {'name': name, 'url': reverse('product_detail', args=[slug])}
+            for name, slug in suggestions
+        ],
+    })
+
 # Product detail view: shows info for a single product, reviews, and recommendations.
-def product_detail(request, slug):
+@conditional_page(_product_stamp)
+async def product_detail(request, slug):
     """
     Route: '/shop/<slug:slug>/'
-    Shows details for a single product, its reviews, and up to 4 recommended products from the same category.
-    Passes the product and recommendations to the template.
-    """
-    product = get_object_or_404(Product, slug=slug)
-    recommendations = Product.objects.filter(category=product.category).exclude(id=product.id)[:4]
-    return render(request, "shop/detail.html", {"product": product, "recommendations": recommendations})
+    Shows details for a single product, the first page of its reviews, and up to 4 recommended products.
+    Recommendations are read from the precomputed ProductRecommendation row (see shop/recommendations.py),
+    or are the first products of its category while it has none.
+    Once the product is found, its reviews, recommendations and the navbar data are loaded concurrently.
+    Older reviews are loaded by main.js from product_reviews when the customer asks for them.
+    Passes the product, reviews and recommendations to the template.
+    Browsers that already have the current version get a 304, checked against the product's updated_at
+    and the catalog version.
+    """
+    product = await aget_object_or_404(Product.objects.select_related('category'), slug=slug)
+    (reviews, next_cursor), recommendations, _ = await asyncio.gather(
+        areview_page(product),
+        aget_recommendations(product),
+        _aprime_request(request),
+    )
+    context = {
+        "product": product,
+        "reviews": reviews,
+        "reviews_next_url": _reviews_url(product, next_cursor),
+        "recommendations": recommendations,
+    }
+    return render(request, "shop/detail.html", context)
 
 # Add to cart view: handles adding a product to the session-based cart.
-def add_to_cart(request, slug):
+async def add_to_cart(request, slug):
     """
     Route: '/add-to-cart/<slug:slug>/'
-    On POST, adds the product to the cart stored in the session. Increments quantity if already present.
+    On POST, adds the product to the cart (the database cart for logged-in users, otherwise the session).
+    Increments quantity if already present.
     Redirects to the cart page and shows a message.
     If the request is AJAX (fetch or XMLHttpRequest), return JSON with cart count and success message instead of redirecting.
+    The cart update needs a transaction, which the async ORM does not offer, so it runs in a worker thread.
     """
-    product = get_object_or_404(Product, slug=slug)
-    cart = request.session.get('cart', {})
-    if str(product.id) in cart:
-        cart[str(product.id)] += 1
-    else:
-        cart[str(product.id)] = 1
-    request.session['cart'] = cart  # Save the updated cart back to the session
-    # Calculate new cart count
-    cart_count = sum(cart.values())
+    product, request.user = await asyncio.gather(aget_object_or_404(Product, slug=slug), request.auser())
+    await sync_to_async(add_item)(request, product)
     if request.headers.get('x-requested-with') == 'XMLHttpRequest':
         return JsonResponse({
             'success': True,
-            'cart_count': cart_count,
+            'cart_count': (await aget_cart_summary(request)).count,
             'message': f"Added {product.name} to cart."
         })
     messages.success(request, f"Added {product.name} to cart.")
     return redirect('cart')
 
-# Remove from cart view: removes a product from the session cart.
-def remove_from_cart(request, slug):
+# Remove from cart view: removes a product from the cart.
+async def remove_from_cart(request, slug):
     """
     Route: '/remove-from-cart/<slug:slug>/'
-    Removes the product from the session cart and redirects to the cart page.
+    Removes the product from the cart and redirects to the cart page.
+    If the request is AJAX (the navbar dropdown), returns JSON with the new cart count instead.
     """
-    product = get_object_or_404(Product, slug=slug)
-    cart = request.session.get('cart', {})
-    if str(product.id) in cart:
-        del cart[str(product.id)]
-        request.session['cart'] = cart
+    product, request.user = await asyncio.gather(aget_object_or_404(Product, slug=slug), request.auser())
+    removed = await sync_to_async(remove_item)(request, product)
+    if request.headers.get('x-requested-with') == 'XMLHttpRequest':
+        return JsonResponse({
+            'success': removed,
+            'cart_count': (await aget_cart_summary(request)).count,
+        })
+    if removed:
         messages.info(request, f"Removed {product.name} from cart.")
     return redirect('cart')
 
-# Cart view: shows the contents of the user's cart (from session).
+# Cart view: shows the contents of the user's cart (from the database).
 @login_required
-def cart_view(request):
+async def cart_view(request):
     """
     Route: '/cart/'
-    Retrieves the cart from the session, fetches product objects and quantities, calculates subtotals and total.
+    Uses the per-request cart summary (the same one cart_summary returns), which is read from the
+    user's cached cart snapshot, so nothing is looked up while the snapshot is current.
     Passes cart_items and total to the template for display.
     """
-    cart = request.session.get('cart', {})
-    products = Product.objects.filter(id__in=cart.keys())
-    cart_items = []
-    total = Decimal('0.00')
-    for product in products:
-        quantity = cart.get(str(product.id), 0)
-        subtotal = product.price * quantity
-        total += subtotal
-        cart_items.append({
-            'product': product,
-            'quantity': quantity,
-            'subtotal': subtotal,
-        })
+    await _aprime_request(request)
+    summary = await aget_cart_summary(request)
     context = {
-        'cart_items': cart_items,
-        'total': total,
+        'cart_items': summary.items,
+        'total': summary.total,
     }
     return render(request, "shop/cart.html", context)
 
-# Checkout view: placeholder for future checkout logic.
+# Cart summary view: the navbar cart, which main.js loads separately so that pages stay the same for every cart.
+@never_cache
+async def cart_summary(request):
+    """
+    Route: '/cart/summary/'
+    Returns JSON with the cart's item count, total and items (name, quantity, subtotal, thumbnail and links).
+    Read from the cart snapshot, like cart_view.
+    """
+    request.user = await request.auser()
+    return JsonResponse(_cart_summary_json(await aget_cart_summary(request)))
+
+def _cart_summary_json(summary):
+    return {
+        'count': summary.count,
+        'total': str(summary.total),
+        'items': [
+            {
+                'name': item['name'],
+                'slug': item['slug'],
+                'quantity': item['quantity'],
+                'subtotal': str(item['subtotal']),
+                'thumbnail_url': item['thumbnail_url'],
+                'url': reverse('product_detail', args=[item['slug']]),
+                'remove_url': reverse('remove_from_cart', args=[item['slug']]),
+            }
+            for item in summary.items
+        ],
+    }
+
+# Cart batch view: applies several cart changes at once (main.js collects rapid clicks into one request).
+@require_POST
+async def cart_batch(request):
+    """
+    Route: '/cart/batch/'
+    Accepts JSON {"operations": [{"op": "add" | "remove" | "set", "slug": ... or "id": ..., "quantity": n}, ...]}
+    (see parse_cart_operations in shop/cart.py). All products are looked up with one query and the
+    operations are applied all or nothing. Returns the updated cart like cart_summary, or 400 with an
+    error (and the cart unchanged) if any operation is invalid, names an unknown product, or would take
+    a product over MAX_ITEM_QUANTITY.
+    """
+    request.user = await request.auser()
+    try:
+        data = json.loads(request.body.decode('utf-8'))
+    except ValueError:
+        data = None
+    try:
+        operations = parse_cart_operations(data.get('operations') if isinstance(data, dict) else None)
+        await sync_to_async(apply_cart_operations)(request, operations)
+    except CartOperationError as error:
+        return JsonResponse({'success': False, 'error': str(error)}, status=400)
+    return JsonResponse({'success': True, **_cart_summary_json(await aget_cart_summary(request))})
+
+# Checkout view: reviews the cart and places the order.
 @login_required
 def checkout_view(request):
     """
     Route: '/checkout/'
-    Shows the checkout page (not implemented in detail here).
+    GET shows the cart with a "Place order" form carrying a fresh checkout token.
+    POST places the order (see shop/checkout.py) and redirects to the dashboard, where it is listed.
+    Submitting the same form twice shows the order that was already placed.
     """
-    return render(request, "shop/checkout.html")
+    if request.method == "POST":
+        try:
+            order, created = place_order(request.user, request.POST.get('checkout_token', ''))
+        except CheckoutError as error:
+            messages.error(request, str(error))
+            return redirect('cart')
+        invalidate_cart_summary(request)
+        if created:
+            messages.success(request, f"Order #{order.pk} placed. Total: ${order.total}.")
+        else:
+            messages.info(request, f"Order #{order.pk} was already placed.")
+        return redirect('dashboard')
+    summary = get_cart_summary(request)
+    context = {
+        'cart_items': summary.items,
+        'total': summary.total,
+        'checkout_token': new_checkout_token(),
+    }
+    return render(request, "shop/checkout.html", context)
 
 # User registration view: handles new user sign up.
 def register_request(request):
@@ -237,45 +445,94 @@ def logout_request(request):
 def dashboard(request):
     """
     Route: '/dashboard/'
-    Shows the user dashboard page (requires authentication).
+    Shows the user dashboard page (requires authentication), with the user's most recent orders.
     """
-    return render(request, "shop/dashboard.html")
+    orders = Order.objects.filter(user=request.user).prefetch_related('lines')[:20]
+    return render(request, "shop/dashboard.html", {"orders": orders})
 
-# AJAX review submission view: handles review form via JavaScript fetch.
+# Profiling dashboard view: per-route request stats collected by the profiling middleware (staff only).
+@login_required
+@user_passes_test(is_admin_or_staff)
+def profiling_dashboard(request):
+    """
+    Route: '/staff/profiling/'
+    Flushes this process's pending stats, then shows every profiled route with its average time,
+    SQL time, template time and query count, slowest routes first, plus each route's slowest queries.
+    """
+    route_stats.flush()
+    stats = sorted(RouteStat.objects.all(), key=lambda stat: stat.avg_ms, reverse=True)
+    return render(request, "shop/profiling.html", {"stats": stats})
+
+# Helpers for the review JSON returned by submit_review and product_reviews.
+def _review_json(review):
+    """
+    Returns the JSON data main.js uses to render one review.
+    """
+    return {
+        'reviewer': review.user.username,
+        'rating': review.rating,
+        'comment': review.comment,
+        'created_at': review.created_at.strftime('%Y-%m-%d %H:%M'),
+    }
+
+def _reviews_url(product, cursor):
+    """
+    Returns the product_reviews URL for the page after `cursor`, or None if there is no next page.
+    """
+    if not cursor:
+        return None
+    return f"{reverse('product_reviews', args=[product.slug])}?after={cursor}"
+
+# Review feed view: older reviews for the product detail page, one page at a time.
+def product_reviews(request, slug):
+    """
+    Route: '/shop/<slug:slug>/reviews/'
+    Returns JSON with one page of the product's reviews (newest first), starting after ?after=,
+    and 'next_url' for the following page (null on the last page).
+    """
+    product = get_object_or_404(Product.objects.only('id', 'slug'), slug=slug)
+    reviews, next_cursor = review_page(product, request.GET.get('after'))
+    return JsonResponse({
+        'reviews': [_review_json(review) for review in reviews],
+        'next_url': _reviews_url(product, next_cursor),
+    })
+
+# AJAX review submission view: validates the review and queues it for the background writer.
 @require_POST
 @login_required
-def submit_review(request, slug):
+async def submit_review(request, slug):
     """
     Route: '/shop/<slug:slug>/review/'
     Accepts POST requests from the review form (AJAX/fetch).
-    Validates and saves the review, then returns JSON with the new review data.
-    Used by the JavaScript in detail.html to update the reviews list without reloading.
+    Validates the review and hands it to the write-behind queue (shop/review_queue.py), which saves it
+    and updates the product's rating aggregates in a batch shortly after. Returns 202 with the review
+    data as it will appear, so the JavaScript in detail.html can show it right away.
     """
-    if not request.user.is_authenticated:
+    user = await request.auser()
+    if not user.is_authenticated:
         return JsonResponse({'error': 'Authentication required.'}, status=403)
-    if request.method == 'POST':
-        try:
-            data = json.loads(request.body.decode('utf-8'))
-        except Exception:
-            data = request.POST
-        rating = data.get('rating')
-        comment = data.get('comment')
-        if not rating or not comment:
-            return JsonResponse({'error': 'Rating and comment are required.'}, status=400)
-        product = get_object_or_404(Product, slug=slug)
-        review = Review.objects.create(
-            user=request.user,
-            product=product,
-            rating=int(rating),
-            comment=comment
-        )
-        return JsonResponse({
-            'reviewer': review.user.username,
-            'rating': review.rating,
-            'comment': review.comment,
-            'created_at': review.created_at.strftime('%Y-%m-%d %H:%M'),
-        })
-    return JsonResponse({'error': 'Invalid request.'}, status=400)
+    try:
+        data = json.loads(request.body.decode('utf-8'))
+    except Exception:
+        data = request.POST
+    if not isinstance(data, dict):  # Valid JSON, but a list, number or string
+        return JsonResponse({'error': 'Send the review as a JSON object.'}, status=400)
+    rating = data.get('rating')
+    comment = data.get('comment')
+    if not rating or not comment:
+        return JsonResponse({'error': 'Rating and comment are required.'}, status=400)
+    if not isinstance(comment, str):
+        return JsonResponse({'error': 'The comment must be text.'}, status=400)
+    rating = validate_rating(rating)
+    if rating is None:
+        return JsonResponse({'error': 'Rating must be a whole number from 1 to 5.'}, status=400)
+    product_id = await Product.objects.filter(slug=slug).values_list('id', flat=True).afirst()
+    if product_id is None:
+        raise Http404("No product matches the given query.")
+    queued = await sync_to_async(enqueue_review)(user.pk, product_id, rating, comment)
+    return JsonResponse(_review_json(Review(
+        user=user, product_id=product_id, rating=rating, comment=comment, created_at=timezone.now(),
+    )), status=202 if queued else 200)
 
 # Add product view: allows only staff to add new products.
 @login_required
@@ -1,62 +1,255 @@
+// CSRF token for AJAX POSTs: the form's hidden input if it has one, otherwise the csrftoken cookie
+// (cached product cards are shared between visitors, so they carry no token of their own)
+function getCsrfToken(form) {
+  const input = (form || document).querySelector('[name=csrfmiddlewaretoken]');
+  if (input) return input.value;
+  const match = document.cookie.match(/(?:^|;\s*)csrftoken=([^;]+)/);
+  return match ? decodeURIComponent(match[1]) : '';
+}
+
+// Navbar cart: the pages are the same for every cart (so they can be cached and revalidated),
+// and the badge and dropdown are filled in here from the cart_summary JSON
+async function refreshCart() {
+  const menu = document.getElementById('cartMenu');
+  if (!menu) return;
+  const response = await fetch(menu.dataset.url, {headers: {'X-Requested-With': 'XMLHttpRequest'}});
+  if (response.ok) renderCart(await response.json());
+}
+
+function renderCart(cart) {
+  const menu = document.getElementById('cartMenu');
+  const badge = document.getElementById('cartBadge');
+  if (!menu) return;
+  badge.textContent = cart.count;
+  badge.style.display = cart.count ? '' : 'none';
+  menu.replaceChildren();
+  if (!cart.items.length) {
+    const empty = document.createElement('li');
+    empty.className = 'text-center text-muted';
+    empty.textContent = 'Your cart is empty.';
+    menu.appendChild(empty);
+    return;
+  }
+  cart.items.forEach(function(item) {
+    const row = document.createElement('li');
+    row.className = 'd-flex align-items-center mb-2';
+    const img = document.createElement('img');
+    img.src = item.thumbnail_url;
+    img.style.cssText = 'height: 50px; width: 50px; object-fit: cover;';
+    img.className = 'me-2 rounded';
+    const details = document.createElement('div');
+    details.className = 'flex-grow-1';
+    const link = document.createElement('a');
+    link.href = item.url;
+    link.className = 'text-decoration-none';
+    link.textContent = item.name;
+    const quantity = document.createElement('div');
+    quantity.className = 'small text-muted';
+    quantity.textContent = 'Qty: ' + item.quantity;
+    const subtotal = document.createElement('div');
+    subtotal.className = 'small';
+    subtotal.textContent = '$' + item.subtotal;
+    details.append(link, quantity, subtotal);
+    const remove = document.createElement('button');
+    remove.type = 'button';
+    remove.className = 'btn btn-sm btn-outline-danger ms-2 remove-from-cart';
+    remove.dataset.slug = item.slug;
+    remove.innerHTML = '&times;';
+    row.append(img, details, remove);
+    menu.appendChild(row);
+  });
+  const divider = document.createElement('li');
+  divider.innerHTML = '<hr class="dropdown-divider">';
+  const total = document.createElement('li');
+  total.className = 'd-flex justify-content-between align-items-center';
+  total.innerHTML = '<span><strong>Total:</strong></span><span><strong></strong></span>';
+  total.lastElementChild.firstElementChild.textContent = '$' + cart.total;
+  const actions = document.createElement('li');
+  actions.className = 'mt-2 text-center';
+  actions.innerHTML = '<a class="btn btn-primary btn-sm">View Cart</a><a class="btn btn-success btn-sm ms-2">Checkout</a>';
+  actions.children[0].href = menu.dataset.cartUrl;
+  actions.children[1].href = menu.dataset.checkoutUrl;
+  menu.append(divider, total, actions);
+}
+
+// Cart changes are collected for a moment and sent together to cart_batch, so a burst of
+// "Add to cart" clicks costs one request (and one cart write per product) instead of one per click
+const CART_BATCH_DELAY = 300;
+let pendingCartOperations = [];
+let cartBatchTimer = null;
+
+function queueCartOperation(operation) {
+  pendingCartOperations.push(operation);
+  clearTimeout(cartBatchTimer);
+  cartBatchTimer = setTimeout(sendCartOperations, CART_BATCH_DELAY);
+  // Show the change right away; the server's answer replaces it
+  const badge = document.getElementById('cartBadge');
+  if (badge && operation.op === 'add') {
+    badge.textContent = (parseInt(badge.textContent, 10) || 0) + operation.quantity;
+    badge.style.display = '';
+  }
+}
+
+async function sendCartOperations() {
+  const menu = document.getElementById('cartMenu');
+  const operations = pendingCartOperations;
+  pendingCartOperations = [];
+  if (!menu || !operations.length) return;
+  try {
+    const response = await fetch(menu.dataset.batchUrl, {
+      method: 'POST',
+      headers: {
+        'Content-Type': 'application/json',
+        'X-CSRFToken': getCsrfToken(),
+        'X-Requested-With': 'XMLHttpRequest',
+      },
+      body: JSON.stringify({operations: operations}),
+    });
+    const data = await response.json();
+    if (data.success) {
+      renderCart(data);
+      return;
+    }
+    showToast(data.error, 'alert-danger');
+  } catch (error) {
+    showToast('Your cart could not be updated. Please try again.', 'alert-danger');
+  }
+  refreshCart();  // Undo the optimistic badge
+}
+
+// Flush the batch when the visitor leaves the page before the timer fires
+window.addEventListener('pagehide', function() {
+  const menu = document.getElementById('cartMenu');
+  if (!menu || !pendingCartOperations.length) return;
+  clearTimeout(cartBatchTimer);
+  fetch(menu.dataset.batchUrl, {
+    method: 'POST',
+    keepalive: true,
+    headers: {
+      'Content-Type': 'application/json',
+      'X-CSRFToken': getCsrfToken(),
+      'X-Requested-With': 'XMLHttpRequest',
+    },
+    body: JSON.stringify({operations: pendingCartOperations}),
+  });
+  pendingCartOperations = [];
+});
+
+// Short-lived message at the top of the page
+function showToast(text, className) {
+  const msg = document.createElement('div');
+  msg.className = 'alert ' + className + ' position-fixed top-0 start-50 translate-middle-x mt-3 shadow';
+  msg.style.zIndex = 2000;
+  msg.textContent = text;
+  document.body.appendChild(msg);
+  setTimeout(() => msg.remove(), 1800);
+}
+
 // AJAX for Add to Cart (shop and detail pages)
 document.addEventListener('DOMContentLoaded', function() {
-  document.querySelectorAll('.add-to-cart-form').forEach(function(form) {
-    form.addEventListener('submit', async function(e) {
-      e.preventDefault();
-      const url = form.action;
-      const csrfToken = form.querySelector('[name=csrfmiddlewaretoken]').value;
-      const response = await fetch(url, {
-        method: 'POST',
-        headers: {
-          'X-CSRFToken': csrfToken,
-          'X-Requested-With': 'XMLHttpRequest',
-        },
-      });
-      const data = await response.json();
-      if (data.success) {
-        // Update cart count in navbar
-        const badge = document.querySelector('.navbar .badge.bg-danger');
-        if (badge) {
-          badge.textContent = data.cart_count;
-          badge.style.display = '';
+  // Delegated listeners, so cards appended later by infinite scroll work too.
+  // The detail page has a form; the cached product cards have a link to the product page instead.
+  function addToCart(e, element) {
+    e.preventDefault();
+    queueCartOperation({op: 'add', slug: element.dataset.slug, quantity: 1});
+    showToast('Added ' + element.dataset.name + ' to cart.', 'alert-success');
+  }
+  document.addEventListener('submit', function(e) {
+    const form = e.target.closest('.add-to-cart-form');
+    if (form) addToCart(e, form);
+  });
+  document.addEventListener('click', function(e) {
+    const link = e.target.closest('.add-to-cart-link');
+    // Modified clicks (new tab, new window) open the product page as usual
+    if (link && e.button === 0 && !(e.ctrlKey || e.metaKey || e.shiftKey || e.altKey)) addToCart(e, link);
+  });
+
+  // Infinite scroll on the shop page: fetch the next page of cards when the "Load more" link comes into view
+  const grid = document.getElementById('product-grid');
+  const loadMore = document.getElementById('load-more');
+  if (grid && loadMore && grid.dataset.nextUrl && 'IntersectionObserver' in window) {
+    let loading = false;
+    const observer = new IntersectionObserver(async function(entries) {
+      if (!entries[0].isIntersecting || loading || !grid.dataset.nextUrl) return;
+      loading = true;
+      try {
+        const response = await fetch(grid.dataset.nextUrl, {
+          headers: { 'X-Requested-With': 'XMLHttpRequest' },
+        });
+        if (!response.ok) return;
+        const data = await response.json();
+        grid.insertAdjacentHTML('beforeend', data.html);
+        grid.dataset.nextUrl = data.next_url || '';
+        if (!data.next_url) {
+          observer.disconnect();
+          loadMore.parentElement.remove();
         } else {
-          // If badge doesn't exist, create it
-          const cartLink = document.querySelector('#cartDropdown');
-          if (cartLink) {
-            const newBadge = document.createElement('span');
-            newBadge.className = 'badge bg-danger';
-            newBadge.textContent = data.cart_count;
-            cartLink.appendChild(newBadge);
-          }
+          // Re-observe so a link that is still on screen triggers the next page too
+          observer.unobserve(loadMore);
+          observer.observe(loadMore);
         }
-        // Update quantity in cart dropdown if present
-        const productName = form.closest('.card')?.querySelector('.card-title')?.textContent?.trim();
-        if (productName) {
-          document.querySelectorAll('.dropdown-menu[aria-labelledby="cartDropdown"] .d-flex.align-items-center.mb-2').forEach(function(item) {
-            const nameLink = item.querySelector('a.text-decoration-none');
-            if (nameLink && nameLink.textContent.trim() === productName) {
-              // Find the quantity div and update it
-              const qtyDiv = item.querySelector('.small.text-muted');
-              if (qtyDiv) {
-                // Extract the number and increment
-                const match = qtyDiv.textContent.match(/Qty: (\d+)/);
-                if (match) {
-                  qtyDiv.textContent = 'Qty: ' + (parseInt(match[1]) + 1);
-                }
-              }
-            }
-          });
+      } finally {
+        loading = false;
+      }
+    }, { rootMargin: '600px' });
+    observer.observe(loadMore);
+  }
+
+  // Shop filters: reload the page as soon as a category, price or rating option changes.
+  // Empty values (e.g. "Any rating") are left out of the URL.
+  const facetForm = document.getElementById('facet-form');
+  if (facetForm) {
+    facetForm.addEventListener('change', function() {
+      const params = new URLSearchParams();
+      new FormData(facetForm).forEach((value, name) => { if (value) params.append(name, value); });
+      window.location.search = params.toString();
+    });
+  }
+
+  // Builds the element for one review from the JSON returned by submit_review / product_reviews
+  function renderReview(data) {
+    const review = document.createElement('div');
+    review.className = 'border rounded p-2 mb-3';
+    // Show stars for the rating
+    let stars = '';
+    for (let i = 1; i <= 5; i++) {
+      stars += i <= data.rating ? '★' : '☆';
+    }
+    const reviewer = document.createElement('strong');
+    reviewer.textContent = data.reviewer;
+    const rating = document.createElement('span');
+    rating.textContent = stars;
+    const date = document.createElement('span');
+    date.className = 'text-muted';
+    date.textContent = `(${data.created_at})`;
+    const comment = document.createElement('div');
+    comment.textContent = data.comment;
+    review.append(reviewer, ' - ', rating, ' ', date, comment);
+    return review;
+  }
+
+  // Load older reviews (detail page), one page per click
+  const moreReviews = document.getElementById('load-more-reviews');
+  if (moreReviews) {
+    moreReviews.addEventListener('click', async function() {
+      moreReviews.disabled = true;
+      const response = await fetch(moreReviews.dataset.url, {
+        headers: { 'X-Requested-With': 'XMLHttpRequest' },
+      });
+      if (response.ok) {
+        const data = await response.json();
+        const reviewsDiv = document.getElementById('reviews');
+        data.reviews.forEach(review => reviewsDiv.append(renderReview(review)));
+        if (data.next_url) {
+          moreReviews.dataset.url = data.next_url;
+        } else {
+          moreReviews.remove();
+          return;
         }
-        // Show a temporary success message
-        let msg = document.createElement('div');
-        msg.className = 'alert alert-success position-fixed top-0 start-50 translate-middle-x mt-3 shadow';
-        msg.style.zIndex = 2000;
-        msg.textContent = data.message;
-        document.body.appendChild(msg);
-        setTimeout(() => msg.remove(), 1800);
       }
+      moreReviews.disabled = false;
     });
-  });
+  }
 
   // AJAX for review form (detail page)
   const form = document.getElementById('review-form');
@@ -78,15 +271,7 @@ document.addEventListener('DOMContentLoaded', function() {
       const data = await response.json();
       if (response.ok) {
         const reviewsDiv = document.getElementById('reviews');
-        const newReview = document.createElement('div');
-        newReview.className = 'border rounded p-2 mb-3';
-        // Show stars for the rating
-        let stars = '';
-        for (let i = 1; i <= 5; i++) {
-          stars += i <= data.rating ? '★' : '☆';
-        }
-        newReview.innerHTML = `<strong>${data.reviewer}</strong> - <span>${stars}</span> <span class='text-muted'>(${data.created_at})</span><div>${data.comment}</div>`;
-        reviewsDiv.prepend(newReview);
+        reviewsDiv.prepend(renderReview(data));
         form.reset();
       } else {
         alert(data.error || 'Error submitting review.');
@@ -94,29 +279,46 @@ document.addEventListener('DOMContentLoaded', function() {
     });
   }
 
-  // AJAX remove from cart in dropdown
-  document.querySelectorAll('.remove-from-cart').forEach(function(button) {
-    button.addEventListener('click', function(e) {
-      e.preventDefault();
-      const url = this.dataset.url;
-      const csrfToken = document.querySelector('[name=csrfmiddlewaretoken]') ? document.querySelector('[name=csrfmiddlewaretoken]').value : '';
-      fetch(url, {
-        method: 'POST',
-        headers: {
-          'X-CSRFToken': csrfToken,
-          'X-Requested-With': 'XMLHttpRequest',
-        },
-      })
-      .then(res => res.json())
-      .then(data => {
-        if (data.success) {
-          // Remove the item from the DOM
-          this.closest('li').remove();
-          // Update cart count
-          const badge = document.querySelector('.navbar .badge.bg-danger');
-          if (badge) badge.textContent = data.cart_count;
-        }
-      });
+  // Search suggestions in the navbar: debounced calls to the autocomplete endpoint
+  const searchInput = document.getElementById('search-input');
+  if (searchInput) {
+    const suggestions = document.getElementById('search-suggestions');
+    let searchTimer = null;
+    let suggestionUrls = {};
+    searchInput.addEventListener('input', function() {
+      clearTimeout(searchTimer);
+      const query = searchInput.value.trim();
+      // Picking a suggestion from the list goes straight to that product
+      if (suggestionUrls[query]) {
+        window.location.href = suggestionUrls[query];
+        return;
+      }
+      if (query.length < 2) return;
+      searchTimer = setTimeout(async function() {
+        const url = searchInput.dataset.autocompleteUrl + '?q=' + encodeURIComponent(query);
+        const response = await fetch(url, { headers: { 'X-Requested-With': 'XMLHttpRequest' } });
+        if (!response.ok) return;
+        const data = await response.json();
+        suggestionUrls = {};
+        suggestions.replaceChildren(...data.suggestions.map(function(item) {
+          suggestionUrls[item.name] = item.url;
+          const option = document.createElement('option');
+          option.value = item.name;
+          return option;
+        }));
+      }, 150);
     });
+  }
+
+  // Remove from cart in the dropdown (delegated: the items are rebuilt by renderCart)
+  document.addEventListener('click', function(e) {
+    const button = e.target.closest('.remove-from-cart');
+    if (!button) return;
+    e.preventDefault();
+    e.stopPropagation();  // Keep the dropdown open
+    button.closest('li').remove();
+    queueCartOperation({op: 'remove', slug: button.dataset.slug});
   });
+
+  refreshCart();
 }); 
\ No newline at end of file